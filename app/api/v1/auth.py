@@ -46,7 +46,7 @@ async def check_user(request: CheckUserRequest):
     mobile = request.mobile
     
     # 1. Check if user exists
-    user = user_service.get_user_by_mobile(mobile)
+    user = await user_service.get_user_by_mobile(mobile)
     
     if user:
         # Extract requested fields
@@ -68,7 +68,7 @@ async def check_user(request: CheckUserRequest):
         return {"status": "existing_user", "data": response_data}
     
     # 2. If not, create new user
-    new_user = user_service.create_user(mobile)
+    new_user = await user_service.create_user(mobile)
     
     # Return formatted info for new user too (fields will be empty/placeholder)
     return {
@@ -1,7 +1,6 @@
 from fastapi import APIRouter, HTTPException
-from app.api.v1.style import OutfitRequest
-from app.services.appwrite_storage import get_file_bytes
-from app.core.config import settings
+from fastapi.responses import StreamingResponse
+from app.api.v1.style import OutfitRequest, collect_outfit, sse_event, SSE_HEADERS
 from app.services.color_scoring_service import ColorScoringService
 
 router = APIRouter()
@@ -13,34 +12,15 @@ async def color_score_outfit(request: OutfitRequest):
     Score outfit specifically against the Dictionary of Colour Combinations.
     Uses 'pure' Gemini analysis with the full dictionary loaded.
     """
-    outfit_images = {}
-    outfit_metadata = {}
-    
-    items = {
-        "top": request.top,
-        "bottom": request.bottom,
-        "layer": request.layer
-    }
-    
-    # 1. Fetch Images & Metadata (Reused logic, could be refactored to shared utility)
-    for category, item in items.items():
-        if item and item.image_id:
-            outfit_metadata[category] = item.dict(exclude={"image_url", "image_id"})
-            
-            bucket_id = settings.APPWRITE_WARDROBE_BUCKET_ID
-            if bucket_id:
-                img_bytes = get_file_bytes(bucket_id, item.image_id)
-                if img_bytes:
-                    outfit_images[category] = img_bytes
-        elif item:
-             outfit_metadata[category] = item.dict(exclude={"image_url", "image_id"})
+    # 1. Fetch Images & Metadata (shared with /style/score)
+    outfit_images, outfit_metadata = await collect_outfit(request)
 
     if not outfit_images:
         raise HTTPException(status_code=400, detail="No images could be retrieved.")
 
     # 2. Analyze Colors
     try:
-        result = color_service.analyze_outfit_with_palette(
+        result = await color_service.analyze_outfit_with_palette(
             outfit_images, 
             outfit_metadata, 
             target_mood=request.mood
@@ -57,3 +37,30 @@ async def color_score_outfit(request: OutfitRequest):
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/color-score/stream")
+async def color_score_outfit_stream(request: OutfitRequest):
+    """
+    Server-sent-event variant of /color-score.
+    Events: images_fetched, rag_context, partial (fields as they complete), result, error.
+    """
+    outfit_images, outfit_metadata = await collect_outfit(request)
+
+    if not outfit_images:
+        raise HTTPException(status_code=400, detail="No images could be retrieved.")
+
+    async def event_stream():
+        yield sse_event("images_fetched", {"categories": list(outfit_images.keys())})
+        try:
+            async for event, data in color_service.stream_outfit_with_palette(
+                outfit_images, 
+                outfit_metadata, 
+                target_mood=request.mood
+            ):
+                yield sse_event(event, data)
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
@@ -1,164 +1,109 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Response
 from PIL import Image, ImageOps
 import io
 
 router = APIRouter()
 
-MAX_FILE_SIZE = 10 * 1024 * 1024 # 10MB limit
+from app.core.config import settings
+
+MAX_FILE_SIZE = settings.UPLOAD_MAX_FILE_BYTES # 10MB limit
+# Multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
 
 from app.services.appwrite_storage import upload_image_from_bytes
-from app.services.wardrobe_service import wardrobe_service
+from app.services.wardrobe_service import wardrobe_service, analysis_to_updates
+from app.services.analysis_queue import analysis_queue
+from app.services.upload_pipeline import run_upload, UploadError, StageTimings
+from app.services.upload_dedup import compute_hashes, upload_hash_index
+from app.services.upload_io import SpooledUpload, UploadTooLarge
 from app.services.user_service import user_service
-from app.core.config import settings
 import os
 from fastapi import Form
 from starlette.concurrency import run_in_threadpool
-import functools
+from typing import List
+import asyncio
+
+def item_analysis_status(item: dict) -> str:
+    """Analysis status of an existing wardrobe item (e.g. an exact dedup hit)."""
+    job = analysis_queue.get(item["$id"])
+    if job:
+        return job["status"]
+    # Not tracked by this process: infer from the document
+    return "completed" if item.get("general_category") != "Uncategorized" else "unknown"
 
 @router.post("/upload-garment")
 async def upload_garment(
+    response: Response,
     file: UploadFile = File(...),
     user_id: str = Form(...),
-    mobile: str = Form(...)
+    mobile: str = Form(...),
+    wait_for_analysis: bool = Form(False)
 ):
-    # 1. Validate File Size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail="File too large")
+    timings = StageTimings()
+
+    # 1. Map the spooled upload (oversized bodies were already rejected by BodySizeLimitMiddleware)
+    async with timings.stage("read"):
+        try:
+            upload = await SpooledUpload.read(file, MAX_FILE_SIZE)
+        except UploadTooLarge:
+            raise HTTPException(status_code=413, detail="File too large")
+    # Zero-copy view shared by hashing, storage upload and analysis
+    contents = upload.view()
+    upload.close()
         
     try:
-        # 3. Direct Memory Upload via Threadpool
         # (Client handles processing, so we upload raw bytes)
         wardrobe_bucket = settings.APPWRITE_WARDROBE_BUCKET_ID
         if not wardrobe_bucket:
              raise HTTPException(status_code=500, detail="Wardrobe bucket configuration missing")
         
-        # We must wrap the blocking call
-        filename = f"{user_id}_{os.urandom(4).hex()}.jpg"
-        
-        # Create a partial function to pass arguments
-        upload_func = functools.partial(
-            upload_image_from_bytes, 
-            image_data=contents, 
-            filename=filename, 
-            bucket_id=wardrobe_bucket
-        )
-        
-        # Run in threadpool to avoid blocking event loop
-        import time
-        upload_start = time.time()
-        print("--> Starting Image Upload to Appwrite Storage...")
-        
-        image_id = await run_in_threadpool(upload_func)
-        
-        upload_duration = time.time() - upload_start
-        print(f"--> Image Upload took {upload_duration:.2f} seconds")
-        
-        if not image_id:
-            raise HTTPException(status_code=500, detail="Failed to upload image to storage")
-        
-        # Encapsulate logic for URL construction
-        # Use Proxy URL (Version agnostic)
-        image_url = f"/proxy/images/{wardrobe_bucket}/{image_id}"
-
-        # 5. Create Wardrobe Item in DB
-        wardrobe_item = wardrobe_service.create_wardrobe_item(
-            user_id=user_id,
-            image_id=image_id,
-            image_url=image_url,
-            category="Uncategorized" # Can be updated later by AI analysis
-        )
-        wardrobe_id = wardrobe_item["$id"]
-        
-        # 6. Update User's wardrobe_id_list
-        success = user_service.add_wardrobe_item(user_id, wardrobe_id)
-        if not success:
-             # Should we rollback? For now just log error, but image/wardrobe item exists
-             print(f"Failed to link wardrobe {wardrobe_id} to user {user_id}")
-        
+        # 2. Deduplicate against the user's previous uploads
+        hashes, duplicate, dedup_match = None, None, None
+        if settings.UPLOAD_DEDUP_ENABLED:
+            async with timings.stage("dedup"):
+                hashes = await run_in_threadpool(compute_hashes, contents, upload.content_hash)
+                duplicate, dedup_match = await upload_hash_index.find(user_id, hashes)
 
-        
-        # 7. Auto-Analyze with Gemini (As requested: call and log time)
-        import time
-        from app.services.gemini_service import gemini_service
-        
-        print("--> Starting Gemini Analysis for uploaded item...")
-        start_time = time.time()
-        
+        if dedup_match == "exact":
+            # Identical bytes: hand back the existing item, no storage or LLM call
+            response.headers["Server-Timing"] = timings.server_timing()
+            analysis_status = item_analysis_status(duplicate)
+            return {
+                "status": "success",
+                "message": "Garment already in wardrobe",
+                "deduplicated": True,
+                "dedup_match": dedup_match,
+                "data": {
+                    "wardrobe_id": duplicate["$id"],
+                    "image_id": duplicate.get("image_id"),
+                    "image_url": duplicate.get("image_url"),
+                    "user_id": user_id,
+                    "caption": duplicate.get("caption") or "",
+                    "specific_category": duplicate.get("specific_category") or "",
+                    "general_category": duplicate.get("general_category") or "Uncategorized",
+                    "custom_category": duplicate.get("custom_category") or "",
+                    "tags": duplicate.get("tags") or "",
+                    "colors": duplicate.get("colors") or [],
+                    "analysis_status": analysis_status
+                }
+            }
+
+        # 3. Storage upload, DB writes and analysis queueing (concurrent where independent)
+        # A near-duplicate (perceptual match) is stored but reuses the matched item's analysis
         try:
-            # Wrap blocking Gemini call
-            analyze_func = functools.partial(gemini_service.analyze_image, image_data=contents)
-            # await execute in threadpool
-            analysis_result = await run_in_threadpool(analyze_func)
-            
-            duration = time.time() - start_time
-            print(f"--> Gemini Analysis took {duration:.2f} seconds")
-            print(f"--> Analysis Result: {analysis_result}")
-            
-            # 8. Save Analysis to Wardrobe Item
-            if analysis_result:
-                updates = {}
-                
-                # Map 'summary' -> 'caption'
-                if "summary" in analysis_result:
-                    updates["caption"] = analysis_result["summary"]
-                
-                # Check for items
-                if "items" in analysis_result and len(analysis_result["items"]) > 0:
-                    first_item = analysis_result["items"][0]
-                    
-                    # Map 'item_name' -> 'specific_category'
-                    if "item_name" in first_item:
-                         updates["specific_category"] = first_item["item_name"]
-                    
-                    # Map 'category' -> 'general_category' (Update existing)
-                    if "category" in first_item:
-                         updates["general_category"] = first_item["category"]
-                         
-                    # Map 'tags' -> 'tags' (Convert list to JSON string or use Appwrite array if configured. 
-                    # Script said array=False for 'tags' in Wardrobe? Let me check schema script.)
-                    # Checking wardrobe.py: create_string_attribute(..., "tags", 128, required=False) -> It is NOT an array in the script!
-                    # "tags" is a string attribute (128 chars). So we must join them.
-                    if "tags" in first_item and isinstance(first_item["tags"], list):
-                         updates["tags"] = ",".join(first_item["tags"])
-                    
-                    # Map 'color' -> 'colors' (Wardrobe has 'colors' as array=True)
-                    if "color" in first_item:
-                        updates["colors"] = [first_item["color"]]
-
-                    # Map 'custom_category' -> 'custom_category'
-                    if "custom_category" in first_item:
-                        c_cat = first_item["custom_category"]
-                        updates["custom_category"] = c_cat
-                        
-                        # FORCE general_category = "top" for specific custom categories
-                        if c_cat in ["tops", "shirts", "Layer", "active", "ethnic"]:
-                             updates["general_category"] = "top"
-                        
-                        # FORCE general_category = "bottom" for bottom categories
-                        elif c_cat in ["jeans", "trousers", "skirts", "shorts", "ethnic_bottoms", "active_lounge"]:
-                             updates["general_category"] = "bottom"
-                        
-                        # FORCE general_category = "dress" for dresses/rompers
-                        elif c_cat in ["oomph", "gown", "Romps"]:
-                             updates["general_category"] = "dress"
-                        
-                        # FORCE general_category = "footwear" for footwear
-                        elif c_cat in ["heels", "shoes", "sandals"]:
-                             updates["general_category"] = "footwear"
-                        
-                        # FORCE general_category = "bag" for bags
-                        elif c_cat == "bags":
-                             updates["general_category"] = "bag"
-                
-                if updates:
-                    print(f"--> Updating Wardrobe Item {wardrobe_id} with AI logic...")
-                    wardrobe_service.update_wardrobe_item(wardrobe_id, updates)
+            uploaded = await run_upload(user_id, contents, wardrobe_bucket, timings, hashes=hashes, clone_from=duplicate)
+        except UploadError as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
-        except Exception as e:
-            print(f"--> Auto-Analysis Failed: {e}")
-            # Do not fail the upload request if analysis fails
-            pass 
+        wardrobe_id = uploaded["wardrobe_id"]
+        image_id = uploaded["image_id"]
+        image_url = uploaded["image_url"]
+        job = uploaded["job"]
+
+        # 4. Analysis runs in the background; poll /analysis/{wardrobe_id}
+        if wait_for_analysis and not duplicate:
+            # Opt-in for clients that still expect the analyzed item in the response
+            job = await analysis_queue.wait(wardrobe_id, timeout=settings.ANALYSIS_WAIT_TIMEOUT_SECONDS)
             
         # Prepare final response data 
         # User requested to match the Wardrobe table structure (flattened)
@@ -173,19 +118,23 @@ async def upload_garment(
              "general_category": "Uncategorized",
              "custom_category": "",
              "tags": "",
-             "colors": []
+             "colors": [],
+             "analysis_status": job["status"]
         }
 
         # Merge updates if available
-        if analysis_result and updates:
-             response_data.update(updates)
+        if job["status"] == "completed" and job["updates"]:
+             response_data.update(job["updates"])
         
         final_response = {
             "status": "success", 
-            "message": "Garment uploaded, analyzed, and saved to wardrobe",
+            "message": "Garment uploaded and saved to wardrobe, analysis " + job["status"],
+            "deduplicated": duplicate is not None,
+            "dedup_match": dedup_match,
             "data": response_data
         }
         
+        response.headers["Server-Timing"] = timings.server_timing()
         print(f"--> Sending Response: {final_response}")
         return final_response
 
@@ -195,6 +144,157 @@ async def upload_garment(
         print(f"Upload Error: {e}")
         raise HTTPException(status_code=400, detail="Invalid image file or processing error")
 
+@router.post("/upload-batch")
+async def upload_garment_batch(
+    response: Response,
+    files: List[UploadFile] = File(...),
+    user_id: str = Form(...),
+    mobile: str = Form(...)
+):
+    """
+    Bulk onboarding: many garments in one multipart request.
+    Files go through the same pipeline as /upload-garment with bounded
+    concurrency; the user's wardrobe_id_list is updated once at the end.
+    Returns one result per file (in request order); analysis runs in the background.
+    """
+    if len(files) > settings.UPLOAD_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Too many files (max {settings.UPLOAD_BATCH_MAX_FILES})")
+
+    wardrobe_bucket = settings.APPWRITE_WARDROBE_BUCKET_ID
+    if not wardrobe_bucket:
+        raise HTTPException(status_code=500, detail="Wardrobe bucket configuration missing")
+
+    batch_timings = StageTimings()
+    semaphore = asyncio.Semaphore(settings.UPLOAD_BATCH_CONCURRENCY)
+    # content hash -> future of the first file with those bytes, so repeats within the batch are stored once
+    in_batch = {}
+
+    async def process(file: UploadFile) -> dict:
+        # One file's failure is reported in its entry; it never fails the
+        # batch after other files were already stored
+        try:
+            return await process_file(file)
+        except Exception as e:
+            print(f"Batch Upload Error ({file.filename}): {e}")
+            return {"filename": file.filename, "status": "failed", "error": "Invalid image file or processing error"}
+
+    async def process_file(file: UploadFile) -> dict:
+        result = {"filename": file.filename}
+        async with semaphore:
+            timings = StageTimings()
+            try:
+                upload = await SpooledUpload.read(file, MAX_FILE_SIZE)
+            except UploadTooLarge:
+                return dict(result, status="failed", error="File too large")
+            contents = upload.view()
+            upload.close()
+
+            first = in_batch.get(upload.content_hash)
+            if first is not None:
+                original = await first
+                if original.get("status") != "success":
+                    return dict(result, status="failed", error=original.get("error"))
+                return dict(result, **{k: original[k] for k in ("wardrobe_id", "image_id", "image_url", "analysis_status")},
+                            status="success", deduplicated=True, dedup_match="exact")
+            done = asyncio.get_running_loop().create_future()
+            in_batch[upload.content_hash] = done
+
+            try:
+                hashes, duplicate, dedup_match = None, None, None
+                if settings.UPLOAD_DEDUP_ENABLED:
+                    async with timings.stage("dedup"):
+                        hashes = await run_in_threadpool(compute_hashes, contents, upload.content_hash)
+                        duplicate, dedup_match = await upload_hash_index.find(user_id, hashes)
+
+                if dedup_match == "exact":
+                    result.update(
+                        status="success",
+                        wardrobe_id=duplicate["$id"],
+                        image_id=duplicate.get("image_id"),
+                        image_url=duplicate.get("image_url"),
+                        analysis_status=item_analysis_status(duplicate),
+                        deduplicated=True,
+                        dedup_match=dedup_match,
+                        linked=True
+                    )
+                else:
+                    # The user document is updated once for the whole batch below
+                    uploaded = await run_upload(user_id, contents, wardrobe_bucket, timings, link_user=False, hashes=hashes, clone_from=duplicate)
+                    result.update(
+                        status="success",
+                        wardrobe_id=uploaded["wardrobe_id"],
+                        image_id=uploaded["image_id"],
+                        image_url=uploaded["image_url"],
+                        analysis_status=uploaded["job"]["status"],
+                        deduplicated=duplicate is not None,
+                        dedup_match=dedup_match,
+                        linked=False
+                    )
+            except Exception as e:
+                print(f"Batch Upload Error ({file.filename}): {e}")
+                result.update(status="failed", error=str(e) if isinstance(e, UploadError) else "Invalid image file or processing error")
+            finally:
+                # Later copies of these bytes wait on this future
+                if not done.done():
+                    done.set_result(result if "status" in result else dict(result, status="failed", error="Upload interrupted"))
+            return result
+
+    async with batch_timings.stage("files"):
+        results = await asyncio.gather(*(process(file) for file in files))
+
+    new_ids = [r["wardrobe_id"] for r in results if r["status"] == "success" and not r.pop("linked", True)]
+    linked = True
+    if new_ids:
+        async with batch_timings.stage("link_user"):
+            linked = await user_service.add_wardrobe_items(user_id, new_ids)
+        if not linked:
+            # Items and images exist but are not in the user's list; reported via "linked"
+            print(f"Failed to link {len(new_ids)} wardrobe items to user {user_id}")
+
+    for r in results:
+        r.pop("linked", None)
+    uploaded = sum(1 for r in results if r["status"] == "success")
+    response.headers["Server-Timing"] = batch_timings.server_timing()
+    return {
+        "status": "success" if uploaded == len(results) else ("partial" if uploaded else "failed"),
+        "uploaded": uploaded,
+        "failed": len(results) - uploaded,
+        "linked": linked,
+        "results": results
+    }
+
+@router.get("/analysis/{wardrobe_id}")
+async def get_analysis_status(wardrobe_id: str, wait: float = 0):
+    """
+    Status of the background analysis for an uploaded garment.
+    `wait` (seconds) long-polls until the job finishes or the wait expires.
+    """
+    wait = min(max(wait, 0), settings.ANALYSIS_WAIT_TIMEOUT_SECONDS)
+    job = await analysis_queue.wait(wardrobe_id, timeout=wait)
+
+    if job is None:
+        # Not tracked by this process (e.g. after a restart): infer from the document
+        try:
+            item = await wardrobe_service.db.get_document(wardrobe_service.db_id, wardrobe_service.coll_id, wardrobe_id)
+        except Exception:
+            raise HTTPException(status_code=404, detail="Wardrobe item not found")
+        return {
+            "status": "success",
+            "data": {"wardrobe_id": wardrobe_id, "analysis_status": item_analysis_status(item)}
+        }
+
+    return {
+        "status": "success",
+        "data": {
+            "wardrobe_id": wardrobe_id,
+            "analysis_status": job["status"],
+            "attempts": job["attempts"],
+            "provider": job["provider"],
+            "error": job["error"],
+            "updates": job["updates"] or {}
+        }
+    }
+
 from app.services.gemini_service import gemini_service
 from typing import Optional
 
@@ -202,28 +302,108 @@ from typing import Optional
 async def analyze_garment_image(
     file: UploadFile = File(...),
     # provider param is deprecated but kept for compatibility if needed, 
-    # effectively ignored as we strictly use Gemini now.
+    # effectively ignored: the vision router picks the provider.
     provider: str = "gemini" 
 ):
     """
-    Analyze garment image to identify clothing items using Gemini.
+    Analyze garment image to identify clothing items (Gemini, hedged to Moondream).
     """
-    # 1. Read content
-    contents = await file.read()
+    from app.services.vision_router import vision_router
+
+    # 1. Map the spooled upload (size-limited)
+    try:
+        upload = await SpooledUpload.read(file, MAX_FILE_SIZE)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large")
+    contents = upload.view()
+    upload.close()
         
-    # 4. Analyze using Gemini
+    # 4. Analyze
     try:
-        # We process exclusively with Gemini now
-        gemini_result = gemini_service.analyze_image(image_data=contents)
-        print(f"--- Gemini Result ---\n{gemini_result}\n---------------------")
+        analysis_result, used_provider = await vision_router.analyze(contents)
+        print(f"--- {used_provider} Result ---\n{analysis_result}\n---------------------")
         
         # Return standard format expecting by client (list of items)
         return {
             "status": "success", 
-            "items": gemini_result, 
-            "provider": "gemini"
+            "items": analysis_result, 
+            "provider": used_provider
         }
 
     except Exception as e:
         print(f"Analysis Error: {e}")
         return {"status": "error", "message": "Failed to analyze image", "items": []}
+
+from pydantic import BaseModel
+from typing import List
+import asyncio
+from app.services.appwrite_storage import get_file_bytes
+
+class BatchAnalyzeRequest(BaseModel):
+    user_id: str
+    # Defaults to every item that is still "Uncategorized"
+    wardrobe_ids: Optional[List[str]] = None
+    apply: bool = True
+
+@router.post("/analyze-batch")
+async def analyze_wardrobe_batch(request: BatchAnalyzeRequest):
+    """
+    Bulk onboarding: analyze many wardrobe items with batched Gemini calls
+    and (optionally) save the results to each wardrobe item.
+    """
+    wardrobe_bucket = settings.APPWRITE_WARDROBE_BUCKET_ID
+    if not wardrobe_bucket:
+        raise HTTPException(status_code=500, detail="Wardrobe bucket configuration missing")
+
+    items = await wardrobe_service.get_user_wardrobe(request.user_id)
+    if request.wardrobe_ids is not None:
+        wanted = set(request.wardrobe_ids)
+        items = [item for item in items if item["$id"] in wanted]
+    else:
+        items = [item for item in items if item.get("general_category") == "Uncategorized"]
+
+    results = {}
+    if request.wardrobe_ids is not None:
+        found = {item["$id"] for item in items}
+        for wardrobe_id in request.wardrobe_ids:
+            if wardrobe_id not in found:
+                results[wardrobe_id] = {"status": "not_found"}
+
+    items = [item for item in items if item.get("image_id")]
+    downloads = await asyncio.gather(
+        *(get_file_bytes(wardrobe_bucket, item["image_id"]) for item in items)
+    )
+
+    images = {}
+    for item, image_bytes in zip(items, downloads):
+        if image_bytes:
+            images[item["$id"]] = image_bytes
+        else:
+            results[item["$id"]] = {"status": "failed", "message": "Image could not be downloaded"}
+
+    import time
+    start_time = time.time()
+    print(f"--> Starting batch Gemini Analysis for {len(images)} items...")
+    analyses = await gemini_service.analyze_images(images)
+    print(f"--> Batch Gemini Analysis took {time.time() - start_time:.2f} seconds")
+
+    async def save(wardrobe_id: str, analysis: dict):
+        updates = analysis_to_updates(analysis)
+        if request.apply and updates:
+            saved = await wardrobe_service.update_wardrobe_item(wardrobe_id, updates)
+            if not saved:
+                return {"status": "failed", "message": "Failed to save analysis", "updates": updates}
+        return {"status": "analyzed", "updates": updates}
+
+    analyzed = {wardrobe_id: analysis for wardrobe_id, analysis in analyses.items() if analysis}
+    saved = await asyncio.gather(*(save(wardrobe_id, analysis) for wardrobe_id, analysis in analyzed.items()))
+    results.update(zip(analyzed.keys(), saved))
+    for wardrobe_id, analysis in analyses.items():
+        if not analysis:
+            results[wardrobe_id] = {"status": "failed", "message": "Analysis failed"}
+
+    return {
+        "status": "success",
+        "analyzed": sum(1 for r in results.values() if r["status"] == "analyzed"),
+        "results": results
+    }
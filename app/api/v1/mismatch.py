@@ -1,5 +1,8 @@
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel
+from typing import List, Optional
+from app.core.responses import FastJSONResponse
+from app.schemas.wardrobe import WardrobeItemsResponse, resolve_fields, wardrobe_item_view
 from app.services.wardrobe_service import wardrobe_service
 
 router = APIRouter()
@@ -7,8 +10,12 @@ router = APIRouter()
 class MismatchFetchRequest(BaseModel):
     user_id: str
     mobile: str
+    # Optional derivative for image_url ("thumb", "medium"); originals by default
+    image_size: Optional[str] = None
+    # Subset of WardrobeItem fields to return ($id is always included); all by default
+    fields: Optional[List[str]] = None
 
-@router.post("/items")
+@router.post("/items", response_model=None, responses={200: {"model": WardrobeItemsResponse}})
 async def get_mismatch_items(request: MismatchFetchRequest):
     """
     Fetch all wardrobe items for the Mismatch feature.
@@ -17,25 +24,20 @@ async def get_mismatch_items(request: MismatchFetchRequest):
     
     from app.core.config import settings
 
+    try:
+        fields = resolve_fields(request.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # Reuse Wardrobe Service to fetch items
-    items = wardrobe_service.get_user_wardrobe(request.user_id)
+    items = await wardrobe_service.get_user_wardrobe(request.user_id)
     
     # Enrich items with Image URL (path only)
-    project_id = settings.APPWRITE_PROJECT_ID
     bucket_id = settings.APPWRITE_WARDROBE_BUCKET_ID
-    
-    enriched_items = []
-    for item in items:
-        image_id = item.get("image_id")
-        if image_id:
-            # Construct Proxy URL
-            item["image_url"] = f"/proxy/images/{bucket_id}/{image_id}"
-        else:
-            item["image_url"] = None
-        enriched_items.append(item)
+    enriched_items = [wardrobe_item_view(item, bucket_id, request.image_size, fields) for item in items]
     
     print(f"--> Sending back {len(enriched_items)} mismatch items for user {request.user_id}")
-    return {
+    return FastJSONResponse({
         "status": "success",
         "data": enriched_items
-    }
+    })
@@ -1,7 +1,16 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import asyncio
+import time
 import httpx
 from app.core.config import settings
+from app.services.image_derivatives import derivative_file_id
+from app.services.proxy_cache import proxy_cache, etag_matches, entity_tag, cache_key
+from app.services.image_resize import image_resizer, negotiate_format
+from app.services.image_urls import verify_signature
 
 router = APIRouter()
 
@@ -9,38 +18,400 @@ router = APIRouter()
 # Limits: 100 connections max, 30s timeout
 proxy_client = httpx.AsyncClient(limits=httpx.Limits(max_keepalive_connections=20, max_connections=100), timeout=30.0)
 
-@router.get("/images/{bucket_id}/{file_id}")
-async def get_proxy_image(bucket_id: str, file_id: str):
+# File IDs are immutable: a given URL always serves the same bytes
+CACHE_CONTROL = f"public, max-age={settings.PROXY_CACHE_MAX_AGE_SECONDS}, immutable"
+# Upstream headers relayed to the client as-is
+PASSTHROUGH_HEADERS = ("content-type", "content-length", "content-range", "accept-ranges", "last-modified")
+
+def view_url(bucket_id: str, file_id: str) -> str:
+    # Construct Appwrite View URL
+    project_id = settings.APPWRITE_PROJECT_ID
+    return f"{settings.APPWRITE_ENDPOINT}/storage/buckets/{bucket_id}/files/{file_id}/view?project={project_id}&mode=admin"
+
+def parse_byte_range(range_header: str, size: int):
     """
-    Proxies image requests to Appwrite using streaming to save RAM.
+    Parses a single-range "bytes=start-end" / "bytes=start-" / "bytes=-suffix" header.
+    Returns (start, end) inclusive, None when the header should be ignored
+    (absent, malformed or multi-range: the full body is served), or
+    "unsatisfiable".
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[6:].strip().partition("-")
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                return "unsatisfiable"
+            return max(size - suffix, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, min(end, size - 1)
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = 64 * 1024):
+    # Opened on first iteration, so a response that is never sent holds no descriptor
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def cached_response(request: Request, entry: dict, path: str):
+    """
+    Response for a cache hit. The body is opened later, when the response
+    is sent; entries evicted or invalidated meanwhile stay readable because
+    the cache only unlinks removed bodies after a grace period.
     """
-    project_id = settings.APPWRITE_PROJECT_ID
-    endpoint = settings.APPWRITE_ENDPOINT
-    api_key = settings.APPWRITE_API_KEY
-    
-    # Construct Appwrite View URL
-    url = f"{endpoint}/storage/buckets/{bucket_id}/files/{file_id}/view?project={project_id}&mode=admin"
-    
-    # Appwrite requires X-Appwrite-Project and X-Appwrite-Key headers for admin access
     headers = {
-        "X-Appwrite-Project": project_id,
-        "X-Appwrite-Key": api_key
+        "ETag": entry["etag"],
+        "Last-Modified": entry["last_modified"],
+        "Cache-Control": CACHE_CONTROL,
+        "Accept-Ranges": "bytes"
     }
-    
-    # Create a generator to stream the content
-    async def iterfile():
-        # Use the shared client
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        proxy_cache.stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+
+    # If-Range: only honour Range when the client's copy is still the current one
+    if_range = request.headers.get("if-range")
+    byte_range = None
+    if not if_range or if_range in (entry["etag"], entry["last_modified"]):
+        byte_range = parse_byte_range(request.headers.get("range"), entry["size"])
+    if byte_range == "unsatisfiable":
+        headers["Content-Range"] = f"bytes */{entry['size']}"
+        return Response(status_code=416, headers=headers)
+    if byte_range:
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{entry['size']}"
+        headers["Content-Length"] = str(end - start + 1)
+        if request.method == "HEAD":
+            return Response(status_code=206, headers=headers, media_type=entry["content_type"])
+        return StreamingResponse(iter_file_range(path, start, end), status_code=206, headers=headers, media_type=entry["content_type"])
+
+    # Served straight from disk (sendfile where the server supports it); FileResponse handles HEAD
+    return FileResponse(path, media_type=entry["content_type"], headers=headers)
+
+class UpstreamFetch:
+    """
+    One upstream download shared by every concurrent request for the same
+    file (single-flight). It runs as its own task, so it finishes and fills
+    the cache even if the request that started it disconnects. Chunks are
+    kept in memory until the download ends so late joiners replay them.
+    """
+    def __init__(self, bucket_id: str, file_id: str, default_media_type: str):
+        self.bucket_id = bucket_id
+        self.file_id = file_id
+        self.default_media_type = default_media_type
+        self.status_code = None
+        self.headers = {}
+        self.last_modified = None
+        self.error = None
+        self.chunks = []
+        self.done = False
+        self.ready = asyncio.Event()  # status and headers are known
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @property
+    def media_type(self) -> str:
+        return self.headers.get("content-type") or self.default_media_type
+
+    async def run(self, url: str, headers: dict):
+        writer = None
         try:
-            async with proxy_client.stream("GET", url, headers=headers) as r:
-                if r.status_code != 200:
-                    # Log error but return what we got or yield error bytes
-                    pass 
-                    
-                async for chunk in r.aiter_bytes():
-                    yield chunk
+            upstream = await proxy_client.send(proxy_client.build_request("GET", url, headers=headers), stream=True)
+            try:
+                self.status_code = upstream.status_code
+                self.headers = upstream.headers
+                self.last_modified = upstream.headers.get("last-modified")
+                if self.status_code == 404:
+                    proxy_cache.mark_missing(self.bucket_id, self.file_id)
+                if self.status_code != 200:
+                    # Error bodies are never relayed, so there is nothing to read
+                    return
+                writer = proxy_cache.writer(self.bucket_id, self.file_id, self.media_type, self.last_modified)
+                if writer:
+                    self.last_modified = writer.last_modified
+                self.ready.set()
+                async for chunk in upstream.aiter_bytes():
+                    if writer:
+                        await writer.write(chunk)
+                    self.chunks.append(chunk)
+                    self._notify()
+                if writer:
+                    await writer.commit()
+                    writer = None
+            finally:
+                if writer:
+                    # Partial bodies are discarded
+                    writer.abort()
+                await upstream.aclose()
         except httpx.HTTPError as exc:
-             print(f"Proxy Error: {exc}")
-             # Connection failed, nothing to yield
-             return
+            print(f"Proxy Error: {exc}")
+            self.error = exc
+        finally:
+            self.done = True
+            self.ready.set()
+            self._notify()
+
+    async def stream(self):
+        sent = 0
+        while True:
+            while sent < len(self.chunks):
+                yield self.chunks[sent]
+                sent += 1
+            if self.done:
+                if self.error:
+                    # Truncates this response; the client retries
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+inflight = {}
+flight_stats = {"fetches": 0, "coalesced": 0}
+
+async def shared_fetch(bucket_id: str, file_id: str, url: str, headers: dict, default_media_type: str) -> UpstreamFetch:
+    """Joins the in-flight download of this file or starts one; returns once headers are in."""
+    key = cache_key(bucket_id, file_id)
+    fetch = inflight.get(key)
+    if fetch is None:
+        fetch = UpstreamFetch(bucket_id, file_id, default_media_type)
+        inflight[key] = fetch
+        flight_stats["fetches"] += 1
+        task = asyncio.create_task(fetch.run(url, headers))
+        task.add_done_callback(lambda _: inflight.pop(key, None) if inflight.get(key) is fetch else None)
+    else:
+        flight_stats["coalesced"] += 1
+    await fetch.ready.wait()
+    return fetch
+
+def variant_file_id(file_id: str, width: int, height: int, quality: int, fmt: str) -> str:
+    # Cache key of a resized variant; "src" means the source format was kept
+    return f"{file_id}@{width or 0}x{height or 0}q{quality}.{fmt or 'src'}"
+
+def read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+async def read_source(bucket_id: str, file_id: str, url: str, headers: dict):
+    """Full bytes of a proxied file from the cache or a (shared) upstream fetch: (status, bytes)."""
+    if proxy_cache.is_missing(bucket_id, file_id):
+        return 404, None
+    entry, path = proxy_cache.get(bucket_id, file_id)
+    if entry:
+        return 200, await run_in_threadpool(read_file, path)
+    fetch = await shared_fetch(bucket_id, file_id, url, headers, "application/octet-stream")
+    if fetch.status_code != 200:
+        return fetch.status_code or 502, None
+    try:
+        return 200, b"".join([chunk async for chunk in fetch.stream()])
+    except httpx.HTTPError:
+        return 502, None
 
-    return StreamingResponse(iterfile(), media_type="image/jpeg")
+variant_tasks = {}
+
+async def build_variant(bucket_id: str, file_id: str, variant_id: str, sources: list, headers: dict, width: int, height: int, quality: int, fmt: str):
+    """Resizes the first available source and stores the result in the cache: (status, bytes, media type)."""
+    for source in sources:
+        status_code, data = await read_source(bucket_id, source, view_url(bucket_id, source), headers)
+        if status_code != 404:
+            break
+    if status_code != 200:
+        return status_code, None, None
+    try:
+        rendered, media_type = await image_resizer.resize(data, width, height, quality, fmt)
+    except Exception as e:
+        print(f"Resize Error ({source}): {e}")
+        return 415, None, None
+    # Linked to the original so deleting it drops the variant too
+    writer = proxy_cache.writer(bucket_id, variant_id, media_type, source_id=file_id)
+    if writer:
+        await writer.write(rendered)
+        await writer.commit()
+    return 200, rendered, media_type
+
+async def resized_response(request: Request, bucket_id: str, file_id: str, headers: dict, width: int, height: int, quality: int):
+    """
+    Serves file_id resized to fit within width x height, re-encoded as
+    AVIF/WebP when the Accept header allows. Variants are cached like any
+    other file and built once even under concurrent requests.
+    """
+    max_edge = settings.PROXY_RESIZE_MAX_EDGE
+    width = min(max(width, 1), max_edge) if width else None
+    height = min(max(height, 1), max_edge) if height else None
+    quality = min(max(quality or settings.PROXY_RESIZE_DEFAULT_QUALITY, 1), 100)
+    fmt = negotiate_format(request.headers.get("accept"))
+    variant_id = variant_file_id(file_id, width, height, quality, fmt)
+
+    if proxy_cache.is_missing(bucket_id, file_id):
+        raise HTTPException(status_code=404, detail="Image not found")
+    entry, path = proxy_cache.get(bucket_id, variant_id)
+    if entry is None:
+        # A stored derivative is a valid (and much smaller) source when it covers the requested box
+        sources = []
+        if width and height:
+            sources = [
+                derivative_file_id(file_id, name)
+                for name, edge in sorted(settings.IMAGE_DERIVATIVES.items(), key=lambda kv: kv[1])
+                if edge >= max(width, height)
+            ]
+        sources.append(file_id)
+
+        key = cache_key(bucket_id, variant_id)
+        task = variant_tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(build_variant(bucket_id, file_id, variant_id, sources, headers, width, height, quality, fmt))
+            variant_tasks[key] = task
+            task.add_done_callback(lambda _: variant_tasks.pop(key, None))
+        # Shielded: a client disconnecting must not cancel the build for the others
+        status_code, data, media_type = await asyncio.shield(task)
+        if status_code != 200:
+            detail = "Image not found" if status_code == 404 else f"Image could not be resized ({status_code})"
+            raise HTTPException(status_code=502 if status_code >= 500 else status_code, detail=detail)
+        entry, path = proxy_cache.get(bucket_id, variant_id)
+        if entry is None:
+            # Caching disabled (or variant too large to cache)
+            return Response(content=data, media_type=media_type, headers={
+                "Cache-Control": CACHE_CONTROL,
+                "ETag": entity_tag(cache_key(bucket_id, variant_id)),
+                "Vary": "Accept"
+            })
+
+    response = cached_response(request, entry, path)
+    response.headers["Vary"] = "Accept"
+    return response
+
+@router.api_route("/images/{bucket_id}/{file_id}", methods=["GET", "HEAD"])
+async def get_proxy_image(
+    request: Request,
+    bucket_id: str,
+    file_id: str,
+    size: Optional[str] = None,
+    w: Optional[int] = None,
+    h: Optional[int] = None,
+    q: Optional[int] = None
+):
+    """
+    Proxies image requests to Appwrite using streaming to save RAM.
+    Responses are kept in an LRU disk cache (see proxy_cache) and served
+    with ETag / long-lived Cache-Control; 404s are cached briefly.
+    Concurrent misses for the same file share one upstream download.
+    Upstream Content-Type/Length and status codes are passed through;
+    HEAD and single byte ranges are supported.
+    `size` ("thumb", "medium") serves the WebP derivative, falling back to
+    the original for images uploaded before derivatives existed.
+    `w` / `h` / `q` resize on the fly (fit within w x h, quality q) and
+    negotiate AVIF/WebP from the Accept header.
+    """
+    # Appwrite requires X-Appwrite-Project and X-Appwrite-Key headers for admin access
+    headers = {
+        "X-Appwrite-Project": settings.APPWRITE_PROJECT_ID,
+        "X-Appwrite-Key": settings.APPWRITE_API_KEY,
+        # Relay bytes exactly as stored so Content-Length stays valid
+        "Accept-Encoding": "identity"
+    }
+    if w or h or q:
+        return await resized_response(request, bucket_id, file_id, headers, w, h, q)
+
+    # Partial requests that miss the cache are forwarded as-is (and not shared or cached)
+    partial = "range" in request.headers
+    if partial:
+        for name in ("range", "if-range"):
+            if name in request.headers:
+                headers[name] = request.headers[name]
+
+    candidates = [file_id]
+    if size in settings.IMAGE_DERIVATIVES:
+        candidates.insert(0, derivative_file_id(file_id, size))
+
+    for candidate in candidates:
+        last = candidate == candidates[-1]
+        if proxy_cache.is_missing(bucket_id, candidate):
+            if last:
+                raise HTTPException(status_code=404, detail="Image not found")
+            continue
+
+        entry, path = proxy_cache.get(bucket_id, candidate)
+        if entry:
+            return cached_response(request, entry, path)
+
+        url = view_url(bucket_id, candidate)
+        default_media_type = "image/webp" if candidate != file_id else "image/jpeg"
+        if partial:
+            try:
+                upstream = await proxy_client.send(proxy_client.build_request("GET", url, headers=headers), stream=True)
+            except httpx.HTTPError as exc:
+                print(f"Proxy Error: {exc}")
+                raise HTTPException(status_code=502, detail="Image fetch failed")
+            status_code, upstream_headers = upstream.status_code, upstream.headers
+            if status_code == 404:
+                await upstream.aclose()
+                proxy_cache.mark_missing(bucket_id, candidate)
+        else:
+            fetch = await shared_fetch(bucket_id, candidate, url, headers, default_media_type)
+            if fetch.status_code is None:
+                raise HTTPException(status_code=502, detail="Image fetch failed")
+            status_code, upstream_headers = fetch.status_code, fetch.headers
+
+        if status_code != 404:
+            break
+        if last:
+            raise HTTPException(status_code=404, detail="Image not found")
+
+    if status_code >= 400 and status_code != 416:
+        # Never relay an error body as an image; upstream 5xx becomes a gateway error
+        if partial:
+            await upstream.aclose()
+        print(f"Proxy Error: upstream returned {status_code} for {candidate}")
+        raise HTTPException(status_code=502 if status_code >= 500 else status_code, detail=f"Upstream returned {status_code}")
+
+    response_headers = {name: upstream_headers[name] for name in PASSTHROUGH_HEADERS if name in upstream_headers}
+    media_type = upstream_headers.get("content-type") or default_media_type
+    if status_code in (200, 206):
+        # Same validator a later cache hit sends, so If-None-Match / If-Range work from the first response
+        response_headers["ETag"] = entity_tag(cache_key(bucket_id, candidate))
+    if status_code == 200:
+        response_headers["Cache-Control"] = CACHE_CONTROL
+        if not partial and fetch.last_modified:
+            response_headers["Last-Modified"] = fetch.last_modified
+
+    if request.method == "HEAD":
+        if partial:
+            await upstream.aclose()
+        return Response(status_code=status_code, headers=response_headers, media_type=media_type)
+
+    if partial:
+        return StreamingResponse(
+            upstream.aiter_bytes(),
+            status_code=status_code,
+            media_type=media_type,
+            headers=response_headers,
+            background=BackgroundTask(upstream.aclose)
+        )
+    return StreamingResponse(fetch.stream(), status_code=status_code, media_type=media_type, headers=response_headers)
+
+@router.api_route("/signed/{bucket_id}/{file_id}", methods=["GET", "HEAD"])
+async def get_signed_image(request: Request, bucket_id: str, file_id: str, expires: int, sig: str, size: Optional[str] = None):
+    """
+    Local stand-in for the edge handler behind IMAGE_URL_MODE=signed:
+    validates the HMAC and expiry, then serves like /images (cache included).
+    Resize parameters are not signed and therefore not accepted here.
+    """
+    if not verify_signature(bucket_id, file_id, size, expires, sig):
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    response = await get_proxy_image(request, bucket_id, file_id, size=size)
+    # Shared caches must not keep serving the URL after it expires
+    response.headers["Cache-Control"] = f"public, max-age={max(expires - int(time.time()), 0)}"
+    return response
@@ -1,6 +1,9 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
+import asyncio
+import json
 from app.services.style_scoring_service import StyleScoringService
 from app.services.appwrite_storage import get_file_bytes
 from app.core.config import settings
@@ -27,13 +30,11 @@ class OutfitRequest(BaseModel):
     mood: Optional[str] = None
     use_rag: Optional[bool] = True
 
-@router.post("/score")
-async def score_outfit(request: OutfitRequest):
+async def collect_outfit(request: OutfitRequest) -> tuple[dict, dict]:
     """
-    Score an outfit composed of Top, Bottom, and optional Layer.
-    Fetches images from Appwrite Storage and uses Gemini Vision for analysis.
+    Builds per-category metadata and fetches the item images concurrently.
+    Returns (outfit_images, outfit_metadata).
     """
-    
     outfit_images = {}
     outfit_metadata = {}
     
@@ -43,37 +44,50 @@ async def score_outfit(request: OutfitRequest):
         "layer": request.layer
     }
     
-    # 1. Fetch Images & Prepare Metadata
+    # Assuming bucket_id is the standard wardrobe bucket
+    bucket_id = settings.APPWRITE_WARDROBE_BUCKET_ID
+    if not bucket_id:
+         print("Warning: WARDROBE_BUCKET_ID not set")
+    
+    fetches = {}
     for category, item in items.items():
-        if item and item.image_id:
-            # Metadata
-            outfit_metadata[category] = item.dict(exclude={"image_url", "image_id"})
-            
-            # Fetch Image Bytes
-            # Assuming bucket_id is the standard wardrobe bucket
-            bucket_id = settings.APPWRITE_WARDROBE_BUCKET_ID
-            if not bucket_id:
-                 # Fallback or error?
-                 print("Warning: WARDROBE_BUCKET_ID not set")
-                 continue
-                 
+        if not item:
+            continue
+        outfit_metadata[category] = item.dict(exclude={"image_url", "image_id"})
+        if item.image_id and bucket_id:
             print(f"Fetching image for {category}: {item.image_id}")
-            img_bytes = get_file_bytes(bucket_id, item.image_id)
-            
-            if img_bytes:
-                outfit_images[category] = img_bytes
-            else:
-                print(f"Failed to fetch image for {category}")
-        elif item:
-            # Metadata only if no image
-            outfit_metadata[category] = item.dict(exclude={"image_url", "image_id"})
+            fetches[category] = get_file_bytes(bucket_id, item.image_id)
+
+    results = await asyncio.gather(*fetches.values())
+    for category, img_bytes in zip(fetches.keys(), results):
+        if img_bytes:
+            outfit_images[category] = img_bytes
+        else:
+            print(f"Failed to fetch image for {category}")
+
+    return outfit_images, outfit_metadata
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@router.post("/score")
+async def score_outfit(request: OutfitRequest):
+    """
+    Score an outfit composed of Top, Bottom, and optional Layer.
+    Fetches images from Appwrite Storage and uses Gemini Vision for analysis.
+    """
+    
+    # 1. Fetch Images & Prepare Metadata
+    outfit_images, outfit_metadata = await collect_outfit(request)
 
     if not outfit_images:
         raise HTTPException(status_code=400, detail="No images could be retrieved for the outfit items.")
 
     # 2. Analyze
     try:
-        score = scoring_service.analyze_outfit(
+        score = await scoring_service.analyze_outfit(
             outfit_images=outfit_images,
             outfit_metadata=outfit_metadata,
             target_mood=request.mood,
@@ -91,3 +105,30 @@ async def score_outfit(request: OutfitRequest):
     except Exception as e:
         print(f"Error scoring outfit: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/score/stream")
+async def score_outfit_stream(request: OutfitRequest):
+    """
+    Server-sent-event variant of /score.
+    Events: images_fetched, rag_context, partial (fields as they complete), result, error.
+    """
+    outfit_images, outfit_metadata = await collect_outfit(request)
+
+    if not outfit_images:
+        raise HTTPException(status_code=400, detail="No images could be retrieved for the outfit items.")
+
+    async def event_stream():
+        yield sse_event("images_fetched", {"categories": list(outfit_images.keys())})
+        try:
+            async for event, data in scoring_service.stream_outfit(
+                outfit_images=outfit_images,
+                outfit_metadata=outfit_metadata,
+                target_mood=request.mood,
+                use_rag=request.use_rag
+            ):
+                yield sse_event(event, data)
+        except Exception as e:
+            print(f"Error streaming outfit score: {e}")
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
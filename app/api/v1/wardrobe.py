@@ -1,5 +1,10 @@
 from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from appwrite.exception import AppwriteException
+from typing import List, Optional
+from app.core.responses import FastJSONResponse, dumps
+from app.schemas.wardrobe import WardrobeItemsResponse, resolve_fields, stored_attributes, wardrobe_item_view
 from app.services.wardrobe_service import wardrobe_service
 from app.services.user_service import user_service # Optional: to verify user exists
 
@@ -8,12 +13,22 @@ router = APIRouter()
 class WardrobeFetchRequest(BaseModel):
     user_id: str
     mobile: str
+    # Optional derivative for image_url ("thumb", "medium"); originals by default
+    image_size: Optional[str] = None
+    # Pagination: set page_size (and the previous response's next_cursor) to get one page
+    page_size: Optional[int] = None
+    cursor: Optional[str] = None
+    # Stream every item (from cursor on) as NDJSON, one page fetched at a time
+    stream: bool = False
+    # Subset of WardrobeItem fields to return ($id is always included); all by default
+    fields: Optional[List[str]] = None
 
 
-@router.post("/items")
+@router.post("/items", response_model=None, responses={200: {"model": WardrobeItemsResponse}})
 async def get_wardrobe_items(request: WardrobeFetchRequest):
     """
-    Fetch all wardrobe items for a user.
+    Fetch wardrobe items for a user: everything (default), one page
+    (`page_size` + `cursor`, returns `next_cursor`), or an NDJSON stream (`stream`).
     """
     print(f"--> Received Fetch Wardrobe Request: user_id={request.user_id}, mobile={request.mobile}")
     # 1. Access Control (Optional verification)
@@ -22,31 +37,55 @@ async def get_wardrobe_items(request: WardrobeFetchRequest):
     
     from app.core.config import settings
 
-    items = wardrobe_service.get_user_wardrobe(request.user_id)
-    
+    try:
+        fields = resolve_fields(request.fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    attributes = stored_attributes(fields)
+
     # Enrich items with Image URL (path only)
-    # Format: /v1/storage/buckets/{bucket_id}/files/{file_id}/view?project={project_id}
     # Note: We assume the base URL is handled by the client as requested.
-    
-    project_id = settings.APPWRITE_PROJECT_ID
     bucket_id = settings.APPWRITE_WARDROBE_BUCKET_ID
-    
-    enriched_items = []
-    for item in items:
-        image_id = item.get("image_id")
-        if image_id:
-            # Construct Proxy URL
-            # Format: /proxy/images/{bucket_id}/{file_id}
-            item["image_url"] = f"/proxy/images/{bucket_id}/{image_id}"
-        else:
-            item["image_url"] = None
-        enriched_items.append(item)
+    page_size = min(max(request.page_size or settings.WARDROBE_DEFAULT_PAGE_SIZE, 1), settings.WARDROBE_MAX_PAGE_SIZE)
+
+    def view(item):
+        return wardrobe_item_view(item, bucket_id, request.image_size, fields)
+
+    if request.stream:
+        async def ndjson():
+            count = 0
+            try:
+                async for page in wardrobe_service.iter_wardrobe_pages(request.user_id, page_size, request.cursor, attributes):
+                    count += len(page)
+                    yield b"".join(dumps(view(item)) + b"\n" for item in page)
+            except AppwriteException as e:
+                # Headers are already sent; the client sees a truncated stream
+                print(f"Wardrobe stream error for user {request.user_id}: {e}")
+            print(f"--> Streamed {count} items for user {request.user_id}")
+
+        return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+    if request.page_size or request.cursor:
+        try:
+            items, next_cursor = await wardrobe_service.list_wardrobe_page(request.user_id, page_size, request.cursor, attributes)
+        except AppwriteException as e:
+            print(f"Wardrobe page error for user {request.user_id}: {e}")
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        print(f"--> Sending back {len(items)} items (page) for user {request.user_id}")
+        return FastJSONResponse({
+            "status": "success",
+            "data": [view(item) for item in items],
+            "next_cursor": next_cursor
+        })
+
+    items = await wardrobe_service.get_user_wardrobe(request.user_id)
+    enriched_items = [view(item) for item in items]
     
     print(f"--> Sending back {len(enriched_items)} items for user {request.user_id}")
-    return {
+    return FastJSONResponse({
         "status": "success",
         "data": enriched_items
-    }
+    })
 
 class WardrobeRemoveRequest(BaseModel):
     user_id: str
@@ -55,43 +94,30 @@ class WardrobeRemoveRequest(BaseModel):
 @router.post("/remove")
 async def remove_wardrobe_items(request: WardrobeRemoveRequest):
     """
-    Remove one or more items from the wardrobe.
-    Executes deletions in PARALLEL for performance.
+    Remove one or more items (by document or image ID) from the wardrobe.
+    IDs are resolved together, images and documents are deleted concurrently,
+    and the user's wardrobe_id_list is updated once. `results` has the
+    outcome per requested ID.
     """
     print(f"--> Received Remove Request: user_id={request.user_id}, items={request.item_ids}")
-    
-    import asyncio
-    from starlette.concurrency import run_in_threadpool
-    import functools
-    
-    deleted_count = 0
-    errors = []
 
-    async def remove_single_item(item_id):
-        print(f"--> [Thread] Starting removal for: {item_id}")
-        # Wrap blocking service call in threadpool
-        func = functools.partial(wardrobe_service.delete_wardrobe_item, request.user_id, item_id)
-        success = await run_in_threadpool(func)
-        print(f"--> [Thread] Finished removal for: {item_id}, Success: {success}")
-        return item_id, success
+    results = await wardrobe_service.delete_wardrobe_items(request.user_id, request.item_ids)
 
-    # Create tasks
-    tasks = [remove_single_item(iid) for iid in request.item_ids]
-    
-    # Run in parallel
-    results = await asyncio.gather(*tasks)
-    
-    for item_id, success in results:
-        if success:
-            print(f"Successfully deleted item: {item_id}")
-            deleted_count += 1
+    deleted = set()
+    errors = []
+    for item_id, result in results.items():
+        if result["status"] == "deleted":
+            # An item requested by both document and image ID counts once
+            deleted.add(result["id"])
         else:
-            print(f"Failed to delete item: {item_id}")
+            print(f"Failed to delete item: {item_id} ({result['status']})")
             errors.append(item_id)
-            
+    deleted_count = len(deleted)
+
     return {
         "status": "success",
         "message": f"Deleted {deleted_count} items",
         "deleted_count": deleted_count,
-        "errors": errors
+        "errors": errors,
+        "results": results
     }
@@ -1,4 +1,6 @@
-from typing import List, Union
+import os
+import tempfile
+from typing import Dict, List, Literal, Optional, Union
 from pydantic import AnyHttpUrl, validator
 from pydantic_settings import BaseSettings
 
@@ -15,6 +17,14 @@ class Settings(BaseSettings):
     APPWRITE_BUCKET_ID: str = ""
     APPWRITE_WARDROBE_BUCKET_ID: str = ""
 
+    # Async Appwrite repository (pooled httpx client used by the services)
+    APPWRITE_HTTP2: bool = True
+    APPWRITE_HTTP_MAX_CONNECTIONS: int = 100
+    APPWRITE_HTTP_MAX_KEEPALIVE: int = 20
+    APPWRITE_HTTP_TIMEOUT_SECONDS: float = 30.0
+    APPWRITE_HTTP_RETRIES: int = 2
+    APPWRITE_HTTP_RETRY_BACKOFF_SECONDS: float = 0.2
+
     # OTP Settings
     OTP_API_KEY: str = ""
     OTP_TEMPLATE_NAME: str = "FlickSickOTP1"
@@ -25,6 +35,125 @@ class Settings(BaseSettings):
     # Gemini
     GOOGLE_API_KEY: str = ""
 
+    # LLM Gateway (shared by all Gemini callers)
+    LLM_REQUESTS_PER_MINUTE: int = 60
+    LLM_TOKENS_PER_MINUTE: int = 1000000
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_MAX_RETRIES: int = 4
+    LLM_TIMEOUT_SECONDS: float = 60.0
+    LLM_BACKOFF_BASE_SECONDS: float = 1.0
+    LLM_BACKOFF_MAX_SECONDS: float = 16.0
+
+    # Image preprocessing before LLM calls
+    IMAGE_MAX_EDGE: int = 1024
+    IMAGE_JPEG_QUALITY: int = 85
+    IMAGE_PASSTHROUGH_MAX_BYTES: int = 512 * 1024
+    IMAGE_CACHE_ENTRIES: int = 256
+
+    # WebP derivatives generated after upload (size name -> max edge in px), served via /proxy/images?size=
+    IMAGE_DERIVATIVES_ENABLED: bool = True
+    IMAGE_DERIVATIVES: Dict[str, int] = {"thumb": 256, "medium": 768}
+    IMAGE_DERIVATIVE_QUALITY: int = 80
+
+    # Wardrobe listing: page size for full fetches, and default / max page_size for /wardrobe/items
+    WARDROBE_FETCH_PAGE_SIZE: int = 500
+    WARDROBE_DEFAULT_PAGE_SIZE: int = 50
+    WARDROBE_MAX_PAGE_SIZE: int = 500
+    # /wardrobe/remove: image and document deletions in flight at once
+    WARDROBE_DELETE_CONCURRENCY: int = 8
+
+    # Per-user wardrobe read cache ("memory" per process, or "redis" shared across workers)
+    WARDROBE_CACHE_ENABLED: bool = True
+    WARDROBE_CACHE_BACKEND: str = "memory"
+    WARDROBE_CACHE_REDIS_URL: str = "redis://localhost:6379/0"
+    WARDROBE_CACHE_TTL_SECONDS: float = 300.0
+    WARDROBE_CACHE_MAX_USERS: int = 10000
+
+    # Image URLs returned by listings: "proxy" (/proxy/images, streamed through the API) or
+    # "signed" (HMAC + expiry URLs under IMAGE_SIGNED_URL_BASE, validated by an edge handler
+    # or the local /proxy/signed stand-in). Signed mode needs IMAGE_SIGNING_KEY.
+    IMAGE_URL_MODE: str = "proxy"
+    IMAGE_SIGNING_KEY: str = ""
+    IMAGE_SIGNED_URL_TTL_SECONDS: int = 900
+    IMAGE_SIGNED_URL_BASE: str = "/proxy/signed"
+
+    # Image proxy disk cache (LRU by total size; file IDs are immutable so entries never go stale)
+    PROXY_CACHE_ENABLED: bool = True
+    PROXY_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "proxy-image-cache")
+    PROXY_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+    PROXY_CACHE_MAX_ENTRY_BYTES: int = 20 * 1024 * 1024
+    PROXY_CACHE_NEGATIVE_TTL_SECONDS: float = 60.0
+    # Evicted/invalidated bodies stay readable this long for responses already in flight
+    PROXY_CACHE_UNLINK_GRACE_SECONDS: float = 60.0
+    PROXY_CACHE_MAX_AGE_SECONDS: int = 365 * 24 * 3600
+
+    # On-the-fly resizing in the image proxy (?w=&h=&q=), run in a process pool (0 = thread pool)
+    PROXY_RESIZE_WORKERS: int = 2
+    PROXY_RESIZE_MAX_EDGE: int = 2048
+    PROXY_RESIZE_DEFAULT_QUALITY: int = 80
+    # AVIF encodes are several times slower than WebP; disable to always negotiate WebP
+    PROXY_RESIZE_AVIF: bool = True
+
+    # Batch garment analysis (several images per Gemini call)
+    GEMINI_BATCH_MAX_IMAGES: int = 8
+    GEMINI_BATCH_MAX_OUTPUT_TOKENS: int = 8192
+    GEMINI_BATCH_OUTPUT_TOKENS_PER_IMAGE: int = 400
+
+    # Vision provider routing for garment analysis (comma-separated preference order)
+    VISION_PROVIDERS: str = "gemini,moondream"
+    VISION_HEDGING_ENABLED: bool = True
+    VISION_HEDGE_DELAY_SECONDS: float = 6.0
+    VISION_STATS_WINDOW: int = 100
+    VISION_MIN_SAMPLES: int = 5
+    VISION_MAX_ERROR_RATE: float = 0.5
+
+    # Background garment analysis queue
+    ANALYSIS_WORKERS: int = 4
+    ANALYSIS_QUEUE_MAX_SIZE: int = 256
+    ANALYSIS_JOB_MAX_ATTEMPTS: int = 2
+    ANALYSIS_JOB_RETENTION: int = 1000
+    ANALYSIS_WAIT_TIMEOUT_SECONDS: float = 30.0
+
+    # Upload handling: size limit (enforced while streaming by BodySizeLimitMiddleware)
+    UPLOAD_MAX_FILE_BYTES: int = 10 * 1024 * 1024
+    # /garments/upload-batch: files per request and files processed at once
+    UPLOAD_BATCH_MAX_FILES: int = 50
+    UPLOAD_BATCH_CONCURRENCY: int = 4
+
+    # Upload deduplication (per-user content hash index, optional perceptual hash)
+    UPLOAD_DEDUP_ENABLED: bool = True
+    UPLOAD_DEDUP_PERCEPTUAL: bool = False
+    UPLOAD_DEDUP_PHASH_DISTANCE: int = 4
+    # Persist hashes on wardrobe documents so the index survives restarts
+    # (needs the content_hash / perceptual_hash attributes from appwrite_db_scripts/wardrobe.py)
+    UPLOAD_DEDUP_STORE_HASHES: bool = False
+    # Users kept in the in-memory hash index, and how long before one is reloaded
+    UPLOAD_DEDUP_MAX_USERS: int = 10000
+    UPLOAD_DEDUP_TTL_SECONDS: float = 3600
+
+    # Offline record/replay of Gemini, Moondream and Appwrite calls: "off", "record" or "replay"
+    REPLAY_MODE: str = "off"
+    REPLAY_PROVIDERS: str = "gemini,moondream,appwrite"
+    REPLAY_FIXTURES_DIR: str = "fixtures/replay"
+    # "recorded", "fixed:<ms>", "uniform:<lo_ms>:<hi_ms>" or "lognormal:<median_ms>:<sigma>"
+    REPLAY_LATENCY: str = "recorded"
+    REPLAY_RATE_LIMIT_PROBABILITY: float = 0.0
+    REPLAY_RATE_LIMIT_BURST: int = 1
+    REPLAY_SEED: Optional[int] = None
+
+    # Style rules prompt context: "pruned" (default), "compact" or "full" (opt-in, larger prompt)
+    STYLE_RULES_MODE: Literal["pruned", "compact", "full"] = "pruned"
+    STYLE_RULES_TOKEN_BUDGET: int = 1500
+
+    # Prompt-prefix caching: "gemini" (context caching API), "local" (in-process stand-in) or "off".
+    # Gemini only caches prefixes of at least PROMPT_CACHE_MIN_TOKENS; with STYLE_RULES_MODE="pruned"
+    # the outfit prefix carries no rules and stays inline (single-image analysis still caches compact rules)
+    PROMPT_CACHE_BACKEND: str = "gemini"
+    PROMPT_CACHE_TTL_SECONDS: int = 3600
+    PROMPT_CACHE_MIN_TOKENS: int = 4096
+    # Wait before retrying a failed prefix registration (prefixes are sent inline meanwhile)
+    PROMPT_CACHE_RETRY_SECONDS: int = 300
+
 
     @validator("BACKEND_CORS_ORIGINS", pre=True)
     def assemble_cors_origins(cls, v: Union[str, List[str]]) -> Union[List[str], str]:
@@ -34,6 +163,13 @@ class Settings(BaseSettings):
             return v
         raise ValueError(v)
 
+    @validator("IMAGE_SIGNING_KEY")
+    def require_signing_key(cls, v: str, values: dict) -> str:
+        # Without a key signed mode would silently hand out proxy URLs
+        if values.get("IMAGE_URL_MODE") == "signed" and not v:
+            raise ValueError("IMAGE_URL_MODE=signed requires IMAGE_SIGNING_KEY")
+        return v
+
     class Config:
         case_sensitive = True
         env_file = ".env"
@@ -0,0 +1,46 @@
+from fastapi import HTTPException
+
+
+class BodySizeLimitMiddleware:
+    """
+    Rejects oversized request bodies for the configured paths before they
+    are parsed: immediately when Content-Length is too large, otherwise as
+    soon as the streamed body crosses the limit (chunked transfer).
+    FastAPI parses multipart forms before the endpoint runs, so the endpoint
+    itself cannot reject early.
+    """
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                return await self._reject(send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside form parsing; FastAPI turns it into a 413 response
+                    raise HTTPException(status_code=413, detail="File too large")
+            return message
+
+        return await self.app(scope, limited_receive, send)
+
+    async def _reject(self, send):
+        body = b'{"detail":"File too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
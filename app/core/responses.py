@@ -0,0 +1,20 @@
+import json
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; the stdlib encoder produces the same output, only slower
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed."""
+    def render(self, content) -> bytes:
+        return dumps(content)
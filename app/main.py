@@ -32,6 +32,14 @@ app.include_router(vector_scoring.router, prefix="/api/v1/semantic", tags=["sema
 from app.api.v1 import color_scoring
 app.include_router(color_scoring.router, prefix="/api/v1/color", tags=["color-theory"])
 
+# Reject oversized uploads before the multipart body is parsed
+from app.core.middleware import BodySizeLimitMiddleware
+app.add_middleware(BodySizeLimitMiddleware, limits={
+    "/api/v1/garments/upload-garment": garments.MAX_FILE_SIZE + garments.MULTIPART_OVERHEAD,
+    "/api/v1/garments/analyze": garments.MAX_FILE_SIZE + garments.MULTIPART_OVERHEAD,
+    "/api/v1/garments/upload-batch": (garments.MAX_FILE_SIZE + garments.MULTIPART_OVERHEAD) * settings.UPLOAD_BATCH_MAX_FILES,
+})
+
 # Set all CORS enabled origins
 if settings.BACKEND_CORS_ORIGINS:
     app.add_middleware(
@@ -48,10 +56,65 @@ async def startup_event():
     print("Initializing Vector Scoring Service...")
     vector_scoring.vector_service.initialize()
 
+    if settings.PROMPT_CACHE_BACKEND == "gemini" and settings.STYLE_RULES_MODE == "pruned":
+        # Pruned rules are sent per request, leaving the outfit prefix (~500 tokens) below the caching minimum
+        print(f"Prompt caching inactive for outfit scoring: STYLE_RULES_MODE=pruned keeps its prefix below "
+              f"PROMPT_CACHE_MIN_TOKENS={settings.PROMPT_CACHE_MIN_TOKENS} (use compact/full to cache the rules)")
+
+    # Background garment analysis workers
+    from app.services.analysis_queue import analysis_queue
+    analysis_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    from app.services.analysis_queue import analysis_queue
+    await analysis_queue.stop()
+
+    from app.services.image_resize import image_resizer
+    image_resizer.shutdown()
+
+    from app.services.appwrite_repository import appwrite_repository
+    await appwrite_repository.close()
+
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+def metrics():
+    from app.services.llm_gateway import llm_gateway
+    from app.services.image_preprocessing import image_preprocessor
+    from app.services.prompt_cache import prompt_prefix_cache
+    from app.services.gemini_service import gemini_service
+    from app.services.vision_router import vision_router
+    from app.services.replay import replay_harness
+    from app.services.analysis_queue import analysis_queue
+    from app.services.upload_pipeline import upload_stats
+    from app.services.upload_dedup import upload_hash_index
+    from app.services.image_derivatives import derivative_generator
+    from app.services.proxy_cache import proxy_cache
+    from app.services.image_resize import image_resizer
+    from app.services.appwrite_repository import appwrite_repository
+    from app.services.wardrobe_cache import wardrobe_cache
+    return {
+        "llm_gateway": llm_gateway.snapshot(),
+        "image_preprocessing": dict(image_preprocessor.stats),
+        "style_rules": style.scoring_service.rules_cache.snapshot(),
+        "prompt_cache": prompt_prefix_cache.snapshot(),
+        "garment_batch": dict(gemini_service.batch_stats, batch_size=gemini_service.batch_size()),
+        "vision_router": vision_router.snapshot(),
+        "replay": replay_harness.snapshot(),
+        "analysis_queue": analysis_queue.snapshot(),
+        "upload_pipeline": upload_stats.snapshot(),
+        "upload_dedup": dict(upload_hash_index.stats, users=len(upload_hash_index._users)),
+        "image_derivatives": dict(derivative_generator.stats),
+        "proxy_cache": proxy_cache.snapshot(),
+        "proxy_single_flight": dict(proxy.flight_stats, in_flight=len(proxy.inflight)),
+        "proxy_resize": dict(image_resizer.stats, in_flight=len(proxy.variant_tasks)),
+        "appwrite": dict(appwrite_repository.stats),
+        "wardrobe_cache": wardrobe_cache.snapshot()
+    }
+
 @app.get("/")
 def root():
     return {"message": "Welcome to STYL API"}
@@ -0,0 +1,62 @@
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Optional
+from app.services.image_urls import image_url, image_variants
+
+
+class WardrobeItem(BaseModel):
+    """What list endpoints return per item (no system attributes or stored image_url)."""
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str = Field(alias="$id")
+    image_id: Optional[str] = None
+    image_url: Optional[str] = None
+    image_variants: Dict[str, str] = {}
+    general_category: Optional[str] = None
+    specific_category: Optional[str] = None
+    custom_category: Optional[str] = None
+    tags: Optional[str] = None
+    colors: Optional[List[str]] = None
+    caption: Optional[str] = None
+    add_date: Optional[str] = None
+
+
+class WardrobeItemsResponse(BaseModel):
+    status: str
+    data: List[WardrobeItem]
+    # Only set for paginated requests
+    next_cursor: Optional[str] = None
+
+
+ITEM_FIELDS = [field.alias or name for name, field in WardrobeItem.model_fields.items()]
+# Built from image_id rather than read from the document
+COMPUTED_FIELDS = {"image_url", "image_variants"}
+
+
+def resolve_fields(requested: Optional[List[str]]) -> List[str]:
+    """Validates a `fields` selection; `$id` is always included. Raises ValueError on unknown fields."""
+    if not requested:
+        return ITEM_FIELDS
+    unknown = [name for name in requested if name not in ITEM_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(ITEM_FIELDS)}")
+    return ["$id"] + [name for name in ITEM_FIELDS if name in requested and name != "$id"]
+
+
+def stored_attributes(fields: List[str]) -> List[str]:
+    """Document attributes to select from Appwrite for the given fields."""
+    attributes = [name for name in fields if name not in COMPUTED_FIELDS and not name.startswith("$")]
+    if COMPUTED_FIELDS.intersection(fields) and "image_id" not in attributes:
+        attributes.append("image_id")
+    return attributes
+
+
+def wardrobe_item_view(item: dict, bucket_id: str, image_size: str = None, fields: List[str] = ITEM_FIELDS) -> dict:
+    view = {name: item.get(name) for name in fields if name not in COMPUTED_FIELDS}
+    image_id = item.get("image_id")
+    if "image_url" in fields:
+        # Proxy URL (/proxy/images/{bucket_id}/{file_id}[?size=thumb|medium])
+        # or a short-lived signed URL, depending on IMAGE_URL_MODE
+        view["image_url"] = image_url(bucket_id, image_id, image_size) if image_id else None
+    if "image_variants" in fields:
+        view["image_variants"] = image_variants(bucket_id, image_id) if image_id else {}
+    return view
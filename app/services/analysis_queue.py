@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from app.core.config import settings
+from app.services.wardrobe_service import wardrobe_service, analysis_to_updates
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class GarmentAnalysisQueue:
+    """
+    In-process background queue for garment analysis.
+    Uploads enqueue the image bytes and return straight away; workers run the
+    vision analysis, apply the category mapping and save it to the wardrobe item.
+    Job state is kept in memory (keyed by wardrobe ID) for the status endpoint.
+    """
+    def __init__(self):
+        self.worker_count = settings.ANALYSIS_WORKERS
+        self.max_attempts = settings.ANALYSIS_JOB_MAX_ATTEMPTS
+        self.retention = settings.ANALYSIS_JOB_RETENTION
+
+        # Created lazily so they bind to the running server loop
+        self._queue = None
+        self._workers = []
+        self._done_events = {}
+        self.jobs = OrderedDict()
+
+        self.stats = {"enqueued": 0, "completed": 0, "failed": 0, "retries": 0, "analysis_ms_total": 0.0, "queue_wait_ms_total": 0.0}
+
+    def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.ANALYSIS_QUEUE_MAX_SIZE)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"Garment analysis queue started with {self.worker_count} workers")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def enqueue(self, wardrobe_id: str, image_data: bytes, document_ready: asyncio.Future = None) -> dict:
+        """
+        Queues analysis for a wardrobe item. Waits only if the queue is full (backpressure).
+        `document_ready` lets analysis start before the wardrobe document exists
+        (while the image is still being stored); the result is saved once it
+        resolves to True and dropped if it resolves to False.
+        """
+        self.start()
+        job = {
+            "wardrobe_id": wardrobe_id,
+            "status": PENDING,
+            "attempts": 0,
+            "updates": None,
+            "provider": None,
+            "error": None,
+            "enqueued_at": time.time(),
+            "finished_at": None,
+        }
+        self.jobs[wardrobe_id] = job
+        self._done_events[wardrobe_id] = asyncio.Event()
+        self._trim()
+        await self._queue.put((wardrobe_id, image_data, document_ready, time.monotonic()))
+        self.stats["enqueued"] += 1
+        return job
+
+    def get(self, wardrobe_id: str):
+        return self.jobs.get(wardrobe_id)
+
+    async def wait(self, wardrobe_id: str, timeout: float):
+        """
+        Long-poll helper: waits up to `timeout` seconds for the job to finish.
+        """
+        event = self._done_events.get(wardrobe_id)
+        if event is not None and timeout > 0:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.jobs.get(wardrobe_id)
+
+    def _trim(self):
+        # Forget the oldest finished jobs; pending ones are never dropped
+        while len(self.jobs) > self.retention:
+            for wardrobe_id, job in self.jobs.items():
+                if job["status"] in (COMPLETED, FAILED):
+                    del self.jobs[wardrobe_id]
+                    self._done_events.pop(wardrobe_id, None)
+                    break
+            else:
+                return
+
+    async def _worker(self, index: int):
+        from app.services.vision_router import vision_router
+
+        while True:
+            wardrobe_id, image_data, document_ready, queued_at = await self._queue.get()
+            job = self.jobs.get(wardrobe_id)
+            try:
+                if job is not None:
+                    self.stats["queue_wait_ms_total"] += (time.monotonic() - queued_at) * 1000
+                    await self._run(job, image_data, document_ready, vision_router)
+            except Exception as e:
+                logger.error(f"Analysis job {wardrobe_id} crashed: {e}")
+                if job is not None:
+                    job["status"] = FAILED
+                    job["error"] = str(e)
+                self.stats["failed"] += 1
+            finally:
+                if job is not None and job["status"] in (COMPLETED, FAILED):
+                    job["finished_at"] = time.time()
+                    event = self._done_events.get(wardrobe_id)
+                    if event:
+                        event.set()
+                self._queue.task_done()
+
+    async def _run(self, job: dict, image_data: bytes, document_ready, vision_router):
+        wardrobe_id = job["wardrobe_id"]
+        job["status"] = RUNNING
+
+        analysis_result = None
+        while job["attempts"] < self.max_attempts and not analysis_result:
+            if job["attempts"]:
+                self.stats["retries"] += 1
+            job["attempts"] += 1
+            start = time.monotonic()
+            analysis_result, provider = await vision_router.analyze(image_data)
+            self.stats["analysis_ms_total"] += (time.monotonic() - start) * 1000
+            job["provider"] = provider
+
+        if not analysis_result:
+            job["status"] = FAILED
+            job["error"] = "Analysis failed"
+            self.stats["failed"] += 1
+            return
+
+        updates = analysis_to_updates(analysis_result)
+        if document_ready is not None and not await document_ready:
+            # The upload failed after analysis started; the result has nowhere to go
+            job["status"] = FAILED
+            job["error"] = "Wardrobe item was not created"
+            self.stats["failed"] += 1
+            return
+
+        if updates:
+            print(f"--> Updating Wardrobe Item {wardrobe_id} with AI logic...")
+            saved = await wardrobe_service.update_wardrobe_item(wardrobe_id, updates)
+            if not saved:
+                job["status"] = FAILED
+                job["error"] = "Failed to save analysis"
+                job["updates"] = updates
+                self.stats["failed"] += 1
+                return
+
+        job["updates"] = updates
+        job["status"] = COMPLETED
+        self.stats["completed"] += 1
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["workers"] = len(self._workers)
+        data["queued"] = self._queue.qsize() if self._queue else 0
+        data["running"] = sum(1 for job in self.jobs.values() if job["status"] == RUNNING)
+        return data
+
+
+analysis_queue = GarmentAnalysisQueue()
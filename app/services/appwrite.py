@@ -1,5 +1,6 @@
 from appwrite.client import Client
 from app.core.config import settings
+from app.services.replay import wrap_appwrite_client
 
 def get_appwrite_client() -> Client:
     """
@@ -9,7 +10,7 @@ def get_appwrite_client() -> Client:
     client.set_endpoint(settings.APPWRITE_ENDPOINT)
     client.set_project(settings.APPWRITE_PROJECT_ID)
     client.set_key(settings.APPWRITE_API_KEY)
-    return client
+    return wrap_appwrite_client(client)
 
 from appwrite.services.databases import Databases
 
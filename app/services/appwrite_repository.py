@@ -0,0 +1,176 @@
+import asyncio
+import json
+import httpx
+from appwrite.exception import AppwriteException
+from app.core.config import settings
+from app.services.replay import replay_appwrite_call
+from app.services.upload_io import MemoryViewReader
+
+# Appwrite rejects single requests above 5MB; larger files are sent in chunks
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+# Methods that are safe to resend after a 5xx (POST is only retried if it never reached the server)
+IDEMPOTENT_METHODS = {"GET", "PUT", "PATCH", "DELETE"}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class AppwriteRepository:
+    """
+    Async access to the Appwrite databases and storage endpoints we use,
+    over one pooled httpx.AsyncClient (keep-alive, HTTP/2 when `h2` is
+    installed). Method names and arguments mirror the SDK's Databases and
+    Storage services, and errors are raised as AppwriteException, so
+    services can swap `self.db.x(...)` for `await self.db.x(...)`.
+    Transport errors and 5xx responses are retried with backoff.
+    """
+    def __init__(self):
+        self.endpoint = settings.APPWRITE_ENDPOINT.rstrip("/")
+        self.retries = settings.APPWRITE_HTTP_RETRIES
+        self.backoff = settings.APPWRITE_HTTP_RETRY_BACKOFF_SECONDS
+        self._client = None
+        self.stats = {"requests": 0, "retries": 0, "errors": 0}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=settings.APPWRITE_HTTP2 and http2_available(),
+                limits=httpx.Limits(
+                    max_connections=settings.APPWRITE_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.APPWRITE_HTTP_MAX_KEEPALIVE
+                ),
+                timeout=settings.APPWRITE_HTTP_TIMEOUT_SECONDS,
+                headers={
+                    "X-Appwrite-Project": settings.APPWRITE_PROJECT_ID,
+                    "X-Appwrite-Key": settings.APPWRITE_API_KEY,
+                    # Same response shape as the Python SDK (appwrite==4.0.0)
+                    "X-Appwrite-Response-Format": "1.4.0",
+                }
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def call(self, method: str, path: str, params: dict = None, headers: dict = None, files: dict = None, response_type: str = "json"):
+        """
+        One Appwrite API call. Routed through the record/replay harness under
+        the same key as the SDK's Client.call, so fixtures are shared.
+        """
+        return await replay_appwrite_call(
+            method, path, params,
+            lambda: self._send(method, path, params, headers, files, response_type)
+        )
+
+    async def _send(self, method: str, path: str, params: dict, headers: dict, files: dict, response_type: str):
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        kwargs = {"headers": headers}
+        if method == "GET":
+            # Lists go out as repeated key[] parameters, like the SDK does
+            kwargs["params"] = {f"{k}[]" if isinstance(v, list) else k: v for k, v in params.items()}
+        elif files:
+            kwargs["data"] = {k: v if isinstance(v, str) else json.dumps(v) for k, v in params.items()}
+            kwargs["files"] = files
+        else:
+            kwargs["json"] = params
+
+        attempt = 0
+        while True:
+            self.stats["requests"] += 1
+            try:
+                response = await self.client.request(method, self.endpoint + path, **kwargs)
+            except httpx.HTTPError as e:
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= self.retries:
+                    self.stats["errors"] += 1
+                    raise AppwriteException(f"Appwrite request failed: {e}", None)
+            else:
+                if response.status_code < 500 or method not in IDEMPOTENT_METHODS or attempt >= self.retries:
+                    break
+            attempt += 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(self.backoff * (2 ** (attempt - 1)))
+
+        if response.status_code >= 400:
+            self.stats["errors"] += 1
+            try:
+                error = response.json()
+            except ValueError:
+                error = {"message": response.text}
+            raise AppwriteException(error.get("message"), response.status_code, error.get("type"), response.text)
+        if response_type == "bytes":
+            return response.content
+        if not response.content:
+            return {}
+        return response.json()
+
+    # --- Databases ------------------------------------------------------
+
+    @staticmethod
+    def _documents_path(database_id: str, collection_id: str) -> str:
+        return f"/databases/{database_id}/collections/{collection_id}/documents"
+
+    async def list_documents(self, database_id: str, collection_id: str, queries: list = None) -> dict:
+        return await self.call("GET", self._documents_path(database_id, collection_id), {"queries": queries})
+
+    async def get_document(self, database_id: str, collection_id: str, document_id: str, queries: list = None) -> dict:
+        return await self.call("GET", f"{self._documents_path(database_id, collection_id)}/{document_id}", {"queries": queries})
+
+    async def create_document(self, database_id: str, collection_id: str, document_id: str, data: dict, permissions: list = None) -> dict:
+        return await self.call("POST", self._documents_path(database_id, collection_id), {
+            "documentId": document_id,
+            "data": data,
+            "permissions": permissions
+        })
+
+    async def update_document(self, database_id: str, collection_id: str, document_id: str, data: dict = None, permissions: list = None) -> dict:
+        return await self.call("PATCH", f"{self._documents_path(database_id, collection_id)}/{document_id}", {
+            "data": data,
+            "permissions": permissions
+        })
+
+    async def delete_document(self, database_id: str, collection_id: str, document_id: str):
+        return await self.call("DELETE", f"{self._documents_path(database_id, collection_id)}/{document_id}")
+
+    # --- Storage --------------------------------------------------------
+
+    async def create_file(self, bucket_id: str, file_id: str, data: bytes, filename: str, mime_type: str) -> dict:
+        """
+        Uploads bytes (or a memoryview), in 5MB chunks when larger than that.
+        The body is streamed from the buffer (MemoryViewReader), never copied whole.
+        """
+        path = f"/storage/buckets/{bucket_id}/files"
+        data = memoryview(data)
+        size = len(data)
+        if size <= UPLOAD_CHUNK_SIZE:
+            return await self.call("POST", path, {"fileId": file_id}, files={"file": (filename, MemoryViewReader(data), mime_type)})
+
+        result = None
+        for start in range(0, size, UPLOAD_CHUNK_SIZE):
+            end = min(start + UPLOAD_CHUNK_SIZE, size) - 1
+            headers = {"Content-Range": f"bytes {start}-{end}/{size}"}
+            if result:
+                # Later chunks are attached to the file created by the first one
+                headers["X-Appwrite-ID"] = result["$id"]
+            result = await self.call(
+                "POST", path, {"fileId": file_id}, headers=headers,
+                files={"file": (filename, MemoryViewReader(data[start:end + 1]), mime_type)}
+            )
+        return result
+
+    async def get_file_download(self, bucket_id: str, file_id: str) -> bytes:
+        return await self.call("GET", f"/storage/buckets/{bucket_id}/files/{file_id}/download", response_type="bytes")
+
+    async def delete_file(self, bucket_id: str, file_id: str):
+        return await self.call("DELETE", f"/storage/buckets/{bucket_id}/files/{file_id}")
+
+
+appwrite_repository = AppwriteRepository()
@@ -25,8 +25,15 @@ except Exception as e:
     print(f"Error initializing Appwrite Client: {e}")
     exit(1)
 
+# Record/replay hook (no-op unless REPLAY_MODE is set)
+from app.services.replay import wrap_appwrite_client
+client = wrap_appwrite_client(client)
+
 storage = Storage(client)
 
+# Async, pooled access used by the API (the sync SDK client above serves the CLI upload below)
+from app.services.appwrite_repository import appwrite_repository
+
 def upload_image(image_path: str, bucket_id: str = None):
     """
     Uploads an image to the Appwrite bucket and returns the File ID.
@@ -68,9 +75,11 @@ def upload_image(image_path: str, bucket_id: str = None):
         print(f"❌ Upload Failed: {e}")
         return None
 
-def upload_image_from_bytes(image_data: bytes, filename: str, bucket_id: str = None):
+async def upload_image_from_bytes(image_data: bytes, filename: str, bucket_id: str = None, file_id: str = "unique()", mime_type: str = "image/jpeg"):
     """
     Uploads bytes directly to Appwrite without saving to disk.
+    Pass file_id to choose the ID up front (lets callers start dependent work before the upload returns).
+    image_data may be a memoryview (e.g. over a spooled upload).
     """
     if not bucket_id:
         bucket_id = settings.APPWRITE_BUCKET_ID
@@ -81,18 +90,12 @@ def upload_image_from_bytes(image_data: bytes, filename: str, bucket_id: str = N
     print(f"Uploading {filename} ({len(image_data)} bytes) to bucket {bucket_id}...")
     
     try:
-        # InputFile.from_bytes(data, name, media_type) - media_type implied by name usually?
-        # Actually checking SDK, InputFile.from_bytes doesn't exist in older versions, 
-        # but modern one has it. 
-        # If not, we can use client.call directly, but assuming it exists.
-        # It's usually InputFile.from_bytes(data, filename=...)
-        
-        file = InputFile.from_bytes(image_data, filename=filename, mime_type="image/jpeg")
-
-        result = storage.create_file(
+        result = await appwrite_repository.create_file(
             bucket_id=bucket_id,
-            file_id='unique()',
-            file=file
+            file_id=file_id,
+            data=image_data,
+            filename=filename,
+            mime_type=mime_type
         )
         file_id = result['$id']
         print(f"✅ Byte Upload Successful! ID: {file_id}")
@@ -100,25 +103,28 @@ def upload_image_from_bytes(image_data: bytes, filename: str, bucket_id: str = N
     except Exception as e:
         print(f"❌ Byte Upload Failed: {e}")
         return None
-def delete_image(bucket_id: str, file_id: str):
+
+async def delete_image(bucket_id: str, file_id: str, missing_ok: bool = False) -> bool:
     """
-    Deletes an image from the Appwrite bucket.
+    Deletes an image from the Appwrite bucket. Returns whether it is gone
+    (with `missing_ok`, a file that did not exist counts as deleted).
     """
     try:
-        storage.delete_file(bucket_id=bucket_id, file_id=file_id)
+        await appwrite_repository.delete_file(bucket_id=bucket_id, file_id=file_id)
         print(f"✅ Deleted file {file_id} from bucket {bucket_id}")
         return True
     except Exception as e:
+        if missing_ok and getattr(e, "code", None) == 404:
+            return True
         print(f"❌ Delete Failed: {e}")
+        return False
 
-def get_file_bytes(bucket_id: str, file_id: str) -> bytes:
+async def get_file_bytes(bucket_id: str, file_id: str) -> bytes:
     """
     Fetches the file content bytes from Appwrite.
     """
     try:
-        # storage.get_file_download returns the raw binary content
-        result = storage.get_file_download(bucket_id=bucket_id, file_id=file_id)
-        return result
+        return await appwrite_repository.get_file_download(bucket_id=bucket_id, file_id=file_id)
     except Exception as e:
         print(f"❌ Fetch Failed: {e}")
         return None
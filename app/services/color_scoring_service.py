@@ -11,7 +11,12 @@ from google.genai import types
 from app.core.config import settings
 from app.core.config import settings
 from app.services.vector_scoring_service import VectorScoringService, get_vector_service
-import random
+from app.services.llm_gateway import llm_gateway
+from app.services.replay import genai_client
+from app.services.image_preprocessing import image_preprocessor
+from app.services.prompt_cache import prompt_prefix_cache
+from app.services.partial_json import PartialJSONObject
+import time
 import urllib.parse
 import re
 
@@ -61,11 +66,10 @@ class ColorScoringService:
         self.api_key = settings.GOOGLE_API_KEY
         self.rules_dir = rules_dir
         self.client = None
-        if self.api_key:
-            try:
-                self.client = genai.Client(api_key=self.api_key)
-            except Exception as e:
-                logger.error(f"Failed to init Gemini client: {e}")
+        try:
+            self.client = genai_client(self.api_key)
+        except Exception as e:
+            logger.error(f"Failed to init Gemini client: {e}")
         
         # Init Vector Service for RAG (Singleton)
         self.vector_service = None
@@ -133,62 +137,20 @@ class ColorScoringService:
         except Exception as e:
             return text
 
-    def _generate_with_retry(self, contents, config):
-        """Helper to retry Gemini calls on 429 errors with custom delays: [1, 2, 3, 2]."""
-        delays = [1, 2, 3, 2]
-        retries = len(delays)
-        attempt = 0
-        
-        while attempt <= retries:
-            try:
-                response = self.client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=contents,
-                    config=config
-                )
-                return response
-            except Exception as e:
-                error_str = str(e)
-                if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                    if attempt >= retries:
-                        logger.error(f"Gemini 429 Exhausted after {retries} retries.")
-                        raise e
-                    
-                    wait_time = delays[attempt] + random.uniform(0, 0.5) # Small jitter
-                    logger.warning(f"Gemini Rate Limit (429). Retrying in {wait_time:.2f}s... (Attempt {attempt+1}/{retries})")
-                    time.sleep(wait_time)
-                    attempt += 1
-                else:
-                    raise e
+    async def _load_images(self, outfit_images: dict[str, bytes]) -> list:
+        images = []
+        for cat, data in outfit_images.items():
+            if data:
+                images.append(await image_preprocessor.to_part(data))
+        return images
 
-    def analyze_outfit_with_palette(self, outfit_images: dict[str, bytes], outfit_metadata: dict[str, dict], target_mood: str = None) -> ColorScoreResult:
+    def _retrieve_palettes(self, outfit_metadata: dict[str, dict]) -> tuple[str, list[str]]:
         """
-        Analyzes the outfit using Gemini's general knowledge + Specific Color Dictionary.
-        Includes Mood Analysis.
+        RAG RETRIEVAL: Fetch relevant palettes from Qdrant.
+        Returns (prompt text, hydrated palette lines ordered by relevance).
         """
-        if not self.client:
-            logger.error("Gemini client not initialized.")
-            return None
-
-        # Load Images
-        images = []
-        try:
-            for cat, data in outfit_images.items():
-                if data:
-                    img = Image.open(io.BytesIO(data))
-                    images.append(img)
-        except Exception as e:
-            logger.error(f"Error loading images: {e}")
-            return None
-
-        if not images:
-             return None
-
-        if not images:
-             return None
-
-        # RAG RETRIEVAL: Fetch relevant palettes from Qdrant
         retrieved_palettes = ""
+        hydrated_lines = []
         if self.vector_service:
             # Construct semantic query
             rag_query_parts = []
@@ -209,7 +171,6 @@ class ColorScoringService:
             # Split by newline or standard separator if retrieve_from_source returns a block
             # Actually retrieve_from_source returns a unified string likely separated by newlines/bullet points
             raw_lines = raw_retrieved_palettes.split("- ") # Assuming format "- Text\n"
-            hydrated_lines = []
             for line in raw_lines:
                 if line.strip():
                      hydrated_lines.append(self.hydrate_palette_text(line))
@@ -217,13 +178,18 @@ class ColorScoringService:
             retrieved_palettes = "\n\n".join(hydrated_lines)
             
             print(f"\\n[DEBUG COLOR RAG V2] Hydrated Palettes: {retrieved_palettes[:100]}...\\n")
-        
+        return retrieved_palettes, hydrated_lines
+
+    def _build_prompt(self, outfit_metadata: dict[str, dict], retrieved_palettes: str, target_mood: str = None) -> tuple[str, str]:
+        """
+        Returns (static prefix, per-request prompt).
+        """
         metadata_str = json.dumps(outfit_metadata, indent=2)
 
         mood_prompt = ""
         if target_mood:
             mood_prompt = f"""
-             2. Mood / Occasion Analysis:
+             Mood / Occasion Analysis:
                 - The user tried to dress for the following occasion: "{target_mood}".
                 - DETECT the actual mood communicated by the combined outfit.
                 - COMPARE the detected mood with the target mood "{target_mood}".
@@ -233,12 +199,13 @@ class ColorScoringService:
              """
         else:
             mood_prompt = """
-             2. Detect the Mood / Occasion:
+             Detect the Mood / Occasion:
                 - Identify the most suitable occasion for this outfit combination.
                 - Provide a brief reasoning for the detected mood.
              """
 
-        prompt = f"""
+        # Static prefix (persona, task, schema) is cached; metadata, palettes and mood are per request
+        prefix = """
         You are a deeply attracted, high-energy 'Gen Z Admirer' or 'Boyfriend'.
         
         TONE GUIDE (Based on Score):
@@ -254,21 +221,14 @@ class ColorScoringService:
         - **RULE**: Be unpredictable. Speak naturally, like a text message or a real-time reaction. React to the specific details of the outfit, not just the general "vibe".
         
         Analyze the OUTFIT COMPOSITION. Explain WHY it makes you feel this way.
-        Use the provided metadata for additional context (materials, brands, descriptions).
-        
-        OUTFIT METADATA:
-        {metadata_str}
-        
-        --- RELEVANT COLOR PALETTES (Retrieved from Dictionary) ---
-        {retrieved_palettes}
-        -----------------------------------------------------------
+        Use the OUTFIT METADATA sent with the images for additional context (materials, brands, descriptions).
 
         YOUR TASK:
         1. Analyze the Visual Harmony (Fit, Silhouette, Style).
-        {mood_prompt}
+        2. Follow the OCCASION INSTRUCTIONS sent with the images.
         
         3. COLOR PALETTE TAGGING (APPROXIMATE MATCHING REQUIRED):
-           - Scan the provided 'Dictionary of Colour Combinations'.
+           - Scan the RELEVANT COLOR PALETTES sent with the images (from the 'Dictionary of Colour Combinations').
            - find the BEST FITTING palette for this outfit, even if not 100% exact.
            - **CRITICAL**: Use VISUAL APPROXIMATION. 
              - If the user wears "Blue", and the palette has "Cobalt Blue" -> It IS a match.
@@ -283,7 +243,7 @@ class ColorScoringService:
             - Creativity/Individuality
             - Adherence to Principles 
            
-           - Check if the outfit's colors correspond to any specific named combination or palette in the "COLOR DICTIONARY MATCHES" section above.
+           - Check if the outfit's colors correspond to any specific named combination or palette in the "RELEVANT COLOR PALETTES" section.
            - If a match is found (e.g. "Hermosa Pink"), explicitly mention it in the critique.
            - You MUST add a `ScoreComponent` to the breakdown with criterion "Color Dictionary Match" and a score (10 for perfect match, 5-9 for close).
         
@@ -320,86 +280,146 @@ class ColorScoringService:
          Output valid JSON exactly matching the ColorScoreResult schema.
         """
 
+        prompt = f"""
+        OUTFIT METADATA:
+        {metadata_str}
+        
+        --- RELEVANT COLOR PALETTES (Retrieved from Dictionary) ---
+        {retrieved_palettes}
+        -----------------------------------------------------------
+
+        --- OCCASION INSTRUCTIONS ---
+        {mood_prompt}
+        """
+
+        return prefix, prompt
+
+    async def _prepare_request(self, images: list, outfit_metadata: dict[str, dict], retrieved_palettes: str, target_mood: str = None):
+        prefix, prompt = self._build_prompt(outfit_metadata, retrieved_palettes, target_mood)
+        return await prompt_prefix_cache.prepare(
+            self.client,
+            model="gemini-2.0-flash",
+            name="color-outfit",
+            version="base",
+            prefix=prefix,
+            contents=[prompt] + images[:3],
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=ColorScoreResult,
+                temperature=0.95 # Force deterministic output
+            )
+        )
+
+    def apply_palette_force_match(self, parsed_result: dict, hydrated_lines: list[str]) -> dict:
+        """
+        Needs 'matched_palette' and 'breakdown'; safe to run as soon as both are known.
+        """
+        # --- FORCE MATCH LOGIC ---
+        # Logic: IF matched_palette is "None" OR (Color Breakdown Score - Match Confidence) diff > 6
+        # THEN Force Assign Top RAG Result.
+        
+        palette_data = parsed_result.get("matched_palette", {})
+        is_none = palette_data.get("name", "None") == "None" 
+        match_confidence = palette_data.get("match_confidence", 0)
+        gemini_conf_score = match_confidence / 10.0 # Scale 0-10
+        
+        # Check Breakdown Scores
+        breakdown = parsed_result.get("breakdown", [])
+        color_score = 0
+        for item in breakdown:
+            if "Color" in item.get("criterion", ""):
+                # Max of Coordination or Dictionary Match
+                color_score = max(color_score, item.get("score", 0))
+        
+        diff = abs(color_score - gemini_conf_score)
+        print(f"[DEBUG MATCH LOGIC] Is None: {is_none}, ColorScore: {color_score}, ConfScore: {gemini_conf_score}, Diff: {diff}")
+        
+        if is_none or diff > 6:
+            print(f"[DEBUG MATCH LOGIC] Forcing fallback to top RAG result. (Diff: {diff})")
+            # Extract top palette from hydrated lines
+            if hydrated_lines:
+                # Format is "Palette: NAME (Hex..."
+                first_match = hydrated_lines[0] # The most relevant semantic match
+                # Extract Name
+                name_match = re.search(r"Palette: (.*?) \(", first_match)
+                if name_match:
+                    forced_name = name_match.group(1).strip()
+                    # SCALING FIX: Ensure score is 0-100
+                    final_conf = color_score
+                    if color_score <= 10:
+                        final_conf = color_score * 10
+                    
+                    # Cap at 99 just in case
+                    final_conf = min(int(final_conf), 99)
+
+                    parsed_result["matched_palette"] = {
+                        "name": forced_name,
+                        "reason": f"AI originally returned {palette_data.get('name')} (Conf {match_confidence}), but logic detected significant divergence (Diff {diff:.1f}). Auto-matched to top RAG result '{forced_name}'.",
+                        "match_confidence": final_conf
+                    }
+                    # Also bump the dictionary match score to reflect this
+                    for item in breakdown:
+                        if "Dictionary Match" in item.get("criterion", ""):
+                            item["score"] = max(item["score"], 8)
+        return parsed_result
+
+    def apply_pinterest_url(self, parsed_result: dict, outfit_metadata: dict[str, dict]) -> dict:
+        term = parsed_result.get("pinterest_search_term", "")
+        if term:
+            encoded = urllib.parse.quote_plus(term)
+            search_url = f"https://www.pinterest.com/search/pins/?q={encoded}"
+            parsed_result["pinterest_search_url"] = search_url
+                
+        else:
+            # Fallback if AI missed it
+            tags = " ".join([f"{meta.get('colors','')} {meta.get('tags','')}" for cat, meta in outfit_metadata.items()])
+            term = f"Scandi style {tags} outfit aesthetic".strip()
+            encoded = urllib.parse.quote_plus(term)
+            
+            search_url = f"https://www.pinterest.com/search/pins/?q={encoded}"
+            parsed_result["pinterest_search_term"] = term
+            parsed_result["pinterest_search_url"] = search_url
+
+        return parsed_result
+
+    async def analyze_outfit_with_palette(self, outfit_images: dict[str, bytes], outfit_metadata: dict[str, dict], target_mood: str = None) -> ColorScoreResult:
+        """
+        Analyzes the outfit using Gemini's general knowledge + Specific Color Dictionary.
+        Includes Mood Analysis.
+        """
+        if not self.client:
+            logger.error("Gemini client not initialized.")
+            return None
+
+        # Load Images
         try:
-            contents = [prompt] + images[:3]
+            images = await self._load_images(outfit_images)
+        except Exception as e:
+            logger.error(f"Error loading images: {e}")
+            return None
+
+        if not images:
+             return None
+
+        retrieved_palettes, hydrated_lines = self._retrieve_palettes(outfit_metadata)
+
+        try:
+            contents, config, cached = await self._prepare_request(images, outfit_metadata, retrieved_palettes, target_mood)
             
-            # Use retry wrapper
-            response = self._generate_with_retry(
+            # Shared gateway handles rate limiting and 429 retries
+            start_time = time.perf_counter()
+            response = await llm_gateway.generate_content(
+                self.client,
+                model="gemini-2.0-flash",
                 contents=contents,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=ColorScoreResult,
-                    temperature=0.95 # Force deterministic output
-                )
+                config=config
             )
+            prompt_prefix_cache.record(response, (time.perf_counter() - start_time) * 1000, cached)
             
             if hasattr(response, 'parsed') and response.parsed:
                 parsed_result = response.parsed
-                
-                # --- FORCE MATCH LOGIC ---
-                # Logic: IF matched_palette is "None" OR (Color Breakdown Score - Match Confidence) diff > 6
-                # THEN Force Assign Top RAG Result.
-                
-                palette_data = parsed_result.get("matched_palette", {})
-                is_none = palette_data.get("name", "None") == "None" 
-                match_confidence = palette_data.get("match_confidence", 0)
-                gemini_conf_score = match_confidence / 10.0 # Scale 0-10
-                
-                # Check Breakdown Scores
-                breakdown = parsed_result.get("breakdown", [])
-                color_score = 0
-                for item in breakdown:
-                    if "Color" in item.get("criterion", ""):
-                        # Max of Coordination or Dictionary Match
-                        color_score = max(color_score, item.get("score", 0))
-                
-                diff = abs(color_score - gemini_conf_score)
-                print(f"[DEBUG MATCH LOGIC] Is None: {is_none}, ColorScore: {color_score}, ConfScore: {gemini_conf_score}, Diff: {diff}")
-                
-                if is_none or diff > 6:
-                    print(f"[DEBUG MATCH LOGIC] Forcing fallback to top RAG result. (Diff: {diff})")
-                    # Extract top palette from hydrated lines
-                    if hydrated_lines:
-                        # Format is "Palette: NAME (Hex..."
-                        first_match = hydrated_lines[0] # The most relevant semantic match
-                        # Extract Name
-                        import re
-                        name_match = re.search(r"Palette: (.*?) \(", first_match)
-                        if name_match:
-                            forced_name = name_match.group(1).strip()
-                            # SCALING FIX: Ensure score is 0-100
-                            final_conf = color_score
-                            if color_score <= 10:
-                                final_conf = color_score * 10
-                            
-                            # Cap at 99 just in case
-                            final_conf = min(int(final_conf), 99)
-
-                            parsed_result["matched_palette"] = {
-                                "name": forced_name,
-                                "reason": f"AI originally returned {palette_data.get('name')} (Conf {match_confidence}), but logic detected significant divergence (Diff {diff:.1f}). Auto-matched to top RAG result '{forced_name}'.",
-                                "match_confidence": final_conf
-                            }
-                            # Also bump the dictionary match score to reflect this
-                            for item in breakdown:
-                                if "Dictionary Match" in item.get("criterion", ""):
-                                    item["score"] = max(item["score"], 8)
-                
-                term = parsed_result.get("pinterest_search_term", "")
-                if term:
-                    encoded = urllib.parse.quote_plus(term)
-                    search_url = f"https://www.pinterest.com/search/pins/?q={encoded}"
-                    parsed_result["pinterest_search_url"] = search_url
-                        
-                else:
-                    # Fallback if AI missed it
-                    tags = " ".join([f"{meta.get('colors','')} {meta.get('tags','')}" for cat, meta in outfit_metadata.items()])
-                    term = f"Scandi style {tags} outfit aesthetic".strip()
-                    encoded = urllib.parse.quote_plus(term)
-                    
-                    search_url = f"https://www.pinterest.com/search/pins/?q={encoded}"
-                    parsed_result["pinterest_search_term"] = term
-                    parsed_result["pinterest_search_url"] = search_url
+                self.apply_palette_force_match(parsed_result, hydrated_lines)
+                self.apply_pinterest_url(parsed_result, outfit_metadata)
 
                 print(f"\\n[DEBUG COLOR GEMINI] Parsed Response:\\n{parsed_result}")
                 return parsed_result
@@ -409,5 +429,56 @@ class ColorScoringService:
         except Exception as e:
             logger.error(f"Analysis Failed: {e}")
             return None
+    async def stream_outfit_with_palette(self, outfit_images: dict[str, bytes], outfit_metadata: dict[str, dict], target_mood: str = None):
+        """
+        Streaming variant of analyze_outfit_with_palette.
+        Async generator of (event, data): "rag_context", "partial", "result".
+        Pinterest URL and palette force-match are applied as soon as their input fields complete.
+        Raises on failure so the caller can emit an error event.
+        """
+        if not self.client:
+            raise RuntimeError("Gemini client not initialized.")
+
+        images = await self._load_images(outfit_images)
+        if not images:
+            raise ValueError("No valid images provided for outfit analysis.")
+
+        retrieved_palettes, hydrated_lines = self._retrieve_palettes(outfit_metadata)
+        yield "rag_context", {"palettes": hydrated_lines}
+
+        contents, config, cached = await self._prepare_request(images, outfit_metadata, retrieved_palettes, target_mood)
+
+        parser = PartialJSONObject()
+        force_matched = False
+        last_chunk = None
+        start_time = time.perf_counter()
+        async for chunk in llm_gateway.generate_content_stream(
+            self.client,
+            model="gemini-2.0-flash",
+            contents=contents,
+            config=config
+        ):
+            last_chunk = chunk
+            fields = parser.feed(chunk.text or "")
+            if not fields:
+                continue
+
+            if "pinterest_search_term" in fields and fields["pinterest_search_term"]:
+                self.apply_pinterest_url(fields, outfit_metadata)
+
+            if not force_matched and "matched_palette" in parser.fields and "breakdown" in parser.fields:
+                force_matched = True
+                self.apply_palette_force_match(parser.fields, hydrated_lines)
+                fields["matched_palette"] = parser.fields["matched_palette"]
+                fields["breakdown"] = parser.fields["breakdown"]
+
+            yield "partial", fields
 
+        prompt_prefix_cache.record(last_chunk, (time.perf_counter() - start_time) * 1000, cached)
 
+        # Re-use the already corrected fields rather than the raw text
+        parsed_result = {**parser.result(), **parser.fields}
+        if not force_matched:
+            self.apply_palette_force_match(parsed_result, hydrated_lines)
+        self.apply_pinterest_url(parsed_result, outfit_metadata)
+        yield "result", parsed_result
@@ -1,11 +1,15 @@
 from google import genai
 from google.genai import types
+import asyncio
 import json
 import typing_extensions as typing
 from PIL import Image, UnidentifiedImageError
 import logging
 import io
 from app.core.config import settings
+from app.services.llm_gateway import llm_gateway, estimate_tokens, is_rate_limit_error
+from app.services.image_preprocessing import image_preprocessor
+from app.services.replay import genai_client
 
 logger = logging.getLogger(__name__)
 
@@ -21,41 +25,15 @@ class OutfitAnalysis(typing.TypedDict):
     summary: str
     items: list[ClothingItem]
 
-class GeminiFashionService:
-    def __init__(self):
-        # Initialize the new Google GenAI Client
-        self.api_key = settings.GOOGLE_API_KEY
-        if not self.api_key:
-            logger.warning("GOOGLE_API_KEY not found in settings.")
-            self.client = None
-        else:
-            try:
-                self.client = genai.Client(api_key=self.api_key)
-            except Exception as e:
-                logger.error(f"Error initializing Gemini client: {e}")
-                self.client = None
-
-    def analyze_image(self, image_path: str = None, image_data: bytes = None):
-        """
-        Analyze image from path or bytes using Gemini.
-        """
-        if not self.client:
-            logger.error("Gemini client not initialized.")
-            return None
+class BatchImageAnalysis(typing.TypedDict):
+    image_index: int
+    summary: str
+    items: list[ClothingItem]
 
-        try:
-            # Load Image
-            img = None
-            if image_data:
-                img = Image.open(io.BytesIO(image_data))
-            elif image_path:
-                img = Image.open(image_path)
-            else:
-                logger.error("No image provided.")
-                return None
+class BatchAnalysis(typing.TypedDict):
+    results: list[BatchImageAnalysis]
 
-            # 3. The Prompt
-            prompt = """
+GARMENT_ANALYSIS_PROMPT = """
             Analyze the image to identify any clothing items.
             The image may contain a full outfit on a person, OR a standalone garment (flat lay, hanger, or product shot).
             
@@ -162,11 +140,64 @@ class GeminiFashionService:
             }
             """
 
+BATCH_INSTRUCTIONS = """
+            BATCH MODE:
+            You will receive several images, each preceded by a label "Image <n>:".
+            Analyze every image independently using the rules above.
+            Return exactly one entry in 'results' per image, with 'image_index' set to <n>.
+            Never merge items from different images into one entry.
+            """
+
+class GeminiFashionService:
+    def __init__(self):
+        # Initialize the new Google GenAI Client
+        self.api_key = settings.GOOGLE_API_KEY
+        try:
+            # None without an API key, unless fixtures are being replayed
+            self.client = genai_client(self.api_key)
+        except Exception as e:
+            logger.error(f"Error initializing Gemini client: {e}")
+            self.client = None
+        if not self.client:
+            logger.warning("GOOGLE_API_KEY not found in settings.")
+
+        # Learned from batch responses; drives the adaptive batch size
+        self.output_tokens_per_image = float(settings.GEMINI_BATCH_OUTPUT_TOKENS_PER_IMAGE)
+        self.batch_stats = {
+            "batches": 0,
+            "batched_images": 0,
+            "splits": 0,
+            "individual_retries": 0,
+            "failed_images": 0,
+        }
+
+    async def analyze_image(self, image_path: str = None, image_data: bytes = None):
+        """
+        Analyze image from path or bytes using Gemini.
+        """
+        if not self.client:
+            logger.error("Gemini client not initialized.")
+            return None
+
+        try:
+            # Load Image (downscaled / re-encoded before upload)
+            if image_path and not image_data:
+                with open(image_path, "rb") as f:
+                    image_data = f.read()
+            if not image_data:
+                logger.error("No image provided.")
+                return None
+            img = await image_preprocessor.to_part(image_data)
+
+            # 3. The Prompt
+            prompt = GARMENT_ANALYSIS_PROMPT
+
             # 4. Generate Content
-            # The new SDK uses client.models.generate_content
-            # 'contents' accepts text and images (PIL Image is supported)
+            # Routed through the shared gateway (rate limits, retries, timeout)
+            # 'contents' accepts text and image Parts
             
-            response = self.client.models.generate_content(
+            response = await llm_gateway.generate_content(
+                self.client,
                 model="gemini-2.0-flash", # Using strict name or 'gemini-2.0-flash' as seen in logs
                 contents=[prompt, img],
                 config=types.GenerateContentConfig(
@@ -188,4 +219,129 @@ class GeminiFashionService:
             logger.error(f"Gemini Analysis Failed: {e}")
             return None
 
+    def batch_size(self) -> int:
+        """
+        Images per call, bounded by the output token limit (with 25% headroom
+        over the observed per-image output) and GEMINI_BATCH_MAX_IMAGES.
+        """
+        per_image = self.output_tokens_per_image * 1.25
+        by_tokens = int(settings.GEMINI_BATCH_MAX_OUTPUT_TOKENS // per_image)
+        return max(1, min(settings.GEMINI_BATCH_MAX_IMAGES, by_tokens))
+
+    async def analyze_images(self, images: dict) -> dict:
+        """
+        Batch variant of analyze_image for bulk imports.
+        `images` maps a caller id (e.g. wardrobe ID) to image bytes; returns the
+        same ids mapped to an OutfitAnalysis, or None if the image could not be analyzed.
+        """
+        results = {image_id: None for image_id in images}
+        if not self.client:
+            logger.error("Gemini client not initialized.")
+            return results
+
+        ids = list(images.keys())
+        prepared = await asyncio.gather(
+            *(image_preprocessor.to_part(images[image_id]) for image_id in ids),
+            return_exceptions=True
+        )
+
+        parts = {}
+        for image_id, part in zip(ids, prepared):
+            if isinstance(part, Exception):
+                logger.error(f"Skipping unreadable image {image_id}: {part}")
+                self.batch_stats["failed_images"] += 1
+            else:
+                parts[image_id] = part
+
+        pending = list(parts.keys())
+        size = self.batch_size()
+        batches = [pending[i:i + size] for i in range(0, len(pending), size)]
+        await asyncio.gather(*(self._run_batch(batch, parts, images, results) for batch in batches))
+        return results
+
+    async def _run_batch(self, ids: list, parts: dict, images: dict, results: dict):
+        try:
+            analyses = await self._analyze_batch([parts[image_id] for image_id in ids])
+        except Exception as e:
+            if is_rate_limit_error(e):
+                # Gateway already exhausted its retries; splitting would only add calls
+                logger.error(f"Batch of {len(ids)} images rate limited: {e}")
+                self.batch_stats["failed_images"] += len(ids)
+                return
+            if len(ids) > 1:
+                # Usually a truncated or malformed response: halve and try again
+                logger.warning(f"Batch of {len(ids)} images failed ({e}), splitting")
+                self.batch_stats["splits"] += 1
+                mid = len(ids) // 2
+                await asyncio.gather(
+                    self._run_batch(ids[:mid], parts, images, results),
+                    self._run_batch(ids[mid:], parts, images, results)
+                )
+                return
+            analyses = {}
+
+        retry = []
+        for index, image_id in enumerate(ids):
+            analysis = analyses.get(index)
+            if isinstance(analysis, dict) and isinstance(analysis.get("items"), list):
+                results[image_id] = analysis
+            else:
+                retry.append(image_id)
+
+        if not retry:
+            return
+
+        # Images the batch skipped or answered badly get a dedicated call
+        self.batch_stats["individual_retries"] += len(retry)
+        retried = await asyncio.gather(*(self.analyze_image(image_data=images[image_id]) for image_id in retry))
+        for image_id, analysis in zip(retry, retried):
+            results[image_id] = analysis
+            if not analysis:
+                self.batch_stats["failed_images"] += 1
+
+    async def _analyze_batch(self, parts: list) -> dict:
+        """
+        One structured-output call for several images.
+        Returns {image_index: OutfitAnalysis}; raises if the response is truncated or unparsable.
+        """
+        contents = [GARMENT_ANALYSIS_PROMPT + BATCH_INSTRUCTIONS]
+        for index, part in enumerate(parts):
+            contents.append(f"Image {index}:")
+            contents.append(part)
+
+        response = await llm_gateway.generate_content(
+            self.client,
+            model="gemini-2.0-flash",
+            contents=contents,
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=BatchAnalysis,
+                max_output_tokens=settings.GEMINI_BATCH_MAX_OUTPUT_TOKENS
+            ),
+            estimated_tokens=estimate_tokens(contents) + int(self.output_tokens_per_image * len(parts))
+        )
+        self.batch_stats["batches"] += 1
+        self.batch_stats["batched_images"] += len(parts)
+
+        candidates = getattr(response, "candidates", None) or []
+        finish_reason = str(getattr(candidates[0], "finish_reason", "")) if candidates else ""
+        if "MAX_TOKENS" in finish_reason:
+            # Later batches must be smaller than this one
+            self.output_tokens_per_image = max(self.output_tokens_per_image, settings.GEMINI_BATCH_MAX_OUTPUT_TOKENS / len(parts))
+            raise ValueError("Batch response truncated at max_output_tokens")
+
+        usage = getattr(response, "usage_metadata", None)
+        output_tokens = getattr(usage, "candidates_token_count", None) if usage else None
+        if output_tokens:
+            # Moving average so one terse batch does not inflate the next batch size
+            self.output_tokens_per_image = 0.7 * self.output_tokens_per_image + 0.3 * (output_tokens / len(parts))
+
+        parsed = json.loads(response.text)
+        analyses = {}
+        for entry in parsed.get("results", []):
+            index = entry.get("image_index")
+            if isinstance(index, int) and 0 <= index < len(parts) and index not in analyses:
+                analyses[index] = {"summary": entry.get("summary", ""), "items": entry.get("items")}
+        return analyses
+
 gemini_service = GeminiFashionService()
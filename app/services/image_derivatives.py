@@ -0,0 +1,99 @@
+import asyncio
+import io
+import logging
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.services.appwrite_storage import upload_image_from_bytes, delete_image
+
+logger = logging.getLogger(__name__)
+
+
+def derivative_file_id(file_id: str, size: str) -> str:
+    # Stored next to the original under a predictable ID, so no DB lookup is needed
+    return f"{file_id}_{size}"
+
+
+def proxy_image_url(bucket_id: str, image_id: str, size: str = None) -> str:
+    url = f"/proxy/images/{bucket_id}/{image_id}"
+    if size and size in settings.IMAGE_DERIVATIVES:
+        url += f"?size={size}"
+    return url
+
+
+def render_derivatives(data: bytes) -> dict:
+    """
+    Returns {size name: WebP bytes}. Orientation is baked in from EXIF and
+    no metadata (EXIF, XMP, ICC) is written to the output.
+    """
+    img = Image.open(io.BytesIO(data))
+    largest = max(settings.IMAGE_DERIVATIVES.values())
+    if img.format == "JPEG":
+        img.draft("RGB", (largest, largest))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+
+    rendered = {}
+    # Largest first so each smaller size is downscaled from an already reduced image
+    for size, edge in sorted(settings.IMAGE_DERIVATIVES.items(), key=lambda kv: -kv[1]):
+        img.thumbnail((edge, edge), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="WEBP", quality=settings.IMAGE_DERIVATIVE_QUALITY, method=4)
+        rendered[size] = out.getvalue()
+    return rendered
+
+
+class DerivativeGenerator:
+    """
+    Builds and stores thumbnail/medium derivatives in the background after an upload.
+    """
+    def __init__(self):
+        self._tasks = set()
+        self.stats = {"generated": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def schedule(self, bucket_id: str, image_id: str, data: bytes):
+        if not settings.IMAGE_DERIVATIVES_ENABLED:
+            return
+        task = asyncio.create_task(self.generate(bucket_id, image_id, data))
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def generate(self, bucket_id: str, image_id: str, data: bytes) -> bool:
+        try:
+            rendered = await run_in_threadpool(render_derivatives, data)
+        except Exception as e:
+            logger.error(f"Derivative rendering failed for {image_id}: {e}")
+            self.stats["failed"] += 1
+            return False
+
+        results = await asyncio.gather(*(
+            upload_image_from_bytes(
+                image_data=webp,
+                filename=f"{image_id}_{size}.webp",
+                bucket_id=bucket_id,
+                file_id=derivative_file_id(image_id, size),
+                mime_type="image/webp"
+            )
+            for size, webp in rendered.items()
+        ))
+        if not all(results):
+            self.stats["failed"] += 1
+            return False
+
+        self.stats["generated"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += sum(len(webp) for webp in rendered.values())
+        return True
+
+    async def delete(self, bucket_id: str, image_id: str) -> bool:
+        """Removes every derivative of an image (missing ones are ignored). Returns whether all are gone."""
+        results = await asyncio.gather(*(
+            delete_image(bucket_id, derivative_file_id(image_id, size), missing_ok=True)
+            for size in settings.IMAGE_DERIVATIVES
+        ))
+        return all(results)
+
+
+derivative_generator = DerivativeGenerator()
@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import io
+import logging
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps
+from google.genai import types
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Formats Gemini accepts as-is, so small images can skip decode/re-encode
+PASSTHROUGH_FORMATS = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+class ImagePreprocessor:
+    """
+    Shrinks uploaded photos before they are sent to the LLM.
+    Fixes EXIF orientation, downscales to a max long edge (using JPEG draft mode
+    so large JPEGs are decoded at reduced scale) and re-encodes as JPEG.
+    Results are cached by content hash.
+    """
+    def __init__(self):
+        self.max_edge = settings.IMAGE_MAX_EDGE
+        self.quality = settings.IMAGE_JPEG_QUALITY
+        self.passthrough_max_bytes = settings.IMAGE_PASSTHROUGH_MAX_BYTES
+        self.cache_entries = settings.IMAGE_CACHE_ENTRIES
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"cache_hits": 0, "passthrough": 0, "resized": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def preprocess(self, data: bytes) -> tuple[bytes, str]:
+        """
+        Returns (image_bytes, mime_type) ready for the LLM. `data` may be any bytes-like object.
+        Raises PIL.UnidentifiedImageError for non-image input.
+        """
+        key = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached:
+                self._cache.move_to_end(key)
+                self.stats["cache_hits"] += 1
+                return cached
+
+        image_bytes, mime_type, outcome = self._process(data)
+        result = (image_bytes, mime_type)
+
+        with self._lock:
+            self.stats[outcome] += 1
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+            self.stats["bytes_in"] += len(data)
+            self.stats["bytes_out"] += len(result[0])
+        return result
+
+    def _process(self, data: bytes) -> tuple[bytes, str, str]:
+        # Returns (image_bytes, mime_type, "passthrough" | "resized"); stats are updated by the caller under the lock
+        # Image.open only parses the header; pixels are decoded on load()
+        img = Image.open(io.BytesIO(data))
+
+        if self._can_pass_through(img, data):
+            # Own copy: `data` may be a view over a spooled upload
+            return bytes(data), PASSTHROUGH_FORMATS[img.format], "passthrough"
+
+        if img.format == "JPEG":
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when the target allows it
+            img.draft("RGB", (self.max_edge, self.max_edge))
+
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=self.quality)
+        return out.getvalue(), "image/jpeg", "resized"
+
+    def _can_pass_through(self, img: Image.Image, data: bytes) -> bool:
+        if img.format not in PASSTHROUGH_FORMATS:
+            return False
+        if len(data) > self.passthrough_max_bytes:
+            return False
+        if max(img.size) > self.max_edge:
+            return False
+        # Rotated photos still need the EXIF transpose
+        return img.getexif().get(EXIF_ORIENTATION_TAG, 1) == 1
+
+    async def to_part(self, data: bytes) -> types.Part:
+        """
+        Preprocesses off the event loop and wraps the result as a Gemini Part.
+        """
+        image_bytes, mime_type = await asyncio.to_thread(self.preprocess, data)
+        return types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+
+
+image_preprocessor = ImagePreprocessor()
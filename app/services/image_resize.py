@@ -0,0 +1,106 @@
+import asyncio
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, features
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+
+def avif_supported() -> bool:
+    try:
+        return features.check("avif")
+    except ValueError:
+        # Pillow builds that predate AVIF support do not know the feature name
+        return False
+
+
+AVIF_AVAILABLE = avif_supported()
+
+
+def negotiate_format(accept: str):
+    """
+    Picks the best output format the client accepts: AVIF, then WebP.
+    Returns None when neither is accepted (the source format is kept).
+    """
+    accept = (accept or "").lower()
+    if settings.PROXY_RESIZE_AVIF and AVIF_AVAILABLE and "image/avif" in accept:
+        return "avif"
+    if "image/webp" in accept:
+        return "webp"
+    return None
+
+
+def render_variant(data: bytes, width: int = None, height: int = None, quality: int = 80, fmt: str = None):
+    """
+    Resizes to fit within width x height (never upscaling) and re-encodes.
+    Runs in a worker process, so it only takes and returns plain values.
+    Returns (bytes, format).
+    """
+    img = Image.open(io.BytesIO(data))
+    source_format = (img.format or "").lower()
+    box = (width or img.width, height or img.height)
+    if source_format == "jpeg":
+        img.draft("RGB", box)
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail(box, Image.LANCZOS)
+
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    if fmt is None:
+        fmt = source_format if source_format in ("jpeg", "png", "webp") else ("png" if has_alpha else "jpeg")
+    if fmt == "jpeg" or not has_alpha:
+        img = img.convert("RGB")
+    elif img.mode != "RGBA":
+        img = img.convert("RGBA")
+
+    out = io.BytesIO()
+    if fmt == "png":
+        img.save(out, format="PNG", optimize=True)
+    else:
+        img.save(out, format=fmt.upper(), quality=quality)
+    return out.getvalue(), fmt
+
+
+class ImageResizer:
+    """
+    Runs render_variant in a process pool so resizing never blocks the
+    event loop or competes with it for the GIL. PROXY_RESIZE_WORKERS=0
+    falls back to the thread pool.
+    """
+    def __init__(self):
+        self.workers = settings.PROXY_RESIZE_WORKERS
+        self._pool = None
+        self.stats = {"renders": 0, "failures": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def _executor(self):
+        if self._pool is None and self.workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    async def resize(self, data: bytes, width: int = None, height: int = None, quality: int = 80, fmt: str = None):
+        """Returns (bytes, media type); raises on undecodable input."""
+        pool = self._executor()
+        try:
+            if pool is None:
+                rendered, fmt = await run_in_threadpool(render_variant, data, width, height, quality, fmt)
+            else:
+                rendered, fmt = await asyncio.get_running_loop().run_in_executor(pool, render_variant, data, width, height, quality, fmt)
+        except Exception:
+            self.stats["failures"] += 1
+            raise
+        self.stats["renders"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(rendered)
+        return rendered, MEDIA_TYPES[fmt]
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+image_resizer = ImageResizer()
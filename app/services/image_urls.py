@@ -0,0 +1,56 @@
+import base64
+import hashlib
+import hmac
+import time
+from urllib.parse import urlencode
+from app.core.config import settings
+from app.services.image_derivatives import proxy_image_url
+
+
+def signature(bucket_id: str, file_id: str, size: str, expires: int) -> str:
+    """
+    HMAC-SHA256 over "{bucket_id}/{file_id}:{size}:{expires}" (size empty for
+    originals), urlsafe base64 without padding. Edge handlers must compute
+    exactly this string to validate a URL.
+    """
+    message = f"{bucket_id}/{file_id}:{size or ''}:{expires}".encode()
+    digest = hmac.new(settings.IMAGE_SIGNING_KEY.encode(), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def verify_signature(bucket_id: str, file_id: str, size: str, expires: int, sig: str, now: float = None) -> bool:
+    if not settings.IMAGE_SIGNING_KEY or not sig:
+        return False
+    if expires < (now or time.time()):
+        return False
+    return hmac.compare_digest(signature(bucket_id, file_id, size, expires), sig)
+
+
+def signed_image_url(bucket_id: str, image_id: str, size: str = None, now: float = None) -> str:
+    ttl = settings.IMAGE_SIGNED_URL_TTL_SECONDS
+    # Expiry is rounded up to a quarter of the TTL so repeated listings hand
+    # out identical URLs (client and CDN caches keep hitting)
+    window = max(ttl // 4, 1)
+    expires = (int(now or time.time()) + ttl) // window * window + window
+    if size not in settings.IMAGE_DERIVATIVES:
+        size = None
+    params = {"expires": expires, "sig": signature(bucket_id, image_id, size, expires)}
+    if size:
+        params["size"] = size
+    return f"{settings.IMAGE_SIGNED_URL_BASE}/{bucket_id}/{image_id}?{urlencode(params)}"
+
+
+def signing_enabled() -> bool:
+    # Settings refuse signed mode without a key
+    return settings.IMAGE_URL_MODE == "signed"
+
+
+def image_url(bucket_id: str, image_id: str, size: str = None) -> str:
+    """Client-facing URL for a stored image, per IMAGE_URL_MODE ("proxy" or "signed")."""
+    if signing_enabled():
+        return signed_image_url(bucket_id, image_id, size)
+    return proxy_image_url(bucket_id, image_id, size)
+
+
+def image_variants(bucket_id: str, image_id: str) -> dict:
+    return {size: image_url(bucket_id, image_id, size) for size in settings.IMAGE_DERIVATIVES}
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import random
+import time
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Gemini bills every image part at a flat rate regardless of resolution
+IMAGE_TOKEN_ESTIMATE = 258
+
+
+class TokenBucket:
+    """
+    Simple per-minute token bucket. Refills continuously.
+    """
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        self._refill()
+        # A single request larger than the bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        # Allowed to go negative so under-estimates are paid back by later callers
+        self._refill()
+        self.tokens -= amount
+
+
+def estimate_tokens(contents) -> int:
+    """
+    Rough prompt size estimate used for TPM accounting before the call.
+    Text is ~4 chars per token, images are billed at a flat rate.
+    """
+    total = 0
+    for part in contents:
+        if isinstance(part, str):
+            total += len(part) // 4
+        else:
+            total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+
+def is_rate_limit_error(exc: Exception) -> bool:
+    if getattr(exc, "code", None) == 429:
+        return True
+    error_str = str(exc)
+    return "429" in error_str or "RESOURCE_EXHAUSTED" in error_str
+
+
+class LLMGateway:
+    """
+    Process-wide gateway for all Gemini calls.
+    Queues callers behind RPM/TPM token buckets and a concurrency cap,
+    retries 429s with jittered exponential backoff and enforces a per-call timeout.
+    """
+    def __init__(self):
+        self.request_bucket = TokenBucket(settings.LLM_REQUESTS_PER_MINUTE)
+        self.token_bucket = TokenBucket(settings.LLM_TOKENS_PER_MINUTE)
+        self.max_retries = settings.LLM_MAX_RETRIES
+        self.timeout = settings.LLM_TIMEOUT_SECONDS
+        self.backoff_base = settings.LLM_BACKOFF_BASE_SECONDS
+        self.backoff_max = settings.LLM_BACKOFF_MAX_SECONDS
+
+        # Created lazily so they bind to the running server loop
+        self._semaphore = None
+        self._bucket_lock = None
+
+        self.metrics = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "timeouts": 0,
+            "queue_wait_total_ms": 0.0,
+            "queue_wait_max_ms": 0.0,
+            "tokens_used": 0,
+        }
+
+    def _primitives(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+            self._bucket_lock = asyncio.Lock()
+        return self._semaphore, self._bucket_lock
+
+    async def _acquire_budget(self, tokens: int):
+        # Lock keeps waiters FIFO so a burst drains in arrival order
+        _, bucket_lock = self._primitives()
+        async with bucket_lock:
+            while True:
+                wait = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+                if wait <= 0:
+                    self.request_bucket.consume(1)
+                    self.token_bucket.consume(tokens)
+                    return
+                await asyncio.sleep(wait)
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # Equal jitter: keeps at least half the exponential delay, randomizes the rest
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(cap / 2, cap)
+
+    async def generate_content(self, client, model: str, contents: list, config=None, estimated_tokens: int = None):
+        """
+        Rate-limited, retried equivalent of client.models.generate_content.
+        """
+        if estimated_tokens is None:
+            estimated_tokens = estimate_tokens(contents)
+
+        self.metrics["calls"] += 1
+        semaphore, _ = self._primitives()
+        attempt = 0
+
+        while True:
+            queued_at = time.monotonic()
+            await self._acquire_budget(estimated_tokens)
+            async with semaphore:
+                wait_ms = (time.monotonic() - queued_at) * 1000
+                self.metrics["queue_wait_total_ms"] += wait_ms
+                self.metrics["queue_wait_max_ms"] = max(self.metrics["queue_wait_max_ms"], wait_ms)
+
+                try:
+                    response = await asyncio.wait_for(
+                        client.aio.models.generate_content(model=model, contents=contents, config=config),
+                        timeout=self.timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.metrics["timeouts"] += 1
+                    self.metrics["failed"] += 1
+                    logger.error(f"Gemini call timed out after {self.timeout}s")
+                    raise
+                except Exception as e:
+                    if not is_rate_limit_error(e):
+                        self.metrics["failed"] += 1
+                        raise
+                    self.metrics["rate_limited"] += 1
+                    if attempt >= self.max_retries:
+                        self.metrics["failed"] += 1
+                        logger.error(f"Gemini 429 Exhausted after {self.max_retries} retries.")
+                        raise
+                    error = e
+                else:
+                    self.metrics["succeeded"] += 1
+                    self._settle_tokens(response, estimated_tokens)
+                    return response
+
+            # Back off outside the semaphore so other callers are not blocked
+            wait_time = self._backoff_delay(attempt)
+            attempt += 1
+            self.metrics["retries"] += 1
+            logger.warning(f"Gemini Rate Limit ({error}). Retrying in {wait_time:.2f}s... (Attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(wait_time)
+
+    async def generate_content_stream(self, client, model: str, contents: list, config=None, estimated_tokens: int = None):
+        """
+        Rate-limited equivalent of client.models.generate_content_stream (async generator of chunks).
+        429s are retried only until the first chunk arrives; the timeout covers the whole stream.
+        """
+        if estimated_tokens is None:
+            estimated_tokens = estimate_tokens(contents)
+
+        self.metrics["calls"] += 1
+        semaphore, _ = self._primitives()
+        attempt = 0
+
+        while True:
+            queued_at = time.monotonic()
+            await self._acquire_budget(estimated_tokens)
+            async with semaphore:
+                wait_ms = (time.monotonic() - queued_at) * 1000
+                self.metrics["queue_wait_total_ms"] += wait_ms
+                self.metrics["queue_wait_max_ms"] = max(self.metrics["queue_wait_max_ms"], wait_ms)
+
+                deadline = time.monotonic() + self.timeout
+                last_chunk = None
+                try:
+                    stream = await asyncio.wait_for(
+                        client.aio.models.generate_content_stream(model=model, contents=contents, config=config),
+                        timeout=self.timeout
+                    )
+                    iterator = stream.__aiter__()
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), timeout=remaining)
+                        except StopAsyncIteration:
+                            break
+                        last_chunk = chunk
+                        yield chunk
+                except asyncio.TimeoutError:
+                    self.metrics["timeouts"] += 1
+                    self.metrics["failed"] += 1
+                    logger.error(f"Gemini stream timed out after {self.timeout}s")
+                    raise
+                except Exception as e:
+                    if last_chunk is not None or not is_rate_limit_error(e):
+                        self.metrics["failed"] += 1
+                        raise
+                    self.metrics["rate_limited"] += 1
+                    if attempt >= self.max_retries:
+                        self.metrics["failed"] += 1
+                        logger.error(f"Gemini 429 Exhausted after {self.max_retries} retries.")
+                        raise
+                    error = e
+                else:
+                    self.metrics["succeeded"] += 1
+                    # The final chunk carries usage for the whole response
+                    self._settle_tokens(last_chunk, estimated_tokens)
+                    return
+
+            wait_time = self._backoff_delay(attempt)
+            attempt += 1
+            self.metrics["retries"] += 1
+            logger.warning(f"Gemini Rate Limit ({error}). Retrying in {wait_time:.2f}s... (Attempt {attempt}/{self.max_retries})")
+            await asyncio.sleep(wait_time)
+
+    def _settle_tokens(self, response, estimated_tokens: int):
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", None) if usage else None
+        if not actual:
+            self.metrics["tokens_used"] += estimated_tokens
+            return
+        self.metrics["tokens_used"] += actual
+        if actual > estimated_tokens:
+            self.token_bucket.consume(actual - estimated_tokens)
+
+    def snapshot(self) -> dict:
+        data = dict(self.metrics)
+        calls = data["calls"] + data["retries"]
+        data["queue_wait_avg_ms"] = data["queue_wait_total_ms"] / calls if calls else 0.0
+        return data
+
+
+llm_gateway = LLMGateway()
@@ -4,6 +4,7 @@ import io
 import os
 import logging
 from app.core.config import settings
+from app.services.replay import replay_harness, moondream_model
 
 logger = logging.getLogger(__name__)
 
@@ -11,12 +12,12 @@ class MoondreamService:
     def __init__(self):
         # Initialize with settings
         self.api_key = settings.MOONDREAM_API_KEY
-        if not self.api_key:
+        if not self.api_key and not replay_harness.replaying("moondream"):
             logger.warning("MOONDREAM_API_KEY not found in settings.")
             self.model = None
         else:
             try:
-                self.model = md.vl(api_key=self.api_key)
+                self.model = moondream_model(lambda: md.vl(api_key=self.api_key))
             except Exception as e:
                 logger.error(f"Error initializing Moondream client: {e}")
                 self.model = None
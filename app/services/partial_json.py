@@ -0,0 +1,58 @@
+import json
+
+
+class PartialJSONObject:
+    """
+    Incrementally parses a streamed JSON object and reports top-level fields
+    as soon as their values are complete, e.g. {"total_score": 82, "breakdown": [...
+    yields total_score before breakdown has finished streaming.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.fields = {}
+        self._decoder = json.JSONDecoder()
+        self._pos = None  # index just after the last complete field
+
+    def feed(self, text: str) -> dict:
+        """
+        Adds streamed text and returns the fields completed by it.
+        """
+        self.buffer += text
+        new_fields = {}
+
+        if self._pos is None:
+            start = self.buffer.find("{")
+            if start == -1:
+                return new_fields
+            self._pos = start + 1
+
+        while True:
+            pos = self._skip(self._pos, ",")
+            if pos >= len(self.buffer) or self.buffer[pos] == "}":
+                return new_fields
+            try:
+                key, pos = self._decoder.raw_decode(self.buffer, pos)
+                pos = self._skip(pos, ":")
+                value, pos = self._decoder.raw_decode(self.buffer, pos)
+            except (json.JSONDecodeError, IndexError):
+                # Value still streaming in
+                return new_fields
+
+            # A number at the very end of the buffer may still have digits coming
+            if pos >= len(self.buffer.rstrip()) and isinstance(value, (int, float)):
+                return new_fields
+
+            self.fields[key] = value
+            new_fields[key] = value
+            self._pos = pos
+
+    def _skip(self, pos: int, separator: str) -> int:
+        while pos < len(self.buffer) and (self.buffer[pos].isspace() or self.buffer[pos] == separator):
+            pos += 1
+        return pos
+
+    def result(self) -> dict:
+        """
+        Full parse of the finished buffer.
+        """
+        return json.loads(self.buffer)
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import logging
+import time
+from google.genai import types
+from app.core.config import settings
+from app.services.llm_gateway import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class PromptCacheBackend:
+    """
+    Interface for registering a static prompt prefix with a provider.
+    server_side backends return a handle the model can reference
+    (GenerateContentConfig.cached_content); others make callers inline the text.
+    """
+    server_side = False
+
+    async def register(self, client, model: str, key: str, prefix: str, ttl_seconds: int) -> str:
+        raise NotImplementedError
+
+    async def release(self, client, name: str):
+        pass
+
+
+class InProcessPromptCacheBackend(PromptCacheBackend):
+    """
+    Offline stand-in. Keeps prefixes in memory so registration, reuse and
+    invalidation can be exercised without the Gemini caches API.
+    """
+    def __init__(self):
+        self.entries = {}
+        self._registered = 0
+
+    async def register(self, client, model: str, key: str, prefix: str, ttl_seconds: int) -> str:
+        # Unique per registration, like server-side handles, so retiring an old one never drops its refresh
+        self._registered += 1
+        name = f"local/{key}/{self._registered}"
+        self.entries[name] = prefix
+        return name
+
+    async def release(self, client, name: str):
+        self.entries.pop(name, None)
+
+
+class GeminiPromptCacheBackend(PromptCacheBackend):
+    """
+    Gemini explicit context caching (client.caches).
+    """
+    server_side = True
+
+    async def register(self, client, model: str, key: str, prefix: str, ttl_seconds: int) -> str:
+        cache = await client.aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=key,
+                contents=[prefix],
+                ttl=f"{ttl_seconds}s"
+            )
+        )
+        return cache.name
+
+    async def release(self, client, name: str):
+        await client.aio.caches.delete(name=name)
+
+
+def get_prompt_cache_backend(name: str) -> PromptCacheBackend:
+    if name == "gemini":
+        return GeminiPromptCacheBackend()
+    if name == "local":
+        return InProcessPromptCacheBackend()
+    return None
+
+
+class PromptPrefixCache:
+    """
+    Registers each static prompt prefix (persona, task, schema, static rules)
+    once per version and references it on later calls, so only the per-request
+    part (images, metadata, retrieved rules) is sent each time.
+    Falls back to inlining the prefix when caching is off, the prefix is
+    below the provider's minimum, or registration failed recently.
+    Superseded versions are released only once their TTL has run out, so
+    in-flight calls that still reference them keep working.
+    """
+    def __init__(self, backend: PromptCacheBackend = None):
+        self.backend = backend
+        self.ttl_seconds = settings.PROMPT_CACHE_TTL_SECONDS
+        self.min_tokens = settings.PROMPT_CACHE_MIN_TOKENS
+        self.retry_seconds = settings.PROMPT_CACHE_RETRY_SECONDS
+
+        self._entries = {}      # key -> {"name", "expires_at", "released_at"}
+        self._current = {}      # prefix name -> active key
+        self._too_small = set() # keys below the caching minimum (sent inline for good)
+        self._retry_at = {}     # key -> monotonic time after which a failed registration is retried
+        self._retired = []      # (release time, handle) of superseded versions
+        self._locks = {}
+
+        self.stats = {
+            "registrations": 0,
+            "registration_failures": 0,
+            "below_minimum": 0,
+            "calls": 0,
+            "cached_calls": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "latency_ms_cached_total": 0.0,
+            "latency_ms_uncached_total": 0.0,
+        }
+
+    async def prepare(self, client, model: str, name: str, version: str, prefix: str, contents: list, config: types.GenerateContentConfig):
+        """
+        Returns (contents, config, cached) ready for generate_content.
+        """
+        digest = hashlib.sha1(prefix.encode()).hexdigest()[:10]
+        key = f"{name}-{version}-{digest}"
+        handle = await self._handle(client, model, name, key, prefix)
+
+        if handle and self.backend.server_side:
+            config.cached_content = handle
+            return contents, config, True
+        # Inline prefixes (including the local backend) are billed and timed as uncached
+        return [prefix] + contents, config, False
+
+    async def _handle(self, client, model: str, name: str, key: str, prefix: str):
+        if not self.backend or key in self._too_small:
+            return None
+        if self._retired:
+            await self._release_due(client)
+        if self._retry_at.get(key, 0) > time.monotonic():
+            return None
+
+        entry = self._entries.get(key)
+        if entry and entry["expires_at"] > time.monotonic():
+            return entry["name"]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # Another request may have registered it while we waited
+            entry = self._entries.get(key)
+            if entry and entry["expires_at"] > time.monotonic():
+                return entry["name"]
+
+            if self.backend.server_side and estimate_tokens([prefix]) < self.min_tokens:
+                logger.info(f"Prompt prefix {key} below caching minimum, sending inline")
+                self._too_small.add(key)
+                self.stats["below_minimum"] += 1
+                return None
+
+            try:
+                handle = await self.backend.register(client, model, key, prefix, self.ttl_seconds)
+            except Exception as e:
+                # Often transient (429, network): send inline for a while, then try again
+                logger.warning(f"Prompt prefix registration failed for {key}, retrying in {self.retry_seconds}s: {e}")
+                self.stats["registration_failures"] += 1
+                self._retry_at[key] = time.monotonic() + self.retry_seconds
+                return None
+
+            self.stats["registrations"] += 1
+            self._retry_at.pop(key, None)
+            now = time.monotonic()
+            previous = self._entries.get(key)
+            # Refresh a minute early so calls never reference an expired cache
+            self._entries[key] = {
+                "name": handle,
+                "expires_at": now + max(self.ttl_seconds - 60, 1),
+                "released_at": now + self.ttl_seconds
+            }
+            if previous:
+                # Expired refresh of the same version
+                self._retire(previous)
+
+            previous_key = self._current.get(name)
+            self._current[name] = key
+            if previous_key and previous_key != key and previous_key in self._entries:
+                self._retire(self._entries.pop(previous_key))
+            return handle
+
+    def _retire(self, entry: dict):
+        self._retired.append((entry["released_at"], entry["name"]))
+
+    async def _release_due(self, client):
+        now = time.monotonic()
+        due = [handle for released_at, handle in self._retired if released_at <= now]
+        if not due:
+            return
+        self._retired = [(released_at, handle) for released_at, handle in self._retired if released_at > now]
+        for handle in due:
+            try:
+                await self.backend.release(client, handle)
+            except Exception as e:
+                logger.warning(f"Failed to release prompt prefix {handle}: {e}")
+
+    def record(self, response, latency_ms: float, cached: bool):
+        self.stats["calls"] += 1
+        if cached:
+            self.stats["cached_calls"] += 1
+            self.stats["latency_ms_cached_total"] += latency_ms
+        else:
+            self.stats["latency_ms_uncached_total"] += latency_ms
+
+        usage = getattr(response, "usage_metadata", None)
+        if usage:
+            self.stats["prompt_tokens"] += getattr(usage, "prompt_token_count", None) or 0
+            self.stats["cached_tokens"] += getattr(usage, "cached_content_token_count", None) or 0
+
+    def snapshot(self) -> dict:
+        data = dict(self.stats)
+        data["backend"] = type(self.backend).__name__ if self.backend else None
+        data["cached_token_ratio"] = data["cached_tokens"] / data["prompt_tokens"] if data["prompt_tokens"] else 0.0
+        uncached_calls = data["calls"] - data["cached_calls"]
+        avg_cached = data["latency_ms_cached_total"] / data["cached_calls"] if data["cached_calls"] else None
+        avg_uncached = data["latency_ms_uncached_total"] / uncached_calls if uncached_calls else None
+        data["avg_latency_ms_cached"] = avg_cached
+        data["avg_latency_ms_uncached"] = avg_uncached
+        data["latency_saving_ms"] = avg_uncached - avg_cached if avg_cached is not None and avg_uncached is not None else None
+        return data
+
+
+prompt_prefix_cache = PromptPrefixCache(get_prompt_cache_backend(settings.PROMPT_CACHE_BACKEND))
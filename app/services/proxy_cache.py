@@ -0,0 +1,272 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import time
+from email.utils import formatdate
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(bucket_id: str, file_id: str) -> str:
+    return f"{bucket_id}/{file_id}"
+
+
+def entity_tag(key: str) -> str:
+    """
+    Strong ETag for a cache key. File IDs are immutable, so the key alone
+    identifies the bytes; a miss can send the same tag a later hit will.
+    """
+    return f'"{hashlib.sha256(key.encode()).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/ prefixes are ignored."""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+class CacheWriter:
+    """
+    Streams one upstream body into a temp file next to the cache entry.
+    Nothing is visible to readers until commit() renames it into place.
+    """
+    def __init__(self, cache: "ProxyDiskCache", key: str, content_type: str, last_modified: str = None, source: str = None):
+        self.cache = cache
+        self.key = key
+        self.source = source
+        self.content_type = content_type
+        self.last_modified = last_modified or formatdate(time.time(), usegmt=True)
+        self.size = 0
+        self._path = cache._path(key) + f".{os.urandom(4).hex()}.part"
+        self._file = open(self._path, "wb")
+
+    async def write(self, chunk: bytes):
+        if self._file is None:
+            return
+        self.size += len(chunk)
+        if self.size > self.cache.max_entry_bytes:
+            # Too big to be worth caching; keep streaming to the client only
+            self.abort()
+            return
+        await run_in_threadpool(self._file.write, chunk)
+
+    async def commit(self) -> dict:
+        if self._file is None:
+            return None
+        self._file.close()
+        self._file = None
+        entry = {
+            "key": self.key,
+            "size": self.size,
+            "etag": entity_tag(self.key),
+            "last_modified": self.last_modified,
+            "content_type": self.content_type,
+        }
+        if self.source:
+            entry["source"] = self.source
+        await run_in_threadpool(self.cache._persist, entry, self._path)
+        self.cache._register(entry)
+        return entry
+
+    def abort(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+
+class ProxyDiskCache:
+    """
+    Size-bounded LRU cache of proxied Appwrite files on local disk.
+    File IDs are immutable, so entries never need revalidation upstream;
+    they only leave the cache through LRU eviction or invalidate().
+    Entries derived from another file (resized variants) record it as
+    their source and are invalidated along with it.
+    Each entry is <sha256(key)> (the body) plus <sha256(key)>.json (headers),
+    so the cache survives restarts. 404s are remembered for a short TTL.
+    Removed bodies are only unlinked after a grace period, so responses
+    that already hold the path can still open it.
+    """
+    def __init__(self):
+        self.enabled = settings.PROXY_CACHE_ENABLED
+        self.directory = settings.PROXY_CACHE_DIR
+        self.max_bytes = settings.PROXY_CACHE_MAX_BYTES
+        self.max_entry_bytes = settings.PROXY_CACHE_MAX_ENTRY_BYTES
+        self.negative_ttl = settings.PROXY_CACHE_NEGATIVE_TTL_SECONDS
+        self._entries = None  # key -> entry dict, in LRU order (oldest first)
+        self._negative = {}   # key -> monotonic expiry
+        self._variants = {}   # source key -> keys of entries derived from it
+        self._unlinks = collections.deque()  # (monotonic deadline, key) of removed bodies, oldest first
+        self._unlink_due = {}  # key -> latest deadline, so a re-removed key waits its own grace period
+        self.unlink_grace = settings.PROXY_CACHE_UNLINK_GRACE_SECONDS
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "negative_hits": 0, "stores": 0, "evictions": 0}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = collections.OrderedDict()
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        names = set(os.listdir(self.directory))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part") or (not name.endswith(".json") and name + ".json" not in names):
+                # Left behind by an interrupted download, or removed before a restart
+                os.remove(path)
+                continue
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+                found.append((os.stat(path[:-5]).st_atime, entry))
+            except (OSError, ValueError):
+                continue
+        for _, entry in sorted(found, key=lambda pair: pair[0]):
+            self._entries[entry["key"]] = entry
+            self.total_bytes += entry["size"]
+            self._link(entry)
+        self._evict()
+
+    def get(self, bucket_id: str, file_id: str):
+        """Returns (entry, body path) or (None, None)."""
+        if not self.enabled:
+            return None, None
+        self._load()
+        key = cache_key(bucket_id, file_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None, None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry, self._path(key)
+
+    def is_missing(self, bucket_id: str, file_id: str) -> bool:
+        expires = self._negative.get(cache_key(bucket_id, file_id))
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del self._negative[cache_key(bucket_id, file_id)]
+            return False
+        self.stats["negative_hits"] += 1
+        return True
+
+    def mark_missing(self, bucket_id: str, file_id: str):
+        if self.enabled and self.negative_ttl > 0:
+            if len(self._negative) > 10000:
+                now = time.monotonic()
+                self._negative = {k: v for k, v in self._negative.items() if v >= now}
+            self._negative[cache_key(bucket_id, file_id)] = time.monotonic() + self.negative_ttl
+
+    def writer(self, bucket_id: str, file_id: str, content_type: str, last_modified: str = None, source_id: str = None):
+        """
+        A CacheWriter for a fresh upstream body, or None when caching is off.
+        `source_id` marks the entry as derived from that file in the same bucket.
+        """
+        if not self.enabled:
+            return None
+        self._load()
+        source = cache_key(bucket_id, source_id) if source_id else None
+        return CacheWriter(self, cache_key(bucket_id, file_id), content_type, last_modified, source)
+
+    def _persist(self, entry: dict, tmp_path: str):
+        path = self._path(entry["key"])
+        with open(path + ".json", "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def _register(self, entry: dict):
+        previous = self._entries.pop(entry["key"], None)
+        if previous:
+            self.total_bytes -= previous["size"]
+        self._entries[entry["key"]] = entry
+        self.total_bytes += entry["size"]
+        self._link(entry)
+        self._negative.pop(entry["key"], None)
+        self.stats["stores"] += 1
+        self._evict()
+
+    def _link(self, entry: dict):
+        if entry.get("source"):
+            self._variants.setdefault(entry["source"], set()).add(entry["key"])
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry["size"]
+        variants = self._variants.get(entry.get("source"))
+        if variants is not None:
+            variants.discard(key)
+            if not variants:
+                del self._variants[entry["source"]]
+        path = self._path(key)
+        try:
+            os.remove(path + ".json")
+        except OSError:
+            pass
+        deadline = time.monotonic() + self.unlink_grace
+        self._unlink_due[key] = deadline
+        self._unlinks.append((deadline, key))
+        self._unlink_expired()
+
+    def _unlink_expired(self):
+        now = time.monotonic()
+        while self._unlinks and self._unlinks[0][0] <= now:
+            deadline, key = self._unlinks.popleft()
+            if self._unlink_due.get(key) != deadline:
+                continue
+            del self._unlink_due[key]
+            if key in self._entries:
+                # Cached again since; the path holds the new body
+                continue
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, bucket_id: str, file_id: str):
+        """Drops the file and every entry derived from it."""
+        if self._entries is None:
+            return
+        key = cache_key(bucket_id, file_id)
+        for variant in list(self._variants.get(key, ())):
+            self._remove(variant)
+        self._remove(key)
+        self._negative.pop(key, None)
+
+    def snapshot(self) -> dict:
+        return dict(
+            self.stats,
+            entries=len(self._entries or {}),
+            bytes=self.total_bytes,
+            max_bytes=self.max_bytes,
+            negative_entries=len(self._negative),
+            pending_unlinks=len(self._unlinks),
+        )
+
+
+proxy_cache = ProxyDiskCache()
@@ -0,0 +1,477 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from google import genai
+from google.genai import errors, types
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "record", "replay")
+
+
+class ReplayMissError(LookupError):
+    """No recorded fixture matches the request."""
+
+
+def fingerprint(obj):
+    """
+    JSON-safe, deterministic view of a request. Binary payloads (image bytes,
+    PIL images, upload files) are reduced to a content hash.
+    """
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return "sha256:" + hashlib.sha256(bytes(obj)).hexdigest()
+    if isinstance(obj, dict):
+        # None values are dropped so config=None and an omitted config match
+        return {str(k): fingerprint(v) for k, v in sorted(obj.items(), key=lambda kv: str(kv[0])) if v is not None}
+    if isinstance(obj, (list, tuple)):
+        return [fingerprint(v) for v in obj]
+    if isinstance(obj, type):
+        return obj.__qualname__
+    if hasattr(obj, "model_dump"):
+        return fingerprint(obj.model_dump(exclude_none=True))
+    if hasattr(obj, "tobytes"):
+        # PIL.Image
+        return "sha256:" + hashlib.sha256(obj.tobytes()).hexdigest()
+    if hasattr(obj, "__dict__"):
+        return fingerprint(vars(obj))
+    return type(obj).__name__
+
+
+def request_key(provider: str, operation: str, request) -> str:
+    payload = json.dumps([provider, operation, fingerprint(request)], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class FixtureStore:
+    """
+    One JSONL file per provider under REPLAY_FIXTURES_DIR.
+    Lookups try the exact request key first, then cycle through recordings of
+    the same route (e.g. any create_document on a collection), because some
+    requests carry generated IDs or timestamps.
+    """
+    def __init__(self, fixtures_dir: str):
+        self.fixtures_dir = fixtures_dir
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_route = {}
+        self._cursor = {}
+        self._loaded = set()
+
+    def _path(self, provider: str) -> str:
+        return os.path.join(self.fixtures_dir, f"{provider}.jsonl")
+
+    def _load(self, provider: str):
+        if provider in self._loaded:
+            return
+        self._loaded.add(provider)
+        path = self._path(provider)
+        if not os.path.exists(path):
+            logger.warning(f"No replay fixtures for {provider} at {path}")
+            return
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._by_key[record["key"]] = record
+                self._by_route.setdefault((provider, record["route"]), []).append(record)
+
+    def lookup(self, provider: str, key: str, route: str):
+        """Returns (record, exact) or (None, False)."""
+        with self._lock:
+            self._load(provider)
+            record = self._by_key.get(key)
+            if record:
+                return record, True
+            candidates = self._by_route.get((provider, route))
+            if not candidates:
+                return None, False
+            index = self._cursor.get((provider, route), 0)
+            self._cursor[(provider, route)] = index + 1
+            return candidates[index % len(candidates)], False
+
+    def append(self, provider: str, record: dict):
+        with self._lock:
+            os.makedirs(self.fixtures_dir, exist_ok=True)
+            with open(self._path(provider), "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+class FaultInjector:
+    """
+    Latency and 429 injection for replayed calls.
+    REPLAY_LATENCY: "recorded" | "fixed:<ms>" | "uniform:<lo_ms>:<hi_ms>" | "lognormal:<median_ms>:<sigma>"
+    REPLAY_RATE_LIMIT_PROBABILITY starts a run of REPLAY_RATE_LIMIT_BURST consecutive 429s.
+    """
+    def __init__(self, latency_spec: str, rate_limit_probability: float, rate_limit_burst: int, seed: int = None):
+        self.latency_spec = latency_spec.split(":")
+        self.rate_limit_probability = rate_limit_probability
+        self.rate_limit_burst = max(1, rate_limit_burst)
+        self.random = random.Random(seed)
+        self._burst_left = 0
+        self._lock = threading.Lock()
+
+    def latency_seconds(self, recorded_ms: float) -> float:
+        kind, args = self.latency_spec[0], [float(a) for a in self.latency_spec[1:]]
+        with self._lock:
+            if kind == "fixed":
+                ms = args[0]
+            elif kind == "uniform":
+                ms = self.random.uniform(args[0], args[1])
+            elif kind == "lognormal":
+                ms = self.random.lognormvariate(math.log(args[0]), args[1])
+            else:
+                ms = recorded_ms or 0.0
+        return ms / 1000
+
+    def should_rate_limit(self) -> bool:
+        with self._lock:
+            if self._burst_left > 0:
+                self._burst_left -= 1
+                return True
+            if self.random.random() < self.rate_limit_probability:
+                self._burst_left = self.rate_limit_burst - 1
+                return True
+            return False
+
+
+class ReplayHarness:
+    """
+    Record/replay layer for Gemini, Moondream and Appwrite.
+    record: calls the real provider and appends request key + response to the fixtures.
+    replay: serves fixtures locally, with injected latency and 429s, and never touches the network.
+    """
+    def __init__(self):
+        self.mode = settings.REPLAY_MODE if settings.REPLAY_MODE in MODES else "off"
+        self.providers = {p.strip() for p in settings.REPLAY_PROVIDERS.split(",") if p.strip()}
+        self.store = FixtureStore(settings.REPLAY_FIXTURES_DIR)
+        self.faults = FaultInjector(
+            settings.REPLAY_LATENCY,
+            settings.REPLAY_RATE_LIMIT_PROBABILITY,
+            settings.REPLAY_RATE_LIMIT_BURST,
+            settings.REPLAY_SEED
+        )
+        self.stats = {"recorded": 0, "hits": 0, "route_hits": 0, "misses": 0, "injected_429": 0}
+
+    def active(self, provider: str) -> bool:
+        return self.mode != "off" and provider in self.providers
+
+    def replaying(self, provider: str) -> bool:
+        return self.mode == "replay" and provider in self.providers
+
+    def _record(self, provider: str, key: str, route: str, started: float, response=None, error: Exception = None, **extra):
+        record = {
+            "key": key,
+            "route": route,
+            "latency_ms": (time.monotonic() - started) * 1000,
+            "response": response,
+        }
+        if error is not None:
+            record["error"] = {"message": str(error), "code": getattr(error, "code", None)}
+        record.update(extra)
+        self.store.append(provider, record)
+        self.stats["recorded"] += 1
+
+    def _fixture(self, provider: str, key: str, route: str) -> dict:
+        record, exact = self.store.lookup(provider, key, route)
+        if record is None:
+            self.stats["misses"] += 1
+            raise ReplayMissError(f"No {provider} fixture for {route} ({key[:12]})")
+        self.stats["hits" if exact else "route_hits"] += 1
+        return record
+
+    def _inject_rate_limit(self) -> bool:
+        if self.faults.should_rate_limit():
+            self.stats["injected_429"] += 1
+            return True
+        return False
+
+    async def call_async(self, provider, operation, route, request, live, serialize, deserialize, raise_error, rate_limit_error):
+        key = request_key(provider, operation, request)
+        if self.mode == "replay":
+            record = self._fixture(provider, key, route)
+            await asyncio.sleep(self.faults.latency_seconds(record["latency_ms"]))
+            if self._inject_rate_limit():
+                raise rate_limit_error()
+            if record.get("error"):
+                raise_error(record["error"])
+            return deserialize(record["response"])
+
+        started = time.monotonic()
+        try:
+            response = await live()
+        except Exception as e:
+            self._record(provider, key, route, started, error=e)
+            raise
+        self._record(provider, key, route, started, response=serialize(response))
+        return response
+
+    def call_sync(self, provider, operation, route, request, live, serialize, deserialize, raise_error, rate_limit_error):
+        key = request_key(provider, operation, request)
+        if self.mode == "replay":
+            record = self._fixture(provider, key, route)
+            time.sleep(self.faults.latency_seconds(record["latency_ms"]))
+            if self._inject_rate_limit():
+                raise rate_limit_error()
+            if record.get("error"):
+                raise_error(record["error"])
+            return deserialize(record["response"])
+
+        started = time.monotonic()
+        try:
+            response = live()
+        except Exception as e:
+            self._record(provider, key, route, started, error=e)
+            raise
+        self._record(provider, key, route, started, response=serialize(response))
+        return response
+
+    def snapshot(self) -> dict:
+        return {"mode": self.mode, "providers": sorted(self.providers), **self.stats}
+
+
+replay_harness = ReplayHarness()
+
+
+# --- Gemini -----------------------------------------------------------------
+
+def _gemini_rate_limit_error():
+    return errors.ClientError(429, {"error": {"code": 429, "message": "Resource exhausted (injected by replay harness)", "status": "RESOURCE_EXHAUSTED"}})
+
+
+def _gemini_raise(error: dict):
+    code = error.get("code") or 500
+    raise errors.APIError(code, {"error": {"code": code, "message": error["message"]}})
+
+
+def _dump(response):
+    return response.model_dump(mode="json", exclude_none=True) if response is not None else None
+
+
+class _ReplayGeminiModels:
+    def __init__(self, harness: ReplayHarness, models):
+        self.harness = harness
+        self.models = models
+
+    async def _call(self, operation, response_type, model, kwargs):
+        return await self.harness.call_async(
+            "gemini", operation, f"{operation}:{model}", {"model": model, **kwargs},
+            live=lambda: getattr(self.models, operation)(model=model, **kwargs),
+            serialize=_dump,
+            deserialize=response_type.model_validate,
+            raise_error=_gemini_raise,
+            rate_limit_error=_gemini_rate_limit_error
+        )
+
+    async def generate_content(self, model: str, **kwargs):
+        return await self._call("generate_content", types.GenerateContentResponse, model, kwargs)
+
+    async def count_tokens(self, model: str, **kwargs):
+        return await self._call("count_tokens", types.CountTokensResponse, model, kwargs)
+
+    async def generate_content_stream(self, model: str, **kwargs):
+        harness = self.harness
+        route = f"generate_content_stream:{model}"
+        key = request_key("gemini", "generate_content_stream", {"model": model, **kwargs})
+
+        if harness.mode == "replay":
+            record = harness._fixture("gemini", key, route)
+            await asyncio.sleep(harness.faults.latency_seconds(record["latency_ms"]))
+            if harness._inject_rate_limit():
+                raise _gemini_rate_limit_error()
+            if record.get("error"):
+                _gemini_raise(record["error"])
+
+            async def replay_chunks():
+                gaps = record.get("chunk_gaps_ms") or []
+                for index, chunk in enumerate(record["response"]):
+                    if index and harness.faults.latency_spec[0] == "recorded" and index < len(gaps):
+                        await asyncio.sleep(gaps[index] / 1000)
+                    yield types.GenerateContentResponse.model_validate(chunk)
+            return replay_chunks()
+
+        started = time.monotonic()
+        try:
+            stream = await self.models.generate_content_stream(model=model, **kwargs)
+        except Exception as e:
+            harness._record("gemini", key, route, started, error=e)
+            raise
+
+        async def record_chunks():
+            # Gaps between chunks are kept so "recorded" latency replays the stream's pacing
+            chunks, gaps, last = [], [], time.monotonic()
+            async for chunk in stream:
+                now = time.monotonic()
+                gaps.append((now - last) * 1000)
+                last = now
+                chunks.append(_dump(chunk))
+                yield chunk
+            # latency_ms is time to first chunk; the rest is replayed from the gaps
+            harness._record("gemini", key, route, started, response=chunks, chunk_gaps_ms=gaps, latency_ms=gaps[0] if gaps else 0.0)
+        return record_chunks()
+
+
+class _ReplayGeminiCaches:
+    def __init__(self, harness: ReplayHarness, caches):
+        self.harness = harness
+        self.caches = caches
+
+    async def create(self, model: str, config=None):
+        return await self.harness.call_async(
+            "gemini", "caches.create", f"caches.create:{model}", {"model": model, "config": config},
+            live=lambda: self.caches.create(model=model, config=config),
+            serialize=_dump,
+            deserialize=types.CachedContent.model_validate,
+            raise_error=_gemini_raise,
+            rate_limit_error=_gemini_rate_limit_error
+        )
+
+    async def delete(self, name: str):
+        return await self.harness.call_async(
+            "gemini", "caches.delete", "caches.delete", {"name": name},
+            live=lambda: self.caches.delete(name=name),
+            serialize=lambda response: None,
+            deserialize=lambda response: None,
+            raise_error=_gemini_raise,
+            rate_limit_error=_gemini_rate_limit_error
+        )
+
+
+class _ReplayGeminiAio:
+    def __init__(self, harness: ReplayHarness, client):
+        self.models = _ReplayGeminiModels(harness, client.aio.models if client else None)
+        self.caches = _ReplayGeminiCaches(harness, client.aio.caches if client else None)
+
+
+class ReplayGeminiClient:
+    """
+    Stands in for genai.Client on the async paths the services use
+    (client.aio.models.* and client.aio.caches.*).
+    """
+    def __init__(self, harness: ReplayHarness, client=None):
+        self.aio = _ReplayGeminiAio(harness, client)
+
+
+def genai_client(api_key: str):
+    """
+    genai.Client honouring REPLAY_MODE. Returns None without an API key,
+    unless replaying (fixtures need no key).
+    """
+    if replay_harness.replaying("gemini"):
+        return ReplayGeminiClient(replay_harness)
+    if not api_key:
+        return None
+    client = genai.Client(api_key=api_key)
+    if replay_harness.active("gemini"):
+        return ReplayGeminiClient(replay_harness, client)
+    return client
+
+
+# --- Moondream --------------------------------------------------------------
+
+class ReplayMoondreamModel:
+    def __init__(self, harness: ReplayHarness, model=None):
+        self.harness = harness
+        self.model = model
+
+    def query(self, image, question):
+        def raise_error(error: dict):
+            raise RuntimeError(error["message"])
+
+        return self.harness.call_sync(
+            "moondream", "query", "query", {"image": image, "question": question},
+            live=lambda: self.model.query(image, question),
+            serialize=lambda response: response,
+            deserialize=lambda response: response,
+            raise_error=raise_error,
+            rate_limit_error=lambda: RuntimeError("429 Too Many Requests (injected by replay harness)")
+        )
+
+
+def moondream_model(factory):
+    """
+    Wraps the Moondream model built by `factory()` (skipped entirely when replaying).
+    """
+    if replay_harness.replaying("moondream"):
+        return ReplayMoondreamModel(replay_harness)
+    model = factory()
+    if replay_harness.active("moondream"):
+        return ReplayMoondreamModel(replay_harness, model)
+    return model
+
+
+# --- Appwrite ---------------------------------------------------------------
+
+def _appwrite_serialize(response):
+    if isinstance(response, (bytes, bytearray)):
+        return {"bytes": base64.b64encode(bytes(response)).decode()}
+    return {"json": response}
+
+
+def _appwrite_deserialize(response: dict):
+    if "bytes" in response:
+        return base64.b64decode(response["bytes"])
+    return response["json"]
+
+
+def _appwrite_error(message: str, code: int):
+    from appwrite.exception import AppwriteException
+    return AppwriteException(message, code)
+
+
+def wrap_appwrite_client(client):
+    """
+    Intercepts Client.call, the single choke point for every Appwrite service
+    (Databases, Storage, Users), so documents and file bytes can be recorded and replayed.
+    """
+    if not replay_harness.active("appwrite"):
+        return client
+
+    live_call = client.call
+
+    def call(method, path="", headers=None, params=None, response_type="json"):
+        def raise_error(error: dict):
+            raise _appwrite_error(error["message"], error.get("code"))
+
+        return replay_harness.call_sync(
+            "appwrite", "call", f"{method.upper()} {path}", {"method": method, "path": path, "params": params},
+            live=lambda: live_call(method, path, headers, params, response_type),
+            serialize=_appwrite_serialize,
+            deserialize=_appwrite_deserialize,
+            raise_error=raise_error,
+            rate_limit_error=lambda: _appwrite_error("Rate limit for the current endpoint has been exceeded (injected by replay harness)", 429)
+        )
+
+    client.call = call
+    return client
+
+
+async def replay_appwrite_call(method: str, path: str, params: dict, live):
+    """
+    Async counterpart of wrap_appwrite_client for the pooled repository;
+    uses the same key as the SDK's Client.call so fixtures are shared.
+    """
+    if not replay_harness.active("appwrite"):
+        return await live()
+
+    def raise_error(error: dict):
+        raise _appwrite_error(error["message"], error.get("code"))
+
+    return await replay_harness.call_async(
+        "appwrite", "call", f"{method.upper()} {path}", {"method": method.lower(), "path": path, "params": params},
+        live=live,
+        serialize=_appwrite_serialize,
+        deserialize=_appwrite_deserialize,
+        raise_error=raise_error,
+        rate_limit_error=lambda: _appwrite_error("Rate limit for the current endpoint has been exceeded (injected by replay harness)", 429)
+    )
@@ -0,0 +1,321 @@
+import os
+import re
+import glob
+import json
+import hashlib
+import logging
+import threading
+import typing_extensions as typing
+from app.services.llm_gateway import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+COLOR_DICTIONARY_FILE = "dictionary_of_colour_combinations.json"
+NO_RULES_TEXT = "No specific style rules provided. Use general fashion knowledge."
+
+RULES_MODES = ("pruned", "compact", "full")
+
+# Vocabulary for the category/colour/mood -> rules index (matched on stemmed words)
+GARMENT_TERMS = {
+    "top", "tee", "shirt", "blouse", "tank", "camisole", "cami", "bodysuit", "corset", "tunic",
+    "kurti", "kurta", "jacket", "blazer", "coat", "trench", "vest", "gilet", "cardigan", "sweater",
+    "turtleneck", "pullover", "jumper", "hoodie", "sweatshirt", "knit", "layer", "jean", "denim",
+    "trouser", "pant", "chino", "culotte", "legging", "jogger", "skirt", "short", "dress", "gown",
+    "jumpsuit", "romper", "playsuit", "overall", "suit", "heel", "shoe", "sneaker", "boot", "loafer",
+    "flat", "sandal", "pump", "bag", "clutch", "tote", "scarf", "belt", "hat", "jewelry",
+}
+COLOR_TERMS = {
+    "black", "white", "gray", "grey", "navy", "blue", "red", "pink", "green", "olive", "yellow",
+    "orange", "purple", "violet", "lavender", "brown", "tan", "beige", "cream", "ivory", "camel",
+    "khaki", "gold", "silver", "burgundy", "maroon", "teal", "turquoise", "coral", "mustard", "neutral",
+}
+MOOD_TERMS = {
+    "casual", "formal", "office", "work", "corporate", "business", "party", "evening", "cocktail",
+    "date", "wedding", "gym", "active", "sport", "beach", "vacation", "weekend", "day", "night",
+    "smart", "elegant", "professional", "lounge", "festive", "gala", "brunch", "lunch", "dinner",
+    "travel", "summer", "winter",
+}
+TERM_WEIGHTS = {**{t: 1 for t in COLOR_TERMS}, **{t: 2 for t in GARMENT_TERMS}, **{t: 2 for t in MOOD_TERMS}}
+
+# custom_category / general_category values -> index terms
+CATEGORY_ALIASES = {
+    "tops": ["top"], "shirts": ["shirt"], "layer": ["layer", "jacket", "cardigan"],
+    "active": ["active", "sport"], "ethnic": ["kurta", "kurti"], "jeans": ["jean", "denim"],
+    "trousers": ["trouser", "pant"], "skirts": ["skirt"], "shorts": ["short"],
+    "ethnic_bottoms": ["skirt"], "active_lounge": ["legging", "jogger", "lounge"],
+    "oomph": ["dress"], "gown": ["gown", "dress", "evening"], "romps": ["jumpsuit", "romper"],
+    "heels": ["heel"], "shoes": ["shoe"], "sandals": ["sandal"], "bags": ["bag"],
+    "top": ["top"], "bottom": ["trouser", "pant", "jean", "skirt"], "dress": ["dress"],
+    "footwear": ["shoe"], "bag": ["bag"],
+}
+
+# Keeps the colour dictionary (hundreds of combinations) from crowding out the books
+MAX_RECORDS_PER_SOURCE = 12
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith(("sses", "shes", "ches", "xes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us")):
+        return word[:-1]
+    return word
+
+
+def extract_terms(text: str) -> set[str]:
+    words = {_stem(w) for w in re.findall(r"[a-z]+", text.lower())}
+    return words & TERM_WEIGHTS.keys()
+
+
+class RuleRecord(typing.TypedDict):
+    source: str
+    text: str
+    tokens: int
+
+
+class RulesContext(typing.TypedDict):
+    version: str
+    mode: str
+    text: str
+    token_count: int
+    token_count_exact: bool
+
+
+def minify(data) -> str:
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def compact_color_dictionary(entries: list) -> list[list[str]]:
+    """
+    Reshapes the colour dictionary into its named combinations.
+    Swatch, CMYK, LAB and RGB values carry no signal for the model and
+    'combinations' are shared group numbers, not indexes into the list.
+    """
+    groups = {}
+    for entry in entries:
+        for combo_id in entry.get("combinations", []):
+            groups.setdefault(combo_id, []).append(entry.get("name"))
+    return [groups[combo_id] for combo_id in sorted(groups)]
+
+
+def flatten_rule_records(source: str, data) -> list[RuleRecord]:
+    """
+    Splits a rule book into small self-contained records ("path: rule").
+    Objects inside lists (e.g. outfit formulas) stay together as one record.
+    """
+    records = []
+
+    def add(text: str):
+        records.append({"source": source, "text": text, "tokens": estimate_tokens([text]) + 1})
+
+    def walk(node, path: str):
+        prefix = f"{path}: " if path else ""
+        if isinstance(node, dict):
+            for key, value in node.items():
+                walk(value, f"{path} > {key}" if path else key)
+        elif isinstance(node, list):
+            for value in node:
+                if isinstance(value, (dict, list)):
+                    add(prefix + minify(value))
+                else:
+                    add(prefix + str(value))
+        else:
+            add(prefix + str(node))
+
+    if source == COLOR_DICTIONARY_FILE:
+        for combination in compact_color_dictionary(data):
+            add("colour combination: " + ", ".join(combination))
+    else:
+        walk(data, "")
+    return records
+
+
+class RulesContextCache:
+    """
+    Builds the serialized rules context once per rules version and reuses it.
+    The version is derived from file names, sizes and mtimes, so edits to
+    rules_json are picked up without re-reading the files on every request.
+
+    Modes:
+    - pruned (default): only rules indexed under the outfit's categories,
+      colours and mood, within a token budget (see select)
+    - compact: minified books, colour dictionary reduced to combinations
+    - full: every book minified verbatim (opt-in, see stats for its cost)
+    """
+    def __init__(self, rules_dir: str = "rules_json"):
+        self.rules_dir = rules_dir
+        self._lock = threading.Lock()
+        self._version = None
+        self._books = {}
+        self._contexts = {}
+        self._records = []
+        self._index = {}
+        self.stats = {mode: {"calls": 0, "prompt_tokens_total": 0, "latency_ms_total": 0.0} for mode in RULES_MODES}
+
+    def _files(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self.rules_dir, "*.json")))
+
+    def current_version(self) -> str:
+        digest = hashlib.sha1()
+        for file_path in self._files():
+            st = os.stat(file_path)
+            digest.update(f"{os.path.basename(file_path)}:{st.st_size}:{st.st_mtime_ns};".encode())
+        return digest.hexdigest()[:12]
+
+    def get(self, mode: str = "compact") -> RulesContext:
+        if mode not in ("compact", "full"):
+            raise ValueError(f"Unknown rules mode '{mode}'")
+        with self._lock:
+            self._refresh()
+            context = self._contexts.get(mode)
+            if context is None:
+                context = self._build(mode)
+                self._contexts[mode] = context
+            return context
+
+    def _refresh(self):
+        version = self.current_version()
+        if version == self._version:
+            return
+
+        books = {}
+        for file_path in self._files():
+            try:
+                with open(file_path, 'r') as f:
+                    books[os.path.basename(file_path)] = json.load(f)
+            except Exception as e:
+                logger.error(f"Error reading rule file {file_path}: {e}")
+
+        if not books:
+            logger.warning(f"No JSON rules found in {self.rules_dir}")
+        logger.info(f"Loaded rules version {version} ({len(books)} books)")
+        self._version = version
+        self._books = books
+        self._contexts = {}
+        self._build_index()
+
+    def _build_index(self):
+        """
+        Precomputes term -> record ids for every garment, colour and mood term.
+        """
+        records = []
+        index = {}
+        for filename, data in self._books.items():
+            for record in flatten_rule_records(filename, data):
+                record_id = len(records)
+                records.append(record)
+                for term in extract_terms(record["text"]):
+                    index.setdefault(term, []).append(record_id)
+        self._records = records
+        self._index = index
+
+    def _build(self, mode: str) -> RulesContext:
+        if not self._books:
+            text = NO_RULES_TEXT
+        else:
+            sections = []
+            for filename, data in self._books.items():
+                if mode == "compact" and filename == COLOR_DICTIONARY_FILE:
+                    data = {"colour_combinations": compact_color_dictionary(data)}
+                sections.append(f"--- Rules from {filename} ---\n{minify(data)}")
+            text = "\n".join(sections)
+
+        return {
+            "version": self._version,
+            "mode": mode,
+            "text": text,
+            "token_count": estimate_tokens([text]),
+            "token_count_exact": False,
+        }
+
+    def select(self, outfit_metadata: dict[str, dict], target_mood: str = None, token_budget: int = 1500) -> RulesContext:
+        """
+        Returns only the rules that mention the outfit's categories, colours
+        or mood, best matches first, until the token budget is spent.
+        """
+        query_terms = set()
+        for meta in outfit_metadata.values():
+            if not meta:
+                continue
+            for field in ("general_category", "custom_category"):
+                value = (meta.get(field) or "").lower()
+                query_terms.update(CATEGORY_ALIASES.get(value, []))
+            colors = meta.get("colors") or []
+            text_fields = [meta.get("specific_category"), meta.get("custom_category"), meta.get("tags")] + list(colors)
+            query_terms |= extract_terms(" ".join(f for f in text_fields if f))
+        if target_mood:
+            query_terms |= extract_terms(target_mood)
+
+        with self._lock:
+            self._refresh()
+            scores = {}
+            for term in query_terms:
+                for record_id in self._index.get(term, []):
+                    scores[record_id] = scores.get(record_id, 0) + TERM_WEIGHTS[term]
+            records = self._records
+            version = self._version
+
+        ranked = sorted(scores, key=lambda record_id: (-scores[record_id], record_id))
+        selected = []
+        per_source = {}
+        used = 0
+        for record_id in ranked:
+            record = records[record_id]
+            if per_source.get(record["source"], 0) >= MAX_RECORDS_PER_SOURCE:
+                continue
+            if used + record["tokens"] > token_budget:
+                continue
+            selected.append(record_id)
+            per_source[record["source"]] = per_source.get(record["source"], 0) + 1
+            used += record["tokens"]
+
+        if not selected:
+            text = NO_RULES_TEXT
+        else:
+            # Keep book order so related rules read together
+            sections = {}
+            for record_id in sorted(selected):
+                record = records[record_id]
+                sections.setdefault(record["source"], []).append(f"- {record['text']}")
+            text = "\n".join(f"--- Rules from {source} ---\n" + "\n".join(lines) for source, lines in sections.items())
+
+        return {
+            "version": version,
+            "mode": "pruned",
+            "text": text,
+            "token_count": estimate_tokens([text]),
+            "token_count_exact": False,
+        }
+
+    async def count_tokens(self, context: RulesContext, client, model: str) -> int:
+        """
+        Replaces the estimate with the model's real token count (once per version).
+        """
+        if context["token_count_exact"] or not client:
+            return context["token_count"]
+        try:
+            result = await client.aio.models.count_tokens(model=model, contents=context["text"])
+            context["token_count"] = result.total_tokens
+            context["token_count_exact"] = True
+        except Exception as e:
+            logger.warning(f"Token count failed, keeping estimate: {e}")
+        return context["token_count"]
+
+    def record_call(self, mode: str, response, latency_ms: float):
+        stats = self.stats[mode]
+        stats["calls"] += 1
+        stats["latency_ms_total"] += latency_ms
+        usage = getattr(response, "usage_metadata", None)
+        stats["prompt_tokens_total"] += getattr(usage, "prompt_token_count", None) or 0
+
+    def snapshot(self) -> dict:
+        data = {"version": self._version}
+        for mode, stats in self.stats.items():
+            calls = stats["calls"]
+            context = self._contexts.get(mode)
+            data[mode] = {
+                "calls": calls,
+                "context_tokens": context["token_count"] if context else None,
+                "avg_prompt_tokens": stats["prompt_tokens_total"] / calls if calls else None,
+                "avg_latency_ms": stats["latency_ms_total"] / calls if calls else None,
+            }
+        return data
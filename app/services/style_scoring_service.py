@@ -19,6 +19,13 @@ from app.core.config import settings
 import logging
 import typing_extensions as typing
 from app.services.vector_scoring_service import VectorScoringService, get_vector_service
+from app.services.llm_gateway import llm_gateway
+from app.services.replay import genai_client
+from app.services.image_preprocessing import image_preprocessor
+from app.services.rules_context import RulesContextCache
+from app.services.prompt_cache import prompt_prefix_cache
+from app.services.partial_json import PartialJSONObject
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -43,12 +50,13 @@ class StyleScoringService:
     def __init__(self, rules_dir: str = "rules_json"):
         self.api_key = settings.GOOGLE_API_KEY
         self.rules_dir = rules_dir
+        self.rules_cache = RulesContextCache(rules_dir)
+        self.rules_mode = settings.STYLE_RULES_MODE
         self.client = None
-        if self.api_key:
-            try:
-                self.client = genai.Client(api_key=self.api_key)
-            except Exception as e:
-                logger.error(f"Failed to init Gemini client: {e}")
+        try:
+            self.client = genai_client(self.api_key)
+        except Exception as e:
+            logger.error(f"Failed to init Gemini client: {e}")
         
         # Init Vector Service for RAG (Use Singleton)
         self.vector_service = None
@@ -58,53 +66,48 @@ class StyleScoringService:
         except Exception as e:
              logger.error(f"Failed to get Vector Service in Style Service: {e}")
 
-    def load_rules(self) -> str:
+    def load_rules(self, mode: str = None) -> str:
         """
-        Loads all JSON files from the rules directory and combines them into a single context string.
+        Returns the serialized rules context for a static mode ("compact" or "full").
+        Built once per rules version (see RulesContextCache), not per request.
         """
-        rules_context = ""
-        json_files = glob.glob(os.path.join(self.rules_dir, "*.json"))
-        
-        if not json_files:
-            logger.warning(f"No JSON rules found in {self.rules_dir}")
-            return "No specific style rules provided. Use general fashion knowledge."
-
-        for file_path in json_files:
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                    filename = os.path.basename(file_path)
-                    rules_context += f"\n--- Rules from {filename} ---\n"
-                    rules_context += json.dumps(data, indent=2)
-            except Exception as e:
-                logger.error(f"Error reading rule file {file_path}: {e}")
-        
-        return rules_context
+        mode = mode or self.rules_mode
+        return self.rules_cache.get("compact" if mode == "pruned" else mode)["text"]
 
-    def analyze_image(self, image_path: str = None, image_data: bytes = None, target_mood: str = None) -> StyleScore:
+    async def _rules_context(self, outfit_metadata: dict[str, dict] = None, target_mood: str = None):
+        # Pruning needs item metadata; single-image analysis falls back to compact
+        if self.rules_mode == "pruned" and outfit_metadata:
+            return self.rules_cache.select(outfit_metadata, target_mood, settings.STYLE_RULES_TOKEN_BUDGET)
+
+        rules = self.rules_cache.get("compact" if self.rules_mode == "pruned" else self.rules_mode)
+        await self.rules_cache.count_tokens(rules, self.client, "gemini-2.0-flash")
+        return rules
+
+    async def analyze_image(self, image_path: str = None, image_data: bytes = None, target_mood: str = None) -> StyleScore:
         if not self.client:
             logger.error("Gemini client not initialized.")
             return None
 
-        # Load Image
+        # Load Image (downscaled / re-encoded before upload)
         try:
-            if image_data:
-                img = Image.open(io.BytesIO(image_data))
-            elif image_path:
-                img = Image.open(image_path)
-            else:
+            if image_path and not image_data:
+                with open(image_path, "rb") as f:
+                    image_data = f.read()
+            if not image_data:
                 raise ValueError("No image provided")
+            img = await image_preprocessor.to_part(image_data)
         except Exception as e:
             logger.error(f"Error loading image: {e}")
             return None
 
-        # Load Rules
-        rules_context = self.load_rules()
+        # Load Rules (cached per rules version)
+        rules = await self._rules_context()
+        rules_context = rules["text"]
 
         # Construct Mood Instruction
         if target_mood:
              mood_instruction = f"""
-             2. Mood / Occasion Analysis:
+             Mood / Occasion Analysis:
                 - The user tried to dress for the following occasion: "{target_mood}".
                 - DETECT the actual mood communicated by the outfit.
                 - COMPARE the detected mood with the target mood "{target_mood}".
@@ -114,19 +117,19 @@ class StyleScoringService:
              """
         else:
              mood_instruction = """
-             2. Detect the Mood / Occasion:
+             Detect the Mood / Occasion:
                 - Identify the most suitable occasion for this outfit (e.g., Party, Office/Meeting, Casual/Shopping, Lunch Date, Gym/Active, Evening Gala, etc.).
                 - Provide a brief reasoning for the detected mood.
              """
 
-        # Construct Prompt
-        prompt = f"""
+        # Static prefix (cached once per rules version) + per-request part
+        prefix = f"""
         You are a highly critical and knowledgeable fashion stylist and judge.
         Analyze the person's outfit in the image based strictly on the Fashion Rules provided below.
         
         YOUR TASK:
         1. Identify the outfit components.
-        {mood_instruction}
+        2. Follow the OCCASION INSTRUCTIONS sent with the image.
         3. Evaluate the outfit against the provided rules (Color combinations, Logic, Fit, Occasion, Balance, etc.).
         4. Assign a score out of 10 for:
             - Color Coordination
@@ -145,15 +148,35 @@ class StyleScoringService:
         Output valid JSON exactly matching the StyleScore schema.
         """
 
+        prompt = f"""
+        --- OCCASION INSTRUCTIONS ---
+        {mood_instruction}
+        """
+
         try:
-            response = self.client.models.generate_content(
+            contents, config, cached = await prompt_prefix_cache.prepare(
+                self.client,
                 model="gemini-2.0-flash",
+                name="style-image",
+                version=rules["version"],
+                prefix=prefix,
                 contents=[prompt, img],
                 config=types.GenerateContentConfig(
                     response_mime_type="application/json",
                     response_schema=StyleScore
                 )
             )
+
+            start_time = time.perf_counter()
+            response = await llm_gateway.generate_content(
+                self.client,
+                model="gemini-2.0-flash",
+                contents=contents,
+                config=config
+            )
+            latency_ms = (time.perf_counter() - start_time) * 1000
+            self.rules_cache.record_call(rules["mode"], response, latency_ms)
+            prompt_prefix_cache.record(response, latency_ms, cached)
             
             if hasattr(response, 'parsed') and response.parsed:
                 print(f"\\n[DEBUG GEMINI] Parsed Response:\\n{response.parsed}")
@@ -166,34 +189,21 @@ class StyleScoringService:
             logger.error(f"Style Analysis Failed: {e}")
             return None
 
-    def analyze_outfit(self, outfit_images: dict[str, bytes], outfit_metadata: dict[str, dict], target_mood: str = None, use_rag: bool = False) -> StyleScore:
-        """
-        Analyzes a composition of items (Top, Bottom, Layer, etc.).
-        outfit_images: dict of {category: image_bytes}
-        outfit_metadata: dict of {category: item_metadata_dict}
-        use_rag: If True, uses Vector Search to retrieve specific rules. If False, uses loose context.
-        """
-        if not self.client:
-            logger.error("Gemini client not initialized.")
-            return None
-
-        # Load Images
+    async def _load_images(self, outfit_images: dict[str, bytes]) -> list:
         images = []
-        try:
-            for cat, data in outfit_images.items():
-                if data:
-                    img = Image.open(io.BytesIO(data))
-                    images.append(img)
-        except Exception as e:
-            logger.error(f"Error loading outfit images: {e}")
-            return None
-
-        if not images:
-             logger.error("No valid images provided for outfit analysis.")
-             return None
+        for cat, data in outfit_images.items():
+            if data:
+                images.append(await image_preprocessor.to_part(data))
+        return images
 
-        # Load Rules
-        rules_context = self.load_rules()
+    async def _prepare_outfit_request(self, images: list, outfit_metadata: dict[str, dict], target_mood: str = None, use_rag: bool = False) -> dict:
+        """
+        Retrieves rules and builds the Gemini request for an outfit.
+        Returns a dict with the request (contents/config/cached) and the retrieved context.
+        """
+        # Load Rules relevant to this outfit (index cached per rules version)
+        rules = await self._rules_context(outfit_metadata, target_mood)
+        rules_context = rules["text"]
         
         # Format Metadata Context
         metadata_str = json.dumps(outfit_metadata, indent=2)
@@ -201,7 +211,7 @@ class StyleScoringService:
         # Construct Mood Instruction
         if target_mood:
              mood_instruction = f"""
-             2. Mood / Occasion Analysis:
+             Mood / Occasion Analysis:
                 - The user tried to dress for the following occasion: "{target_mood}".
                 - DETECT the actual mood communicated by the combined outfit.
                 - COMPARE the detected mood with the target mood "{target_mood}".
@@ -211,7 +221,7 @@ class StyleScoringService:
              """
         else:
              mood_instruction = """
-             2. Detect the Mood / Occasion:
+             Detect the Mood / Occasion:
                 - Identify the most suitable occasion for this outfit combination.
                 - Provide a brief reasoning for the detected mood.
              """
@@ -243,33 +253,31 @@ class StyleScoringService:
         else:
             print(f"\\n[DEBUG RAG] RAG Retrieval Skipped (use_rag={use_rag})\\n")
 
-        # Construct Prompt
-        prompt = f"""
+        # Static rules belong to the cached prefix; per-outfit (pruned) rules are sent with the request
+        fashion_rules = f"""
+        --- FASHION RULES ---
+        {rules_context}
+        ---------------------
+        """
+        static_rules = rules["mode"] != "pruned"
+
+        # Static prefix (cached once per rules version) + per-request part
+        prefix = f"""
         You are a highly critical and knowledgeable fashion stylist and judge.
         Analyze the OUTFIT COMPOSITION shown in the provided images (e.g., Top, Bottom, Layer).
-        Use the provided metadata for additional context (materials, brands, descriptions).
-        
-        OUTFIT METADATA:
-        {metadata_str}
+        Use the OUTFIT METADATA sent with the images for additional context (materials, brands, descriptions).
 
         YOUR TASK:
         1. Identify the visual harmony between the provided items.
-        {mood_instruction}
-        3. Evaluate the outfit against the provided rules and specifically the RETRIEVED RULES below.
+        2. Follow the OCCASION INSTRUCTIONS sent with the images.
+        3. Evaluate the outfit against the FASHION RULES and specifically the RETRIEVED RELEVANT RULES.
         
         CRITICAL COLOR/STYLE CHECK (RAG):
-        Review the following SPECIFIC rules retrieved from our style database that match this outfit.
+        Review the SPECIFIC rules retrieved from our style database that match this outfit.
         If the outfit follows or breaks these specific rules, cite them explicitly.
         
-        --- RETRIEVED RELEVANT RULES ---
-        # {retrieved_rules}
-        
-        --- COLOR DICTIONARY MATCHES (High Priority) ---
-        {retrieved_color_rules}
-        --------------------------------
-        
         CRITICAL COLOR STEP:
-        - Check if the outfit's colors correspond to any specific named combination or palette in the "COLOR DICTIONARY MATCHES" section above.
+        - Check if the outfit's colors correspond to any specific named combination or palette in the "COLOR DICTIONARY MATCHES" section.
         - If a match is found (e.g. "Hermosa Pink"), explicitly mention it in the critique.
         - You MUST add a `ScoreComponent` to the breakdown with criterion "Color Dictionary Match" and a score (10 for perfect match, 5-9 for close).
         
@@ -282,26 +290,83 @@ class StyleScoringService:
         6. Provide a constructive critique.
         7. List strengths and improvements.
         8. Cite specific rules from the provided JSONs that were followed or broken.
+        {fashion_rules if static_rules else ""}
+        Output valid JSON exactly matching the StyleScore schema.
+        """
 
-        --- FASHION RULES ---
-        {rules_context}
-        ---------------------
+        prompt = f"""
+        OUTFIT METADATA:
+        {metadata_str}
+
+        --- OCCASION INSTRUCTIONS ---
+        {mood_instruction}
+
+        --- RETRIEVED RELEVANT RULES ---
+        # {retrieved_rules}
         
-        Output valid JSON exactly matching the StyleScore schema.
+        --- COLOR DICTIONARY MATCHES (High Priority) ---
+        {retrieved_color_rules}
+        --------------------------------
+        {"" if static_rules else fashion_rules}
         """
 
+        # Pass prompt + list of images (static prefix is referenced or prepended)
+        contents, config, cached = await prompt_prefix_cache.prepare(
+            self.client,
+            model="gemini-2.0-flash",
+            name="style-outfit",
+            version=rules["version"] if static_rules else "base",
+            prefix=prefix,
+            contents=[prompt] + images,
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=StyleScore
+            )
+        )
+        return {
+            "contents": contents,
+            "config": config,
+            "cached": cached,
+            "rules": rules,
+            "retrieved_rules": retrieved_rules,
+            "retrieved_color_rules": retrieved_color_rules,
+        }
+
+    async def analyze_outfit(self, outfit_images: dict[str, bytes], outfit_metadata: dict[str, dict], target_mood: str = None, use_rag: bool = False) -> StyleScore:
+        """
+        Analyzes a composition of items (Top, Bottom, Layer, etc.).
+        outfit_images: dict of {category: image_bytes}
+        outfit_metadata: dict of {category: item_metadata_dict}
+        use_rag: If True, uses Vector Search to retrieve specific rules. If False, uses loose context.
+        """
+        if not self.client:
+            logger.error("Gemini client not initialized.")
+            return None
+
+        # Load Images
+        try:
+            images = await self._load_images(outfit_images)
+        except Exception as e:
+            logger.error(f"Error loading outfit images: {e}")
+            return None
+
+        if not images:
+             logger.error("No valid images provided for outfit analysis.")
+             return None
+
         try:
-            # Pass prompt + list of images
-            contents = [prompt] + images
+            request = await self._prepare_outfit_request(images, outfit_metadata, target_mood, use_rag)
             
-            response = self.client.models.generate_content(
+            start_time = time.perf_counter()
+            response = await llm_gateway.generate_content(
+                self.client,
                 model="gemini-2.0-flash",
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=StyleScore
-                )
+                contents=request["contents"],
+                config=request["config"]
             )
+            latency_ms = (time.perf_counter() - start_time) * 1000
+            self.rules_cache.record_call(request["rules"]["mode"], response, latency_ms)
+            prompt_prefix_cache.record(response, latency_ms, request["cached"])
             
             if hasattr(response, 'parsed') and response.parsed:
                 print(f"\\n[DEBUG GEMINI] Parsed Response:\\n{response.parsed}")
@@ -314,6 +379,47 @@ class StyleScoringService:
             logger.error(f"Outfit Analysis Failed: {e}")
             return None
 
+    async def stream_outfit(self, outfit_images: dict[str, bytes], outfit_metadata: dict[str, dict], target_mood: str = None, use_rag: bool = False):
+        """
+        Streaming variant of analyze_outfit.
+        Async generator of (event, data): "rag_context", "partial" (fields as they complete), "result".
+        Raises on failure so the caller can emit an error event.
+        """
+        if not self.client:
+            raise RuntimeError("Gemini client not initialized.")
+
+        images = await self._load_images(outfit_images)
+        if not images:
+            raise ValueError("No valid images provided for outfit analysis.")
+
+        request = await self._prepare_outfit_request(images, outfit_metadata, target_mood, use_rag)
+        yield "rag_context", {
+            "rules_mode": request["rules"]["mode"],
+            "rules_tokens": request["rules"]["token_count"],
+            "retrieved_rules": request["retrieved_rules"],
+            "retrieved_color_rules": request["retrieved_color_rules"],
+        }
+
+        parser = PartialJSONObject()
+        last_chunk = None
+        start_time = time.perf_counter()
+        async for chunk in llm_gateway.generate_content_stream(
+            self.client,
+            model="gemini-2.0-flash",
+            contents=request["contents"],
+            config=request["config"]
+        ):
+            last_chunk = chunk
+            fields = parser.feed(chunk.text or "")
+            if fields:
+                yield "partial", fields
+
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        self.rules_cache.record_call(request["rules"]["mode"], last_chunk, latency_ms)
+        prompt_prefix_cache.record(last_chunk, latency_ms, request["cached"])
+
+        yield "result", parser.result()
+
 # Command Line Interface for testing
 if __name__ == "__main__":
     import argparse
@@ -329,16 +435,19 @@ if __name__ == "__main__":
     parser.add_argument("--mood", help="Target mood/occasion (e.g., 'Party', 'Office')", default=None)
     args = parser.parse_args()
 
-    service = StyleScoringService(rules_dir="rules_json") # Assumes run from root or rules_json exists
+    rules_dir = "rules_json" # Assumes run from root or rules_json exists
     
     # Adjust rules_dir if running from a different location, or rely on absolute path if needed.
     # For this CLI, assuming running from project root.
-    if not os.path.exists(service.rules_dir):
+    if not os.path.exists(rules_dir):
          # Try absolute path based on this file
-         service.rules_dir = os.path.join(parent_dir, "rules_json")
+         rules_dir = os.path.join(parent_dir, "rules_json")
+
+    service = StyleScoringService(rules_dir=rules_dir)
 
     print(f"Analyzing {args.image_path} with mood: {args.mood if args.mood else 'Auto-Detect'}...")
-    result = service.analyze_image(image_path=args.image_path, target_mood=args.mood)
+    import asyncio
+    result = asyncio.run(service.analyze_image(image_path=args.image_path, target_mood=args.mood))
     
     if result:
         print("\n--- Style Score Analysis ---")
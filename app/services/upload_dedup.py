@@ -0,0 +1,155 @@
+import asyncio
+import collections
+import hashlib
+import io
+import logging
+import time
+from PIL import Image
+from app.core.config import settings
+from app.services.wardrobe_service import wardrobe_service
+
+logger = logging.getLogger(__name__)
+
+# Wardrobe attributes an analysis clone copies from the matched item
+ANALYSIS_FIELDS = ("caption", "specific_category", "general_category", "custom_category", "tags", "colors")
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data: bytes) -> str:
+    """
+    64-bit difference hash (dHash) as 16 hex chars: survives re-encoding,
+    resizing and small edits. Returns None for undecodable input.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.draft("L", (64, 64))
+        img = img.convert("L").resize((9, 8), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = list(img.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+def compute_hashes(data: bytes, precomputed_content_hash: str = None) -> dict:
+    hashes = {"content_hash": precomputed_content_hash or content_hash(data)}
+    if settings.UPLOAD_DEDUP_PERCEPTUAL:
+        hashes["perceptual_hash"] = perceptual_hash(data)
+    return hashes
+
+
+class UploadHashIndex:
+    """
+    Per-user index of upload hashes -> wardrobe IDs.
+    Loaded lazily from the user's wardrobe documents (content_hash /
+    perceptual_hash attributes) when hashes are stored there, and kept
+    current by uploads and deletes. Users are kept in an LRU with a TTL.
+    """
+    def __init__(self):
+        self.perceptual_distance = settings.UPLOAD_DEDUP_PHASH_DISTANCE
+        self.max_users = settings.UPLOAD_DEDUP_MAX_USERS
+        self.ttl = settings.UPLOAD_DEDUP_TTL_SECONDS
+        self._users = collections.OrderedDict()  # user_id -> entry, oldest first
+        self._locks = {}  # only while a user's index is being loaded
+        self.stats = {"lookups": 0, "exact_hits": 0, "perceptual_hits": 0, "stale": 0}
+
+    def _cached(self, user_id: str):
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        if entry["expires"] < time.monotonic():
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return entry
+
+    async def _entry(self, user_id: str) -> dict:
+        entry = self._cached(user_id)
+        if entry is not None:
+            return entry
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                entry = self._cached(user_id)
+                if entry is None:
+                    entry = {"exact": {}, "perceptual": {}, "expires": time.monotonic() + self.ttl}
+                    if settings.UPLOAD_DEDUP_STORE_HASHES:
+                        # Without stored hashes the documents have nothing to index
+                        items = await wardrobe_service.get_user_wardrobe(user_id)
+                        for item in items:
+                            self._index(entry, item["$id"], item.get("content_hash"), item.get("perceptual_hash"))
+                    self._users[user_id] = entry
+                    while len(self._users) > self.max_users:
+                        self._users.popitem(last=False)
+        finally:
+            if self._locks.get(user_id) is lock:
+                del self._locks[user_id]
+        return entry
+
+    @staticmethod
+    def _index(entry: dict, wardrobe_id: str, exact: str = None, perceptual: str = None):
+        if exact:
+            entry["exact"][exact] = wardrobe_id
+        if perceptual:
+            entry["perceptual"][wardrobe_id] = perceptual
+
+    async def find(self, user_id: str, hashes: dict):
+        """
+        Returns (wardrobe_item, "exact" | "perceptual") or (None, None).
+        Index entries whose document no longer exists are dropped.
+        """
+        self.stats["lookups"] += 1
+        entry = await self._entry(user_id)
+
+        candidates = []
+        wardrobe_id = entry["exact"].get(hashes.get("content_hash"))
+        if wardrobe_id:
+            candidates.append((wardrobe_id, "exact"))
+        phash = hashes.get("perceptual_hash")
+        if phash:
+            near = [
+                (hamming(phash, other), other_id)
+                for other_id, other in entry["perceptual"].items()
+                if other_id != wardrobe_id
+            ]
+            candidates += [(other_id, "perceptual") for distance, other_id in sorted(near) if distance <= self.perceptual_distance]
+
+        for wardrobe_id, match in candidates:
+            try:
+                item = await wardrobe_service.db.get_document(wardrobe_service.db_id, wardrobe_service.coll_id, wardrobe_id)
+            except Exception:
+                self.stats["stale"] += 1
+                self.forget(user_id, wardrobe_id)
+                continue
+            if match == "perceptual" and item.get("general_category") == "Uncategorized":
+                # Nothing to clone yet
+                continue
+            self.stats[f"{match}_hits"] += 1
+            return item, match
+        return None, None
+
+    def add(self, user_id: str, wardrobe_id: str, hashes: dict):
+        entry = self._cached(user_id)
+        if entry is not None:
+            self._index(entry, wardrobe_id, hashes.get("content_hash"), hashes.get("perceptual_hash"))
+
+    def forget(self, user_id: str, wardrobe_id: str):
+        entry = self._cached(user_id)
+        if entry is None:
+            return
+        entry["perceptual"].pop(wardrobe_id, None)
+        for key in [k for k, v in entry["exact"].items() if v == wardrobe_id]:
+            del entry["exact"][key]
+
+
+upload_hash_index = UploadHashIndex()
@@ -0,0 +1,102 @@
+import hashlib
+import io
+import mmap
+import os
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class SpooledUpload:
+    """
+    Zero-copy access to an uploaded file. Starlette's multipart parser has
+    already spooled the part into UploadFile.file (in memory up to 1MB, then
+    a temp file), so nothing is read again: view() is the in-memory buffer
+    or an mmap of the temp file, and the sha256 is computed over that view.
+    Oversized bodies are rejected early, while still streaming, by
+    BodySizeLimitMiddleware; read() only checks the final size.
+    """
+    def __init__(self, view: memoryview, spooled: bool):
+        self._view = view
+        self.size = len(view)
+        self.spooled = spooled
+        self._sha256 = None
+
+    @classmethod
+    async def read(cls, file: UploadFile, max_size: int) -> "SpooledUpload":
+        """Wraps `file`, raising UploadTooLarge when it is over max_size."""
+        size = file.size
+        if size is None:
+            size = await run_in_threadpool(file.file.seek, 0, os.SEEK_END)
+        if size > max_size:
+            raise UploadTooLarge()
+        view, spooled = await run_in_threadpool(cls._map, file.file)
+        upload = cls(view, spooled)
+        # hashlib releases the GIL for large buffers
+        upload._sha256 = await run_in_threadpool(hashlib.sha256, view)
+        return upload
+
+    @staticmethod
+    def _map(f):
+        """(memoryview of the whole file, whether it is on disk)."""
+        buffer = getattr(f, "_file", f)  # SpooledTemporaryFile wraps a BytesIO or a real file
+        if isinstance(buffer, io.BytesIO):
+            # getvalue() shares the BytesIO's storage (no copy) and, unlike
+            # getbuffer(), does not block closing the file while the view lives
+            return memoryview(buffer.getvalue()), False
+        buffer.flush()
+        if os.fstat(buffer.fileno()).st_size == 0:
+            return memoryview(b""), True
+        # The mapping stays valid after Starlette closes the file
+        return memoryview(mmap.mmap(buffer.fileno(), 0, access=mmap.ACCESS_READ)), True
+
+    @property
+    def content_hash(self) -> str:
+        return self._sha256.hexdigest()
+
+    def view(self) -> memoryview:
+        return self._view
+
+    def close(self):
+        # The file itself belongs to the UploadFile (closed by Starlette); views
+        # handed to background work keep the mapping alive until they are released
+        pass
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a memoryview, so HTTP clients can
+    stream an upload (in their own small chunks) without copying it whole.
+    """
+    def __init__(self, view):
+        self._view = memoryview(view).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: len(self._view)}[whence]
+        self._pos = min(max(base + offset, 0), len(self._view))
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        chunk = bytes(self._view[self._pos:end])
+        self._pos = end
+        return chunk
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from app.services.appwrite_storage import upload_image_from_bytes, delete_image
+from app.services.wardrobe_service import wardrobe_service
+from app.services.user_service import user_service
+from app.services.analysis_queue import analysis_queue, COMPLETED
+from app.services.upload_dedup import upload_hash_index, ANALYSIS_FIELDS
+from app.services.image_derivatives import derivative_generator
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """A required upload stage failed (the caller maps it to an HTTP error)."""
+
+
+def new_id() -> str:
+    # Valid Appwrite custom ID: 20 hex chars (max is 36, alphanumeric first)
+    return os.urandom(10).hex()
+
+
+class StageTimings:
+    """
+    Wall-clock duration per pipeline stage, for logs, Server-Timing and /metrics.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+
+    @contextlib.asynccontextmanager
+    async def stage(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.monotonic() - start) * 1000
+
+    def total_ms(self) -> float:
+        return (time.monotonic() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={ms:.1f}" for name, ms in self.stages.items()]
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+
+class UploadPipelineStats:
+    def __init__(self):
+        self.uploads = 0
+        self.failures = 0
+        self.stage_totals = {}
+        self.stage_counts = {}
+
+    def record(self, timings: StageTimings, ok: bool):
+        self.uploads += 1
+        if not ok:
+            self.failures += 1
+        for name, ms in list(timings.stages.items()) + [("total", timings.total_ms())]:
+            self.stage_totals[name] = self.stage_totals.get(name, 0.0) + ms
+            self.stage_counts[name] = self.stage_counts.get(name, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "uploads": self.uploads,
+            "failures": self.failures,
+            "avg_stage_ms": {name: self.stage_totals[name] / self.stage_counts[name] for name in self.stage_totals},
+        }
+
+
+upload_stats = UploadPipelineStats()
+
+
+async def run_upload(user_id: str, contents: bytes, bucket_id: str, timings: StageTimings, link_user: bool = True, hashes: dict = None, clone_from: dict = None) -> dict:
+    """
+    Upload pipeline as a small dependency graph. IDs are generated up front so:
+      - analysis (needs only the bytes) starts while the storage upload runs,
+      - the wardrobe document and the user's wardrobe_id_list update run
+        concurrently once the image is stored,
+      - derivatives are built once the document exists.
+    The analysis job waits for the document only before saving its result;
+    on a failed upload the result is dropped (one wasted model call).
+    With `clone_from` (a near-duplicate wardrobe item) its analysis is copied instead of queued.
+    Returns {"wardrobe_id", "image_id", "image_url", "job"}; raises UploadError.
+    """
+    wardrobe_id = new_id()
+    image_id = new_id()
+    filename = f"{user_id}_{os.urandom(4).hex()}.jpg"
+    # Use Proxy URL (Version agnostic)
+    image_url = f"/proxy/images/{bucket_id}/{image_id}"
+    document_ready = asyncio.get_running_loop().create_future()
+
+    extra = {}
+    if hashes and settings.UPLOAD_DEDUP_STORE_HASHES:
+        extra.update({k: v for k, v in hashes.items() if v})
+    if clone_from:
+        extra.update({field: clone_from[field] for field in ANALYSIS_FIELDS if clone_from.get(field) is not None})
+
+    async def store():
+        async with timings.stage("storage_upload"):
+            return await upload_image_from_bytes(
+                image_data=contents,
+                filename=filename,
+                bucket_id=bucket_id,
+                file_id=image_id
+            )
+
+    async def enqueue():
+        if clone_from:
+            return {"wardrobe_id": wardrobe_id, "status": COMPLETED, "updates": {k: v for k, v in extra.items() if k in ANALYSIS_FIELDS}}
+        async with timings.stage("analysis_enqueue"):
+            return await analysis_queue.enqueue(wardrobe_id, contents, document_ready=document_ready)
+
+    async def create():
+        async with timings.stage("create_item"):
+            return await wardrobe_service.create_wardrobe_item(
+                user_id=user_id,
+                image_id=image_id,
+                image_url=image_url,
+                category="Uncategorized", # Updated by the analysis job (or overridden by a clone)
+                document_id=wardrobe_id,
+                extra=extra
+            )
+
+    async def link():
+        async with timings.stage("link_user"):
+            return await user_service.add_wardrobe_item(user_id, wardrobe_id)
+
+    try:
+        # Stage 1: storage upload || analysis
+        stored, job = await asyncio.gather(store(), enqueue())
+        if not stored:
+            raise UploadError("Failed to upload image to storage")
+
+        # Stage 2: independent DB writes
+        writes = [create(), link()] if link_user else [create()]
+        results = await asyncio.gather(*writes, return_exceptions=True)
+        created = results[0]
+        linked = results[1] if link_user else True
+
+        if isinstance(created, Exception) or not created:
+            # Undo the side effects that did succeed
+            if link_user and linked is True:
+                await user_service.remove_wardrobe_item(user_id, wardrobe_id)
+            await delete_image(bucket_id, image_id)
+            raise UploadError(f"Failed to create wardrobe item: {created}")
+
+        if linked is not True:
+            # Should we rollback? For now just log error, but image/wardrobe item exists
+            logger.error(f"Failed to link wardrobe {wardrobe_id} to user {user_id}: {linked}")
+
+        # Thumbnails are built in the background from the bytes we already hold
+        derivative_generator.schedule(bucket_id, image_id, contents)
+        document_ready.set_result(True)
+    except BaseException:
+        if not document_ready.done():
+            document_ready.set_result(False)
+        upload_stats.record(timings, ok=False)
+        raise
+
+    if hashes:
+        upload_hash_index.add(user_id, wardrobe_id, hashes)
+    upload_stats.record(timings, ok=True)
+    logger.info(f"Upload {wardrobe_id} stages: {timings.server_timing()}")
+    return {"wardrobe_id": wardrobe_id, "image_id": image_id, "image_url": image_url, "job": job}
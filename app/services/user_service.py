@@ -1,4 +1,4 @@
-from app.services.appwrite import get_appwrite_db
+from app.services.appwrite_repository import appwrite_repository
 from app.core.config import settings
 from appwrite.query import Query
 from appwrite.exception import AppwriteException
@@ -8,14 +8,14 @@ logger = logging.getLogger(__name__)
 
 class UserService:
     def __init__(self):
-        self.db = get_appwrite_db()
+        self.db = appwrite_repository
         self.db_id = settings.APPWRITE_DATABASE_ID
         self.coll_id = "users"
 
-    def get_user_by_mobile(self, mobile: str):
+    async def get_user_by_mobile(self, mobile: str):
         try:
             # Query Appwrite for user with matching mobile
-            response = self.db.list_documents(
+            response = await self.db.list_documents(
                 database_id=self.db_id,
                 collection_id=self.coll_id,
                 queries=[Query.equal("mobile", mobile)]
@@ -28,7 +28,7 @@ class UserService:
             logger.error(f"Error fetching user by mobile: {e}")
             raise e
 
-    def create_user(self, mobile: str):
+    async def create_user(self, mobile: str):
         try:
             # Since name and email are required by schema but we only have mobile,
             # we use placeholders until user updates profile.
@@ -39,7 +39,7 @@ class UserService:
                 "gender": "unknown" 
             }
             
-            result = self.db.create_document(
+            result = await self.db.create_document(
                 database_id=self.db_id,
                 collection_id=self.coll_id,
                 document_id="unique()",
@@ -49,13 +49,13 @@ class UserService:
         except AppwriteException as e:
             logger.error(f"Error creating user: {e}")
     
-    def add_wardrobe_item(self, user_id: str, wardrobe_id: str):
+    async def add_wardrobe_item(self, user_id: str, wardrobe_id: str):
         """
         Appends a wardrobe ID to the user's wardrobe_id_list.
         """
         try:
             # 1. Get current user to fetch existing list
-            user = self.db.get_document(self.db_id, self.coll_id, user_id)
+            user = await self.db.get_document(self.db_id, self.coll_id, user_id)
             current_list = user.get("wardrobe_id_list") or []
             
             # 2. Append new ID
@@ -63,7 +63,7 @@ class UserService:
                 current_list.append(wardrobe_id)
                 
             # 3. Update document
-            self.db.update_document(
+            await self.db.update_document(
                 database_id=self.db_id,
                 collection_id=self.coll_id,
                 document_id=user_id,
@@ -74,14 +74,57 @@ class UserService:
             logger.error(f"Error adding wardrobe item to user: {e}")
             return False
 
-    def remove_wardrobe_item(self, user_id: str, wardrobe_id: str):
+    async def add_wardrobe_items(self, user_id: str, wardrobe_ids: list):
+        """
+        Appends several wardrobe IDs to the user's wardrobe_id_list in a single update.
+        """
+        try:
+            user = await self.db.get_document(self.db_id, self.coll_id, user_id)
+            current_list = user.get("wardrobe_id_list") or []
+            current_list += [wardrobe_id for wardrobe_id in dict.fromkeys(wardrobe_ids) if wardrobe_id not in current_list]
+
+            await self.db.update_document(
+                database_id=self.db_id,
+                collection_id=self.coll_id,
+                document_id=user_id,
+                data={"wardrobe_id_list": current_list}
+            )
+            return True
+        except AppwriteException as e:
+            logger.error(f"Error adding wardrobe items to user: {e}")
+            return False
+
+    async def remove_wardrobe_items(self, user_id: str, wardrobe_ids: list):
+        """
+        Removes several wardrobe IDs from the user's wardrobe_id_list in a single update.
+        """
+        try:
+            user = await self.db.get_document(self.db_id, self.coll_id, user_id)
+            current_list = user.get("wardrobe_id_list") or []
+            removed = set(wardrobe_ids)
+            new_list = [wardrobe_id for wardrobe_id in current_list if wardrobe_id not in removed]
+            if len(new_list) == len(current_list):
+                return True
+
+            await self.db.update_document(
+                database_id=self.db_id,
+                collection_id=self.coll_id,
+                document_id=user_id,
+                data={"wardrobe_id_list": new_list}
+            )
+            return True
+        except AppwriteException as e:
+            logger.error(f"Error removing wardrobe items from user: {e}")
+            return False
+
+    async def remove_wardrobe_item(self, user_id: str, wardrobe_id: str):
         """
         Removes a wardrobe ID from the user's wardrobe_id_list.
         """
         try:
             # 1. Get current user
             print(f"US: Fetching user {user_id}...")
-            user = self.db.get_document(self.db_id, self.coll_id, user_id)
+            user = await self.db.get_document(self.db_id, self.coll_id, user_id)
             current_list = user.get("wardrobe_id_list") or []
             print(f"US: Current list count: {len(current_list)}")
             
@@ -91,7 +134,7 @@ class UserService:
                 print(f"US: Removed {wardrobe_id}. New count: {len(current_list)}")
                 
                 # 3. Update document
-                self.db.update_document(
+                await self.db.update_document(
                     database_id=self.db_id,
                     collection_id=self.coll_id,
                     document_id=user_id,
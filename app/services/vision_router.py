@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from app.core.config import settings
+from app.services.gemini_service import gemini_service, GARMENT_ANALYSIS_PROMPT
+from app.services.wardrobe_service import CUSTOM_CATEGORY_GROUPS
+
+logger = logging.getLogger(__name__)
+
+# The custom_category keyword lists embedded in the Gemini prompt, reused to
+# classify Moondream items the same way
+CUSTOM_CATEGORIES = json.loads(
+    GARMENT_ANALYSIS_PROMPT[GARMENT_ANALYSIS_PROMPT.index("{"):GARMENT_ANALYSIS_PROMPT.rindex("}") + 1]
+)
+
+
+def classify_item(item_name: str) -> tuple[str, str]:
+    """
+    Returns (custom_category, general_category) for a free-text item name,
+    preferring the longest matching keyword ("denim jacket" over "jacket").
+    """
+    name = item_name.lower()
+    best, best_len = "", 0
+    for custom_category, keywords in CUSTOM_CATEGORIES.items():
+        for keyword in keywords + [custom_category.lower().rstrip("s")]:
+            if keyword in name and len(keyword) > best_len:
+                best, best_len = custom_category, len(keyword)
+
+    for general_category, custom_categories in CUSTOM_CATEGORY_GROUPS.items():
+        if best in custom_categories:
+            return best, general_category
+    return best, "Other"
+
+
+def normalize_moondream_items(items: list) -> dict:
+    """
+    Converts MoondreamService.parse_and_dedupe output into an OutfitAnalysis.
+    """
+    clothing = []
+    for entry in items:
+        custom_category, general_category = classify_item(entry["item"])
+        clothing.append({
+            "item_name": entry["item"],
+            "category": general_category,
+            "custom_category": custom_category,
+            "color": entry["color"],
+            "tags": entry["tags"],
+        })
+    summary = ", ".join(f"{c['color']} {c['item_name']}" for c in clothing)
+    return {"summary": summary, "items": clothing}
+
+
+class ProviderStats:
+    """
+    Rolling latency and error window for one provider.
+    """
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+
+    def record(self, latency_ms: float, ok: bool):
+        self.latencies.append(latency_ms)
+        self.outcomes.append(ok)
+
+    def percentile(self, pct: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def healthy(self) -> bool:
+        # Too few samples to judge: assume healthy so the provider gets traffic
+        if len(self.outcomes) < settings.VISION_MIN_SAMPLES:
+            return True
+        return self.error_rate <= settings.VISION_MAX_ERROR_RATE
+
+    def snapshot(self) -> dict:
+        return {
+            "samples": len(self.latencies),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "error_rate": self.error_rate,
+            "healthy": self.healthy(),
+        }
+
+
+class VisionProvider:
+    name = ""
+
+    @property
+    def available(self) -> bool:
+        return False
+
+    async def analyze(self, image_data: bytes):
+        """Returns an OutfitAnalysis dict, or None on failure."""
+        raise NotImplementedError
+
+
+class GeminiVisionProvider(VisionProvider):
+    name = "gemini"
+
+    @property
+    def available(self) -> bool:
+        return gemini_service.client is not None
+
+    async def analyze(self, image_data: bytes):
+        return await gemini_service.analyze_image(image_data=image_data)
+
+
+class MoondreamVisionProvider(VisionProvider):
+    name = "moondream"
+
+    def __init__(self):
+        try:
+            from app.services.moondream_service import moondream_service
+            self.service = moondream_service
+        except ImportError as e:
+            logger.warning(f"Moondream provider disabled: {e}")
+            self.service = None
+
+    @property
+    def available(self) -> bool:
+        return self.service is not None and self.service.model is not None
+
+    async def analyze(self, image_data: bytes):
+        # The SDK is blocking. A cancelled hedge abandons the thread rather than stopping it
+        items = await asyncio.to_thread(self.service.analyze_garment, image_data)
+        if not items:
+            return None
+        return normalize_moondream_items(items)
+
+
+PROVIDERS = {
+    "gemini": GeminiVisionProvider,
+    "moondream": MoondreamVisionProvider,
+}
+
+
+class VisionRouter:
+    """
+    Sends garment analysis to the fastest healthy provider (by rolling p50).
+    If it has not answered after VISION_HEDGE_DELAY_SECONDS (or fails first),
+    the next provider is started as a hedge; the first good answer wins and
+    the other request is cancelled.
+    """
+    def __init__(self, provider_names: list):
+        self.providers = [PROVIDERS[name]() for name in provider_names if name in PROVIDERS]
+        self.stats = {p.name: ProviderStats(settings.VISION_STATS_WINDOW) for p in self.providers}
+        self.hedge_delay = settings.VISION_HEDGE_DELAY_SECONDS
+        self.counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failed": 0}
+
+    def ranked(self) -> list:
+        candidates = [p for p in self.providers if p.available]
+        order = {p.name: i for i, p in enumerate(self.providers)}
+
+        def key(provider):
+            stats = self.stats[provider.name]
+            p50 = stats.percentile(0.5)
+            # Unhealthy last; unmeasured providers keep their configured order at the front
+            return (not stats.healthy(), p50 is not None, p50 or 0.0, order[provider.name])
+
+        return sorted(candidates, key=key)
+
+    async def _timed(self, provider: VisionProvider, image_data: bytes):
+        start = time.monotonic()
+        try:
+            # A cancelled hedge records nothing: its latency is unknown, not a success
+            result = await provider.analyze(image_data)
+        except Exception as e:
+            logger.error(f"Vision provider {provider.name} failed: {e}")
+            result = None
+        self.stats[provider.name].record((time.monotonic() - start) * 1000, result is not None)
+        return result
+
+    async def analyze(self, image_data: bytes) -> tuple:
+        """
+        Returns (OutfitAnalysis or None, provider name or None).
+        """
+        self.counters["requests"] += 1
+        ranked = self.ranked()
+        if not ranked:
+            logger.error("No vision provider available.")
+            self.counters["failed"] += 1
+            return None, None
+
+        primary = ranked[0]
+        tasks = {asyncio.create_task(self._timed(primary, image_data)): primary}
+        backups = ranked[1:] if settings.VISION_HEDGING_ENABLED else []
+
+        try:
+            while tasks:
+                timeout = self.hedge_delay if backups else None
+                done, _ = await asyncio.wait(tasks.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    provider = tasks.pop(task)
+                    result = task.result()
+                    if result is not None:
+                        if provider is not primary:
+                            self.counters["hedge_wins"] += 1
+                        return result, provider.name
+
+                # Timed out waiting, or everything in flight failed: start the next provider
+                if backups and (not done or not tasks):
+                    hedge = backups.pop(0)
+                    self.counters["hedged"] += 1
+                    logger.info(f"Hedging vision request to {hedge.name}")
+                    tasks[asyncio.create_task(self._timed(hedge, image_data))] = hedge
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        self.counters["failed"] += 1
+        return None, None
+
+    def snapshot(self) -> dict:
+        return {
+            **self.counters,
+            "order": [p.name for p in self.ranked()],
+            "providers": {name: stats.snapshot() for name, stats in self.stats.items()},
+        }
+
+
+vision_router = VisionRouter([name.strip() for name in settings.VISION_PROVIDERS.split(",") if name.strip()])
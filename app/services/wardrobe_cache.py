@@ -0,0 +1,220 @@
+import collections
+import json
+import logging
+import time
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryWardrobeCacheBackend:
+    """Per-process LRU of user_id -> item list, with a TTL per entry."""
+    # Read-modify-write is atomic here (no awaits in between), so writes can patch entries
+    supports_patch = True
+
+    def __init__(self, ttl_seconds: float, max_users: int):
+        self.ttl = ttl_seconds
+        self.max_users = max_users
+        self._entries = collections.OrderedDict()  # user_id -> (expires, items)
+        # Generations are ticks of one counter, kept for the most recently written users.
+        # Forgotten users report the highest evicted tick, which is never below
+        # anything they held, so a read that started before an eviction cannot store.
+        self._generations = collections.OrderedDict()
+        self._tick = 0
+        self._floor = 0
+
+    async def generation(self, user_id: str) -> int:
+        return self._generations.get(user_id, self._floor)
+
+    async def bump(self, user_id: str) -> int:
+        self._tick += 1
+        self._generations[user_id] = self._tick
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > self.max_users:
+            _, evicted = self._generations.popitem(last=False)
+            self._floor = max(self._floor, evicted)
+        return self._tick
+
+    async def get(self, user_id: str):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires, items = entry
+        if expires < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        # Callers enrich items in place; hand out copies
+        return [dict(item) for item in items]
+
+    async def set(self, user_id: str, items: list, generation: int):
+        if generation != await self.generation(user_id):
+            return False
+        self._entries[user_id] = (time.monotonic() + self.ttl, [dict(item) for item in items])
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+        return True
+
+    async def invalidate(self, user_id: str):
+        await self.bump(user_id)
+        self._entries.pop(user_id, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisWardrobeCacheBackend:
+    """
+    Shared cache for multi-worker deployments (needs the `redis` package).
+    The generation is a per-user version key in Redis, and stores are a
+    WATCH/MULTI compare-and-set against it, so a slow read in one worker
+    cannot overwrite what another worker's write invalidated.
+    """
+    # Concurrent writers in other processes could interleave, so writes invalidate instead
+    supports_patch = False
+
+    def __init__(self, url: str, ttl_seconds: float):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url)
+        self.ttl = ttl_seconds
+        # Outlives any read in flight; an expired version key reads as 0 again
+        self.version_ttl = max(int(ttl_seconds), 1) + 3600
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"wardrobe:{user_id}"
+
+    @staticmethod
+    def _version_key(user_id: str) -> str:
+        return f"wardrobe:{user_id}:version"
+
+    async def generation(self, user_id: str) -> int:
+        return int(await self.redis.get(self._version_key(user_id)) or 0)
+
+    async def get(self, user_id: str):
+        raw = await self.redis.get(self._key(user_id))
+        return json.loads(raw) if raw else None
+
+    async def set(self, user_id: str, items: list, generation: int):
+        from redis.exceptions import WatchError
+        version_key = self._version_key(user_id)
+        async with self.redis.pipeline() as pipe:
+            try:
+                await pipe.watch(version_key)
+                if int(await pipe.get(version_key) or 0) != generation:
+                    return False
+                pipe.multi()
+                pipe.set(self._key(user_id), json.dumps(items), ex=max(int(self.ttl), 1))
+                await pipe.execute()
+                return True
+            except WatchError:
+                # A write bumped the version while we were storing
+                return False
+
+    async def invalidate(self, user_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.incr(self._version_key(user_id))
+            pipe.expire(self._version_key(user_id), self.version_ttl)
+            pipe.delete(self._key(user_id))
+            await pipe.execute()
+
+    def size(self):
+        return None
+
+
+def create_backend():
+    if settings.WARDROBE_CACHE_BACKEND == "redis":
+        try:
+            return RedisWardrobeCacheBackend(settings.WARDROBE_CACHE_REDIS_URL, settings.WARDROBE_CACHE_TTL_SECONDS)
+        except ImportError:
+            logger.warning("WARDROBE_CACHE_BACKEND=redis but the redis package is not installed; using the in-memory cache")
+    return MemoryWardrobeCacheBackend(settings.WARDROBE_CACHE_TTL_SECONDS, settings.WARDROBE_CACHE_MAX_USERS)
+
+
+class WardrobeCache:
+    """
+    Read cache for get_user_wardrobe, kept current by WardrobeService writes:
+    backends that allow it are patched in place, others are invalidated.
+    A per-user generation (owned by the backend) stops a slow read from
+    storing a list that a concurrent write has already made stale.
+    """
+    def __init__(self, backend=None):
+        self.enabled = settings.WARDROBE_CACHE_ENABLED
+        self.backend = backend or create_backend()
+        self.stats = {"hits": 0, "misses": 0, "patches": 0, "invalidations": 0, "stale_sets": 0, "errors": 0}
+
+    async def generation(self, user_id: str):
+        """Token to pass to set() after reading from the database; None disables the store."""
+        if not self.enabled:
+            return None
+        try:
+            return await self.backend.generation(user_id)
+        except Exception as e:
+            logger.error(f"Wardrobe cache generation read failed for {user_id}: {e}")
+            self.stats["errors"] += 1
+            return None
+
+    async def get(self, user_id: str):
+        if not self.enabled:
+            return None
+        try:
+            items = await self.backend.get(user_id)
+        except Exception as e:
+            # A cache outage only costs a database read
+            logger.error(f"Wardrobe cache read failed for {user_id}: {e}")
+            self.stats["errors"] += 1
+            return None
+        self.stats["hits" if items is not None else "misses"] += 1
+        return items
+
+    async def set(self, user_id: str, items: list, generation):
+        if not self.enabled or generation is None:
+            return
+        try:
+            if not await self.backend.set(user_id, items, generation):
+                self.stats["stale_sets"] += 1
+        except Exception as e:
+            logger.error(f"Wardrobe cache write failed for {user_id}: {e}")
+            self.stats["errors"] += 1
+
+    async def invalidate(self, user_id: str):
+        if not self.enabled:
+            return
+        self.stats["invalidations"] += 1
+        try:
+            await self.backend.invalidate(user_id)
+        except Exception as e:
+            logger.error(f"Wardrobe cache invalidation failed for {user_id}: {e}")
+            self.stats["errors"] += 1
+
+    async def patch(self, user_id: str, apply):
+        """Applies `apply(items) -> items` to the cached list, or invalidates it."""
+        if not self.enabled or not getattr(self.backend, "supports_patch", False):
+            return await self.invalidate(user_id)
+        generation = await self.backend.bump(user_id)
+        items = await self.backend.get(user_id)
+        if items is None:
+            return
+        await self.backend.set(user_id, apply(items), generation)
+        self.stats["patches"] += 1
+
+    async def item_created(self, user_id: str, document: dict):
+        # Lists are newest first
+        await self.patch(user_id, lambda items: [document] + [i for i in items if i["$id"] != document["$id"]])
+
+    async def item_updated(self, user_id: str, document: dict):
+        await self.patch(user_id, lambda items: [document if i["$id"] == document["$id"] else i for i in items])
+
+    async def item_deleted(self, user_id: str, item_id: str):
+        await self.patch(user_id, lambda items: [i for i in items if i["$id"] != item_id])
+
+    async def items_deleted(self, user_id: str, item_ids: list):
+        removed = set(item_ids)
+        await self.patch(user_id, lambda items: [i for i in items if i["$id"] not in removed])
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, backend=type(self.backend).__name__, users=self.backend.size())
+
+
+wardrobe_cache = WardrobeCache()
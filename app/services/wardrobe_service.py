@@ -1,20 +1,102 @@
-from app.services.appwrite import get_appwrite_db
+from app.services.appwrite_repository import appwrite_repository
+from app.services.wardrobe_cache import wardrobe_cache
 from app.core.config import settings
 from appwrite.exception import AppwriteException
+import asyncio
 import logging
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# custom_category -> general_category overrides applied to AI analysis
+CUSTOM_CATEGORY_GROUPS = {
+    "top": ["tops", "shirts", "Layer", "active", "ethnic"],
+    "bottom": ["jeans", "trousers", "skirts", "shorts", "ethnic_bottoms", "active_lounge"],
+    "dress": ["oomph", "gown", "Romps"],
+    "footwear": ["heels", "shoes", "sandals"],
+    "bag": ["bags"],
+}
+
+# Attributes read by the API and in-app consumers. Listings select only these;
+# system attributes and the stored image_url are dropped.
+WARDROBE_ITEM_ATTRIBUTES = [
+    "user_id", "image_id", "general_category", "specific_category", "custom_category",
+    "tags", "colors", "caption", "add_date"
+]
+# Only present once appwrite_db_scripts/wardrobe.py has added them; Appwrite
+# rejects a select of an unknown attribute
+UPLOAD_HASH_ATTRIBUTES = ["content_hash", "perceptual_hash"]
+
+def item_attributes() -> list:
+    """Attributes for full wardrobe reads (upload hashes only when they are stored)."""
+    if settings.UPLOAD_DEDUP_STORE_HASHES:
+        return WARDROBE_ITEM_ATTRIBUTES + UPLOAD_HASH_ATTRIBUTES
+    return WARDROBE_ITEM_ATTRIBUTES
+
+def project_document(document: dict, attributes: list = None) -> dict:
+    """Keeps `$id` and the given attributes (Appwrite returns system attributes regardless of Query.select)."""
+    attributes = attributes or item_attributes()
+    projected = {"$id": document["$id"]}
+    for name in attributes:
+        if name in document:
+            projected[name] = document[name]
+    return projected
+
+def analysis_to_updates(analysis_result: dict) -> dict:
+    """
+    Maps a Gemini OutfitAnalysis onto wardrobe document attributes.
+    Only the first detected item is used.
+    """
+    updates = {}
+    if not analysis_result:
+        return updates
+
+    # Map 'summary' -> 'caption'
+    if "summary" in analysis_result:
+        updates["caption"] = analysis_result["summary"]
+
+    items = analysis_result.get("items") or []
+    if not items:
+        return updates
+    first_item = items[0]
+
+    # Map 'item_name' -> 'specific_category'
+    if "item_name" in first_item:
+        updates["specific_category"] = first_item["item_name"]
+
+    # Map 'category' -> 'general_category' (Update existing)
+    if "category" in first_item:
+        updates["general_category"] = first_item["category"]
+
+    # "tags" is a string attribute (128 chars) in the wardrobe schema, not an array. So we must join them.
+    if "tags" in first_item and isinstance(first_item["tags"], list):
+        updates["tags"] = ",".join(first_item["tags"])
+
+    # Map 'color' -> 'colors' (Wardrobe has 'colors' as array=True)
+    if "color" in first_item:
+        updates["colors"] = [first_item["color"]]
+
+    # Map 'custom_category' -> 'custom_category' and FORCE the matching general_category
+    if "custom_category" in first_item:
+        c_cat = first_item["custom_category"]
+        updates["custom_category"] = c_cat
+        for general_category, custom_categories in CUSTOM_CATEGORY_GROUPS.items():
+            if c_cat in custom_categories:
+                updates["general_category"] = general_category
+                break
+
+    return updates
+
 class WardrobeService:
     def __init__(self):
-        self.db = get_appwrite_db()
+        self.db = appwrite_repository
         self.db_id = settings.APPWRITE_DATABASE_ID
         self.coll_id = "wardrobe"
 
-    def create_wardrobe_item(self, user_id: str, image_id: str, image_url: str = None, category: str = "Uncategorized"):
+    async def create_wardrobe_item(self, user_id: str, image_id: str, image_url: str = None, category: str = "Uncategorized", document_id: str = "unique()", extra: dict = None):
         """
         Creates a new wardrobe item.
+        `extra` holds additional attributes (e.g. cloned analysis, upload hashes).
         """
         try:
             data = {
@@ -24,121 +106,227 @@ class WardrobeService:
                 "general_category": category,
                 "add_date": datetime.now().isoformat()
             }
+            if extra:
+                data.update(extra)
             
-            result = self.db.create_document(
+            result = await self.db.create_document(
                 database_id=self.db_id,
                 collection_id=self.coll_id,
-                document_id="unique()",
+                document_id=document_id,
                 data=data
             )
+            await wardrobe_cache.item_created(user_id, project_document(result))
             return result
         except AppwriteException as e:
             logger.error(f"Error creating wardrobe item: {e}")
             raise e
 
-    def get_user_wardrobe(self, user_id: str):
+    async def _fetch_page(self, user_id: str, limit: int, cursor: str = None, attributes: list = None):
+        from appwrite.query import Query
+        attributes = attributes or item_attributes()
+        queries = [
+            Query.equal("user_id", user_id),
+            Query.select(attributes),
+            Query.order_desc("add_date"), # Newest first
+            Query.limit(limit)
+        ]
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        response = await self.db.list_documents(
+            database_id=self.db_id,
+            collection_id=self.coll_id,
+            queries=queries
+        )
+        documents = [project_document(document, attributes) for document in response["documents"]]
+        # A short page is the last one
+        next_cursor = documents[-1]["$id"] if len(documents) == limit else None
+        return documents, next_cursor
+
+    async def get_user_wardrobe(self, user_id: str):
         """
-        Retrieves all wardrobe items for a specific user.
+        Retrieves all wardrobe items for a specific user (every page).
+        Served from the per-user wardrobe cache when possible.
         """
-        from appwrite.query import Query
+        cached = await wardrobe_cache.get(user_id)
+        if cached is not None:
+            return cached
+        generation = await wardrobe_cache.generation(user_id)
         try:
-            response = self.db.list_documents(
-                database_id=self.db_id,
-                collection_id=self.coll_id,
-                queries=[
-                    Query.equal("user_id", user_id),
-                    Query.order_desc("add_date"), # Newest first
-                    Query.limit(1000) # Retrieve up to 1000 items (Appwrite default is 25)
-                ]
-            )
-            return response["documents"]
+            documents, cursor = [], None
+            while True:
+                page, cursor = await self._fetch_page(user_id, settings.WARDROBE_FETCH_PAGE_SIZE, cursor)
+                documents += page
+                if cursor is None:
+                    break
+            await wardrobe_cache.set(user_id, documents, generation)
+            return documents
         except AppwriteException as e:
-            logger.error(f"Error fetching wardrobe for user {user_id}: {e}")
             logger.error(f"Error fetching wardrobe for user {user_id}: {e}")
             return []
 
-    def delete_wardrobe_item(self, user_id: str, item_id: str):
+    async def list_wardrobe_page(self, user_id: str, limit: int, cursor: str = None, attributes: list = None):
         """
-        Deletes a wardrobe item, its image, and unlinks from user.
+        One page of a user's wardrobe (newest first) and the cursor for the
+        next page (None after the last). Sliced from the cached list when
+        there is one, otherwise only `attributes` are selected.
+        Raises AppwriteException (e.g. for an unknown cursor).
+        """
+        cached = await wardrobe_cache.get(user_id)
+        if cached is not None:
+            ids = [item["$id"] for item in cached]
+            if not cursor or cursor in ids:
+                start = ids.index(cursor) + 1 if cursor else 0
+                page = cached[start:start + limit]
+                next_cursor = page[-1]["$id"] if page and start + limit < len(cached) else None
+                return page, next_cursor
+        return await self._fetch_page(user_id, limit, cursor, attributes)
+
+    async def iter_wardrobe_pages(self, user_id: str, limit: int, cursor: str = None, attributes: list = None):
+        """Yields pages until the end of the wardrobe; only one page is held at a time."""
+        while True:
+            page, cursor = await self.list_wardrobe_page(user_id, limit, cursor, attributes)
+            if page:
+                yield page
+            if cursor is None:
+                return
+
+    async def _resolve_items(self, item_ids: list) -> dict:
+        """
+        Maps each requested ID (document ID or, as a fallback, image ID) to
+        its wardrobe document: one `$id` query, then one `image_id` query for
+        whatever is left (in chunks of 100, Appwrite's limit per equal()).
+        """
+        from appwrite.query import Query
+        resolved = {}
+        for attribute in ("$id", "image_id"):
+            pending = [item_id for item_id in item_ids if item_id not in resolved]
+            for start in range(0, len(pending), 100):
+                chunk = pending[start:start + 100]
+                res = await self.db.list_documents(
+                    self.db_id,
+                    self.coll_id,
+                    [Query.equal(attribute, chunk), Query.limit(len(chunk))]
+                )
+                for document in res["documents"]:
+                    resolved[document[attribute]] = document
+        return resolved
+
+    async def delete_wardrobe_items(self, user_id: str, item_ids: list) -> dict:
+        """
+        Deletes several wardrobe items, their images, and unlinks them from
+        the user with a single wardrobe_id_list update.
+        Returns {requested_id: {"status": "deleted" | "not_found" | "forbidden" | "failed", ...}};
+        a failed image delete is "failed" with document_deleted=True.
         """
         from app.services.appwrite_storage import delete_image
+        from app.services.image_derivatives import derivative_generator, derivative_file_id
+        from app.services.proxy_cache import proxy_cache
+        from app.services.upload_dedup import upload_hash_index
         from app.services.user_service import user_service
-        from app.core.config import settings
 
+        item_ids = list(dict.fromkeys(item_ids))
+        results = {}
+
+        # 1. Resolve every ID up front
         try:
-            # 1. Fetch Item to get details (Image ID)
-            print(f"WS: Fetching item {item_id} for deletion...")
-            try:
-                print(f"WS: Attempting to get document with ID: {item_id}")
-                item = self.db.get_document(self.db_id, self.coll_id, item_id)
-                print(f"WS: Item found via Doc ID. Owner: {item.get('user_id')}")
-            except AppwriteException as e:
-                print(f"WS: Item {item_id} NOT found by Doc ID. Error: {e}")
-                print(f"WS: Checking if {item_id} is an Image ID...")
-                # Fallback: Check if item_id is actually an image_id
-                from appwrite.query import Query
-                try:
-                    res = self.db.list_documents(
-                        self.db_id, 
-                        self.coll_id, 
-                        [Query.equal("image_id", item_id)]
-                    )
-                    if res["total"] > 0:
-                        item = res["documents"][0]
-                        # Important: switch item_id to the actual document ID
-                        print(f"WS: Found item via Image ID! Swapping {item_id} -> {item['$id']}")
-                        item_id = item['$id'] 
-                    else:
-                        print(f"WS: Item not found by ID or Image ID.")
-                        return False
-                except Exception as ex:
-                    print(f"WS: Error searching by Image ID: {ex}")
-                    return False
-            
-            # Verify ownership
-            if item.get("user_id") != user_id:
-                print(f"WS: Ownership mismatch! Request User: {user_id}, Item Owner: {item.get('user_id')}")
-                logger.warning(f"User {user_id} attempted to delete non-owned item {item_id}")
-                return False
+            resolved = await self._resolve_items(item_ids)
+        except AppwriteException as e:
+            logger.error(f"Error resolving wardrobe items {item_ids}: {e}")
+            return {item_id: {"status": "failed", "message": str(e)} for item_id in item_ids}
 
-            # 2. Delete Image from Storage
-            image_id = item.get("image_id")
-            wardrobe_bucket = settings.APPWRITE_WARDROBE_BUCKET_ID
-            print(f"WS: Deleting Image {image_id} from bucket {wardrobe_bucket}...")
-            
-            if image_id and wardrobe_bucket:
-                delete_image(wardrobe_bucket, image_id)
+        items = {}  # requested ID -> owned document
+        aliases = {}  # requested ID -> requested ID of the same document
+        for item_id in item_ids:
+            item = resolved.get(item_id)
+            if item is None:
+                print(f"WS: Item {item_id} not found by ID or Image ID.")
+                results[item_id] = {"status": "not_found"}
+            elif item.get("user_id") != user_id:
+                print(f"WS: Ownership mismatch! Request User: {user_id}, Item Owner: {item.get('user_id')}")
+                logger.warning(f"User {user_id} attempted to delete non-owned item {item['$id']}")
+                results[item_id] = {"status": "forbidden"}
+            elif any(other["$id"] == item["$id"] for other in items.values()):
+                # Same document requested by doc ID and image ID; delete it once
+                aliases[item_id] = next(key for key, other in items.items() if other["$id"] == item["$id"])
             else:
-                print("WS: No image_id or bucket_id found, skipping storage delete.")
+                items[item_id] = item
 
-            # 3. Unlink from User
-            print(f"WS: Unlinking item {item_id} from user {user_id}...")
-            user_service.remove_wardrobe_item(user_id, item_id)
+        semaphore = asyncio.Semaphore(settings.WARDROBE_DELETE_CONCURRENCY)
+        wardrobe_bucket = settings.APPWRITE_WARDROBE_BUCKET_ID
 
-            # 4. Delete Wardrobe Document
-            print(f"WS: Deleting document {item_id}...")
-            self.db.delete_document(self.db_id, self.coll_id, item_id)
-            print(f"WS: Document deleted.")
-            
-            return True
+        # 2. Delete the documents
+        async def remove_document(item_id: str, document_id: str):
+            async with semaphore:
+                try:
+                    await self.db.delete_document(self.db_id, self.coll_id, document_id)
+                    results[item_id] = {"status": "deleted", "id": document_id}
+                except AppwriteException as e:
+                    logger.error(f"Error deleting wardrobe item {document_id}: {e}")
+                    results[item_id] = {"status": "failed", "id": document_id, "message": str(e)}
 
-        except AppwriteException as e:
-            print(f"WS: Exception during deletion: {e}")
-            logger.error(f"Error deleting wardrobe item {item_id}: {e}")
-            return False
+        await asyncio.gather(*(remove_document(item_id, item["$id"]) for item_id, item in items.items()))
+        # Documents that are gone, whatever happens to their images below
+        deleted = [results[item_id]["id"] for item_id in items if results[item_id]["status"] == "deleted"]
+
+        # 3. Delete the images (and their derivatives) of deleted documents only,
+        # so a failed document never points at a missing file
+        async def remove_image(item_id: str, image_id: str):
+            async with semaphore:
+                image_deleted, derivatives_deleted = await asyncio.gather(
+                    delete_image(wardrobe_bucket, image_id, missing_ok=True),
+                    derivative_generator.delete(wardrobe_bucket, image_id)
+                )
+            for file_id in [image_id] + [derivative_file_id(image_id, size) for size in settings.IMAGE_DERIVATIVES]:
+                proxy_cache.invalidate(wardrobe_bucket, file_id)
+            if not (image_deleted and derivatives_deleted):
+                # Removed from the wardrobe, but files are left in storage
+                results[item_id] = dict(
+                    results[item_id], status="failed", document_deleted=True,
+                    message="Image could not be deleted from storage"
+                )
+
+        if wardrobe_bucket:
+            await asyncio.gather(*(
+                remove_image(item_id, item["image_id"])
+                for item_id, item in items.items()
+                if item.get("image_id") and results[item_id]["status"] == "deleted"
+            ))
+        for alias, item_id in aliases.items():
+            results[alias] = results[item_id]
+
+        # 4. Unlink from the user in one update, and drop them from the caches
+        if deleted:
+            print(f"WS: Unlinking {len(deleted)} items from user {user_id}...")
+            if not await user_service.remove_wardrobe_items(user_id, deleted):
+                logger.error(f"Deleted items {deleted} could not be unlinked from user {user_id}")
+            await wardrobe_cache.items_deleted(user_id, deleted)
+            for document_id in deleted:
+                # Stop deduplicating new uploads against it
+                upload_hash_index.forget(user_id, document_id)
+
+        return {item_id: results[item_id] for item_id in item_ids}
+
+    async def delete_wardrobe_item(self, user_id: str, item_id: str):
+        """
+        Deletes a wardrobe item, its image, and unlinks from user.
+        """
+        results = await self.delete_wardrobe_items(user_id, [item_id])
+        return results[item_id]["status"] == "deleted"
 
-    def update_wardrobe_item(self, item_id: str, updates: dict):
+    async def update_wardrobe_item(self, item_id: str, updates: dict):
         """
         Updates a wardrobe item with new attributes.
         """
         try:
             print(f"WS: Updating item {item_id} with {updates.keys()}")
-            result = self.db.update_document(
+            result = await self.db.update_document(
                 database_id=self.db_id,
                 collection_id=self.coll_id,
                 document_id=item_id,
                 data=updates
             )
+            if result.get("user_id"):
+                await wardrobe_cache.item_updated(result["user_id"], project_document(result))
             return result
         except AppwriteException as e:
             logger.error(f"Error updating wardrobe item {item_id}: {e}")
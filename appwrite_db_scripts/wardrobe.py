@@ -19,3 +19,5 @@ def setup_wardrobe(db_service: Databases, db_id: str):
     create_attr(db_service.create_string_attribute, db_id, coll_id, "caption", 1000, required=False) # AI or User Caption
     create_attr(db_service.create_string_attribute, db_id, coll_id, "custom_category", 128, required=False) # e.g. 'Tops', 'Shirts', 'Layer', etc.
     create_attr(db_service.create_datetime_attribute, db_id, coll_id, "add_date", required=False)
+    create_attr(db_service.create_string_attribute, db_id, coll_id, "content_hash", 64, required=False) # sha256 of the uploaded bytes (dedup)
+    create_attr(db_service.create_string_attribute, db_id, coll_id, "perceptual_hash", 16, required=False) # dHash of the image (near-duplicate dedup)
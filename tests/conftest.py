@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Add project root to path (like the verify_* scripts)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from app.core.config import settings
+from app.services.image_urls import signature, signed_image_url, verify_signature
+
+
+@pytest.fixture(autouse=True)
+def signing(monkeypatch):
+    monkeypatch.setattr(settings, "IMAGE_SIGNING_KEY", "test-key")
+    monkeypatch.setattr(settings, "IMAGE_SIGNED_URL_TTL_SECONDS", 900)
+    monkeypatch.setattr(settings, "IMAGE_SIGNED_URL_BASE", "/proxy/signed")
+
+
+def query(url: str) -> dict:
+    return {name: values[0] for name, values in parse_qs(urlsplit(url).query).items()}
+
+
+def test_expiry_rounds_up_to_a_quarter_of_the_ttl():
+    # Window is 225s: every call within one window gets the same URL
+    first = signed_image_url("bucket", "file", now=1000)
+    assert signed_image_url("bucket", "file", now=1124) == first
+    assert int(query(first)["expires"]) == 2025
+    assert signed_image_url("bucket", "file", now=1125) != first
+
+
+def test_expiry_never_shortens_the_ttl():
+    for now in range(1000, 1500, 37):
+        expires = int(query(signed_image_url("bucket", "file", now=now))["expires"])
+        assert now + 900 <= expires <= now + 900 + 225
+
+
+def test_signed_url_verifies():
+    url = signed_image_url("bucket", "file", size="thumb", now=1000)
+    params = query(url)
+    assert urlsplit(url).path == "/proxy/signed/bucket/file"
+    assert params["size"] == "thumb"
+    assert verify_signature("bucket", "file", "thumb", int(params["expires"]), params["sig"], now=1000)
+
+
+def test_unknown_size_signs_the_original():
+    params = query(signed_image_url("bucket", "file", size="huge", now=1000))
+    assert "size" not in params
+    assert params["sig"] == signature("bucket", "file", None, int(params["expires"]))
+
+
+def test_verify_rejects_tampering_and_expiry():
+    params = query(signed_image_url("bucket", "file", now=1000))
+    expires, sig = int(params["expires"]), params["sig"]
+    assert not verify_signature("bucket", "other", None, expires, sig, now=1000)
+    assert not verify_signature("bucket", "file", "thumb", expires, sig, now=1000)
+    assert not verify_signature("bucket", "file", None, expires + 1, sig, now=1000)
+    assert not verify_signature("bucket", "file", None, expires, sig, now=expires + 1)
+    assert not verify_signature("bucket", "file", None, expires, "", now=1000)
@@ -0,0 +1,63 @@
+import pytest
+from app.services import llm_gateway
+from app.services.llm_gateway import IMAGE_TOKEN_ESTIMATE, LLMGateway, TokenBucket, estimate_tokens, is_rate_limit_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llm_gateway.time, "monotonic", clock)
+    return clock
+
+
+def test_estimate_tokens_text_and_images():
+    assert estimate_tokens(["a" * 40]) == 10
+    assert estimate_tokens(["a" * 40, object(), object()]) == 10 + 2 * IMAGE_TOKEN_ESTIMATE
+    assert estimate_tokens([]) == 0
+
+
+class ApiError(Exception):
+    def __init__(self, code, message=""):
+        super().__init__(message)
+        self.code = code
+
+
+def test_is_rate_limit_error():
+    assert is_rate_limit_error(ApiError(429))
+    assert is_rate_limit_error(Exception("RESOURCE_EXHAUSTED: quota"))
+    assert is_rate_limit_error(Exception("HTTP 429 Too Many Requests"))
+    assert not is_rate_limit_error(ApiError(500, "INTERNAL"))
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.wait_time(60) == 0.0
+    bucket.consume(60)
+    assert bucket.wait_time(10) == pytest.approx(10.0)
+    clock.now += 5
+    assert bucket.wait_time(10) == pytest.approx(5.0)
+
+
+def test_token_bucket_debt_and_oversized_requests(clock):
+    bucket = TokenBucket(per_minute=60)
+    # Under-estimates go negative and are paid back before the next caller
+    bucket.consume(90)
+    assert bucket.wait_time(1) == pytest.approx(31.0)
+    # A request larger than the bucket only waits for a full bucket
+    assert bucket.wait_time(1000) == pytest.approx(90.0)
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    gateway = LLMGateway()
+    gateway.backoff_base, gateway.backoff_max = 1.0, 8.0
+    for attempt, cap in [(0, 1.0), (2, 4.0), (10, 8.0)]:
+        for _ in range(20):
+            assert cap / 2 <= gateway._backoff_delay(attempt) <= cap
@@ -0,0 +1,30 @@
+from app.services.partial_json import PartialJSONObject
+
+
+def test_fields_reported_once_complete():
+    parser = PartialJSONObject()
+    assert parser.feed('{"total_score": 8') == {}
+    assert parser.feed('2, "critique": "Goo') == {"total_score": 82}
+    assert parser.feed('d fit", "breakdown": [') == {"critique": "Good fit"}
+    assert parser.feed('1, 2]}') == {"breakdown": [1, 2]}
+    assert parser.result() == {"total_score": 82, "critique": "Good fit", "breakdown": [1, 2]}
+
+
+def test_escape_split_across_chunks():
+    parser = PartialJSONObject()
+    assert parser.feed('{"quote": "say \\') == {}
+    assert parser.feed('"hi\\"", "accent": "caf\\u00') == {"quote": 'say "hi"'}
+    assert parser.feed('e9"}') == {"accent": "café"}
+
+
+def test_trailing_number_waits_for_more_digits():
+    parser = PartialJSONObject()
+    assert parser.feed('{"score": 1') == {}
+    assert parser.feed('00') == {}
+    assert parser.feed('}') == {"score": 100}
+
+
+def test_text_before_object_is_ignored():
+    parser = PartialJSONObject()
+    assert parser.feed("```json\n") == {}
+    assert parser.feed('{"a": true, ') == {"a": True}
@@ -0,0 +1,28 @@
+import pytest
+from app.api.v1.proxy import parse_byte_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-4", (0, 4)),
+    ("bytes=5-", (5, 9)),
+    ("bytes=5-100", (5, 9)),
+    ("bytes=-3", (7, 9)),
+    ("bytes=-20", (0, 9)),
+    ("bytes=-0", "unsatisfiable"),
+    ("bytes=10-", "unsatisfiable"),
+    ("bytes=4-2", "unsatisfiable"),
+])
+def test_single_ranges(header, expected):
+    assert parse_byte_range(header, 10) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "bytes=0-1,4-5",
+    "bytes=-2, 0-1",
+    "items=0-4",
+    "bytes=a-b",
+])
+def test_ignored_ranges_serve_the_full_body(header):
+    assert parse_byte_range(header, 10) is None
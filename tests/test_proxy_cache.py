@@ -0,0 +1,23 @@
+from app.services.proxy_cache import cache_key, entity_tag, etag_matches
+
+
+def test_entity_tag_is_strong_and_deterministic():
+    tag = entity_tag(cache_key("bucket", "file"))
+    assert tag.startswith('"') and tag.endswith('"')
+    assert tag == entity_tag("bucket/file")
+    assert tag != entity_tag("bucket/other")
+
+
+def test_etag_matches_weak_comparison():
+    tag = entity_tag("bucket/file")
+    assert etag_matches(tag, tag)
+    assert etag_matches(f"W/{tag}", tag)
+    assert etag_matches(f'"other", W/{tag}', tag)
+    assert etag_matches("*", tag)
+
+
+def test_etag_mismatches():
+    tag = entity_tag("bucket/file")
+    assert not etag_matches(None, tag)
+    assert not etag_matches('"other"', tag)
+    assert not etag_matches(tag, None)